@@ -0,0 +1,224 @@
+"""
+date: 2026-10-19
+
+Catalogue des sauvegardes courantes (BACKUP_PATH/catalogue.json) et politique
+de rétention grand-père/père/fils.
+
+Chaque sauvegarde courante (destination par défaut de create_dump, ou copie
+d'un téléchargement diffusé) y est inscrite avec sa taille, sa date et son
+empreinte : la rétention et list_backups lisent le catalogue au lieu de
+parcourir le dossier. Le catalogue est un fichier et non une table, pour ne pas
+revenir en arrière lors de la restauration de la base qu'il décrit. Absent, il
+est reconstruit une fois à partir du dossier.
+
+    ARCHIVES_RETENTION = {"daily": 7, "weekly": 4, "monthly": 12}
+
+garde, pour chaque base, la dernière sauvegarde de chacun des 7 derniers jours,
+des 4 dernières semaines et des 12 derniers mois ayant une sauvegarde. Par
+défaut, 60 sauvegardes quotidiennes.
+"""
+import datetime
+import fcntl
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+
+from base_archives import compression
+
+DEFAULT_RETENTION = {"daily": 60, "weekly": 0, "monthly": 0}
+# period -> key of a date within this period
+PERIODS = {
+    "daily": lambda date: date.isoformat(),
+    "weekly": lambda date: "%d-W%02d" % date.isocalendar()[:2],
+    "monthly": lambda date: date.strftime("%Y-%m"),
+}
+
+
+def get_retention() -> dict:
+    retention = dict(DEFAULT_RETENTION)
+    configured = getattr(settings, "ARCHIVES_RETENTION", None) or {}
+    unknown = set(configured) - set(PERIODS)
+    if unknown:
+        raise ValueError(f"Unknown ARCHIVES_RETENTION keys: {', '.join(sorted(unknown))}")
+    if configured:
+        retention = {period: 0 for period in PERIODS}
+        retention.update(configured)
+    return retention
+
+
+def select_kept(entries: list[dict], retention: dict|None=None) -> dict[str, list[str]]:
+    """
+    Sauvegardes à garder parmi entries (dicts avec "name", "database" et
+    "timestamp"), avec pour chacune les périodes qui la retiennent.
+
+    Pour chaque base et chaque période, la sauvegarde la plus récente de
+    chacune des n dernières périodes (jours, semaines, mois) qui en ont une.
+    """
+    retention = retention or get_retention()
+    kept = {}
+    databases = {}
+    for entry in sorted(entries, key=lambda e: e["timestamp"], reverse=True):
+        databases.setdefault(entry.get("database"), []).append(entry)
+    for newest_first in databases.values():
+        for period, count in retention.items():
+            seen = set()
+            for entry in newest_first:
+                if len(seen) >= count:
+                    break
+                key = PERIODS[period](datetime.date.fromtimestamp(entry["timestamp"]))
+                if key in seen:
+                    continue
+                seen.add(key)
+                kept.setdefault(entry["name"], []).append(period)
+    return kept
+
+
+def database_from_name(name: str) -> str:
+    """
+    Base d'une sauvegarde d'après son nom ({dbname}_backup-{date}.sql...).
+    """
+    return name.rsplit("_backup-", 1)[0]
+
+
+class Catalogue():
+    """
+    Usage :
+
+        with Catalogue.edit() as catalogue:
+            catalogue.record(path, info, "default")
+
+    ou Catalogue.read() pour une simple lecture.
+    """
+
+    def __init__(self, entries: dict[str, dict]):
+        self._entries = entries
+
+    @staticmethod
+    def get_path() -> Path:
+        return settings.BACKUP_PATH / "catalogue.json"
+
+    @classmethod
+    def _load(cls) -> "Catalogue":
+        try:
+            data = json.loads(cls.get_path().read_text())
+        except FileNotFoundError:
+            return cls.scan()
+        return cls({entry["name"]: entry for entry in data["backups"]})
+
+    @classmethod
+    def read(cls) -> "Catalogue":
+        settings.BACKUP_PATH.mkdir(parents=True, exist_ok=True)
+        with open(settings.BACKUP_PATH / ".catalogue.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            return cls._load()
+
+    @classmethod
+    @contextmanager
+    def edit(cls):
+        """
+        Catalogue modifiable, enregistré à la sortie du bloc. Le verrou exclusif
+        est gardé pendant tout le bloc.
+        """
+        settings.BACKUP_PATH.mkdir(parents=True, exist_ok=True)
+        with open(settings.BACKUP_PATH / ".catalogue.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            catalogue = cls._load()
+            yield catalogue
+            catalogue.save()
+
+    @classmethod
+    def scan(cls) -> "Catalogue":
+        """
+        Catalogue reconstruit à partir des fichiers de BACKUP_PATH (et de leurs
+        manifestes).
+        """
+        catalogue = cls({})
+        for path in settings.BACKUP_PATH.glob("*.sql*"):
+            if path.name.endswith((".json", ".tmp", ".part", ".raw")) or not path.is_file():
+                continue
+            try:
+                info = json.loads(compression.get_sidecar_path(path).read_text())
+            except (OSError, ValueError):
+                info = {}
+            stat = path.stat()
+            catalogue.record(path, info, info.get("database"), timestamp=stat.st_mtime)
+        return catalogue
+
+    @classmethod
+    def rebuild(cls) -> "Catalogue":
+        """
+        Remplace le catalogue par celui du dossier, en gardant la date inscrite
+        des sauvegardes déjà connues.
+        """
+        with cls.edit() as catalogue:
+            scanned = cls.scan()
+            for entry in scanned.entries():
+                known = catalogue.get(entry["name"])
+                if known is not None:
+                    entry["timestamp"] = known["timestamp"]
+            catalogue._entries = scanned._entries
+        return catalogue
+
+    def save(self):
+        path = self.get_path()
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps({"backups": self.entries()}, indent=1))
+        tmp.replace(path)
+
+    def entries(self, database: str|None=None) -> list[dict]:
+        """
+        Sauvegardes, de la plus ancienne à la plus récente.
+        """
+        entries = sorted(self._entries.values(), key=lambda e: e["timestamp"])
+        if database is not None:
+            entries = [e for e in entries if e["database"] == database]
+        return entries
+
+    def get(self, name: str) -> dict|None:
+        return self._entries.get(name)
+
+    def record(self, path: Path, info: dict, database: str|None=None,
+            timestamp: float|None=None) -> dict:
+        """
+        Inscrit (ou met à jour) la sauvegarde path. info vient du manifeste
+        (compression.write_sidecar).
+        """
+        path = Path(path)
+        entry = {
+            "name": path.name,
+            "database": database or database_from_name(path.name),
+            "timestamp": timestamp or time.time(),
+            "size": info.get("size", path.stat().st_size if path.exists() else 0),
+            "sha256": info.get("sha256"),
+            "codec": info.get("codec"),
+        }
+        self._entries[entry["name"]] = entry
+        return entry
+
+    def remove(self, name: str):
+        self._entries.pop(name, None)
+
+    def apply_retention(self, retention: dict|None=None) -> list[dict]:
+        """
+        Supprime les sauvegardes que la politique de rétention ne garde pas
+        (fichier et manifeste) et renvoie leurs entrées.
+        """
+        kept = select_kept(self.entries(), retention)
+        deleted = []
+        for entry in self.entries():
+            if entry["name"] in kept:
+                continue
+            path = settings.BACKUP_PATH / entry["name"]
+            path.unlink(missing_ok=True)
+            compression.get_sidecar_path(path).unlink(missing_ok=True)
+            self.remove(entry["name"])
+            deleted.append(entry)
+        return deleted
+
+
+def record_backup(path: Path, info: dict, database: str):
+    with Catalogue.edit() as catalogue:
+        catalogue.record(path, info, database)
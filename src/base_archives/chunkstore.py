@@ -0,0 +1,345 @@
+"""
+date: 2026-10-19
+
+Magasin de sauvegardes dédupliquées.
+
+Chaque sauvegarde est découpée en morceaux délimités par leur contenu (hachage
+glissant « gear », comme FastCDC) : une modification au milieu d'une sauvegarde
+ne déplace que les limites voisines, les morceaux suivants restent identiques
+d'une nuit à l'autre. Chaque morceau est stocké une seule fois, sous son
+empreinte sha256 :
+
+    ARCHIVES_CHUNK_STORE/           (par défaut BACKUP_PATH/store)
+        chunks/ab/abcdef....        morceaux
+        manifests/<nom>.json        liste ordonnée des morceaux d'une sauvegarde
+
+La restauration réassemble les morceaux en vérifiant chaque empreinte, puis
+celle du fichier entier. Supprimer une sauvegarde ne supprime que son
+manifeste ; collect_garbage efface ensuite les morceaux que plus aucun
+manifeste ne référence. La rétention est celle des sauvegardes courantes
+(ARCHIVES_RETENTION, voir base_archives.catalogue).
+
+Le découpage est vectorisé avec numpy s'il est installé (environ 90 Mo/s avec
+la taille par défaut). Sans numpy, il est fait en Python, octet par octet
+(environ 6 Mo/s), pour les ARCHIVES_CHUNK_CDC_LIMIT premiers octets seulement
+(256 Mio par défaut) ; la suite est découpée en morceaux de taille fixe, qui ne
+se dédupliquent plus après une insertion. Les deux calculs donnent les mêmes
+limites. Les min_size premiers octets de chaque morceau ne sont pas hachés. Le
+découpage se fait sans le verrou du magasin, pris seulement pour publier le
+manifeste.
+
+Une sauvegarde compressée ne se déduplique pas : une modification change tout
+le flux compressé qui la suit. Les sauvegardes destinées au magasin ne sont
+donc compressées ni par base_archives.compression ni par la commande (fragment
+"store" de DB_BACKUP_COMMANDS, "-Z 0" pour pg_dump -F c).
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from base_archives.catalogue import database_from_name, select_kept
+
+BLOCK_SIZE = 1024 * 1024
+_MASK64 = (1 << 64) - 1
+# the gear hash only depends on the last 64 bytes
+_WINDOW = 64
+# fixed table, chunk boundaries must not change between runs
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+_GEAR_ARRAY = numpy.array(GEAR, dtype=numpy.uint64) if numpy is not None else None
+# positions hashed at once by _cut_point_numpy
+_SEGMENT = 64 * 1024
+# interrupted writes, left in chunk_dir
+_TMP_MAX_AGE = 24 * 3600
+_NAME_RE = re.compile(r"^[\w.-]+$")
+
+
+class ChunkStoreError(Exception):
+    pass
+
+
+def get_store_root() -> Path:
+    root = getattr(settings, "ARCHIVES_CHUNK_STORE", None)
+    return Path(root) if root else settings.BACKUP_PATH / "store"
+
+
+def get_chunk_sizes(avg_size: int|None=None) -> tuple[int, int, int]:
+    """
+    (min, moyenne, max) des tailles de morceaux, à partir de
+    ARCHIVES_CHUNK_AVG_SIZE (1 Mio par défaut, arrondi à une puissance de 2).
+    """
+    avg_size = avg_size or getattr(settings, "ARCHIVES_CHUNK_AVG_SIZE", 1024 * 1024)
+    avg_size = 1 << max(avg_size.bit_length() - 1, 8)
+    return avg_size // 4, avg_size, avg_size * 4
+
+
+def _cut_point(buf: bytearray, min_size: int, max_size: int, mask: int) -> int:
+    """
+    Longueur du premier morceau de buf.
+    """
+    end = min(len(buf), max_size)
+    if end <= min_size:
+        return end
+    if numpy is not None:
+        return _cut_point_numpy(buf, min_size, end, mask)
+    gear = GEAR
+    h = 0
+    for i in range(max(min_size - _WINDOW, 0), min_size):
+        h = ((h << 1) + gear[buf[i]]) & _MASK64
+    for i in range(min_size, end):
+        h = ((h << 1) + gear[buf[i]]) & _MASK64
+        if not h & mask:
+            return i + 1
+    return end
+
+
+def _cut_point_numpy(buf: bytearray, min_size: int, end: int, mask: int) -> int:
+    """
+    _cut_point, avec numpy. Le hachage en i est la somme des gear[buf[i - k]] << k
+    pour k < 64 : il est calculé pour un segment de positions à la fois, en
+    doublant la fenêtre à chaque étape.
+    """
+    data = numpy.frombuffer(buf, dtype=numpy.uint8, count=end)
+    mask = numpy.uint64(mask)
+    # about the average size : the cut is often in the first segment
+    segment = min(4 * min_size, _SEGMENT)
+    for seg_start in range(min_size, end, segment):
+        seg_end = min(seg_start + segment, end)
+        start = max(seg_start - _WINDOW + 1, 0)
+        h = _GEAR_ARRAY[data[start:seg_end]]
+        step = 1
+        while step < _WINDOW:
+            h[step:] += h[:-step] << numpy.uint64(step)
+            step *= 2
+        cuts = numpy.flatnonzero((h[seg_start - start:] & mask) == 0)
+        if len(cuts):
+            return seg_start + int(cuts[0]) + 1
+    return end
+
+
+def iter_chunks(f, avg_size: int|None=None):
+    """
+    Generate the content defined chunks of the binary file f (fixed size ones
+    past ARCHIVES_CHUNK_CDC_LIMIT bytes without numpy).
+    """
+    min_size, avg_size, max_size = get_chunk_sizes(avg_size)
+    cdc_limit = None
+    if numpy is None:
+        cdc_limit = getattr(settings, "ARCHIVES_CHUNK_CDC_LIMIT", 256 * 1024 * 1024)
+    position = 0
+    bits = avg_size.bit_length() - 1
+    # high bits : they depend on the whole window
+    mask = ((1 << bits) - 1) << (64 - bits)
+    buf = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buf) < max_size:
+            block = f.read(BLOCK_SIZE)
+            if block:
+                buf += block
+            else:
+                eof = True
+        if not buf:
+            return
+        if cdc_limit is not None and position >= cdc_limit:
+            n = min(len(buf), avg_size)
+        else:
+            n = _cut_point(buf, min_size, max_size, mask)
+        yield bytes(buf[:n])
+        del buf[:n]
+        position += n
+
+
+class ChunkStore():
+
+    def __init__(self, root: Path|None=None):
+        self.root = Path(root) if root else get_store_root()
+        self.chunk_dir = self.root / "chunks"
+        self.manifest_dir = self.root / "manifests"
+        self.chunk_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+
+    def _lock(self, kind=fcntl.LOCK_EX):
+        """
+        Verrou du magasin : collect_garbage ne doit pas effacer les morceaux
+        d'une sauvegarde en cours d'écriture, dont le manifeste n'existe pas
+        encore.
+        """
+        f = open(self.root / ".lock", "a")
+        fcntl.flock(f, kind)
+        return f
+
+    def chunk_path(self, digest: str) -> Path:
+        return self.chunk_dir / digest[:2] / digest
+
+    def manifest_path(self, name: str) -> Path:
+        if not _NAME_RE.match(name):
+            raise ChunkStoreError(f"Invalid backup name {name!r}")
+        return self.manifest_dir / f"{name}.json"
+
+    def _write_chunks(self, path: Path, avg_size: int|None=None, only: set|None=None):
+        """
+        Découpe le fichier path et écrit ses morceaux absents du magasin (ceux
+        de only seulement, s'il est donné). Renvoie l'empreinte du fichier, la
+        liste [empreinte, taille] de ses morceaux, le nombre et la taille des
+        morceaux écrits.
+        """
+        digest = hashlib.sha256()
+        chunks = []
+        new_chunks = new_bytes = 0
+        with open(path, "rb") as f:
+            for chunk in iter_chunks(f, avg_size):
+                digest.update(chunk)
+                chunk_digest = hashlib.sha256(chunk).hexdigest()
+                chunks.append([chunk_digest, len(chunk)])
+                chunk_path = self.chunk_path(chunk_digest)
+                if (only is not None and chunk_digest not in only) or chunk_path.exists():
+                    continue
+                chunk_path.parent.mkdir(exist_ok=True)
+                tmp = chunk_path.with_name(f"{chunk_path.name}.{os.getpid()}.tmp")
+                tmp.write_bytes(chunk)
+                tmp.replace(chunk_path)
+                new_chunks += 1
+                new_bytes += len(chunk)
+        return digest.hexdigest(), chunks, new_chunks, new_bytes
+
+    def put(self, name: str, path: Path, avg_size: int|None=None) -> dict:
+        """
+        Enregistre le fichier path sous le nom name (remplace une sauvegarde du
+        même nom) et renvoie son manifeste, complété par le nombre et la taille
+        des morceaux nouveaux ("new_chunks", "new_bytes").
+
+        Les morceaux sont écrits sans le verrou : un collect_garbage lancé
+        entre-temps a pu effacer ceux que le manifeste, pas encore publié, ne
+        protégeait pas. Ils sont vérifiés, et réécrits au besoin, sous le verrou.
+        """
+        manifest_path = self.manifest_path(name)
+        sha256, chunks, new_chunks, new_bytes = self._write_chunks(path, avg_size)
+        manifest = {
+            "name": name,
+            "timestamp": time.time(),
+            "size": sum(size for _, size in chunks),
+            "sha256": sha256,
+            "chunks": chunks,
+        }
+        with self._lock():
+            missing = {
+                chunk_digest for chunk_digest, _ in chunks
+                if not self.chunk_path(chunk_digest).exists()}
+            if missing:
+                _, _, rewritten, rewritten_bytes = self._write_chunks(
+                    path, avg_size, only=missing)
+                new_chunks += rewritten
+                new_bytes += rewritten_bytes
+            tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+            tmp.write_text(json.dumps(manifest))
+            tmp.replace(manifest_path)
+        return dict(manifest, new_chunks=new_chunks, new_bytes=new_bytes)
+
+    def get_manifest(self, name: str) -> dict:
+        try:
+            return json.loads(self.manifest_path(name).read_text())
+        except FileNotFoundError:
+            raise ChunkStoreError(f"No backup {name} in the store")
+
+    def manifests(self, strict: bool=False) -> list[dict]:
+        """
+        Manifestes, du plus ancien au plus récent. Un manifeste illisible est
+        ignoré, ou lève ChunkStoreError avec strict.
+        """
+        manifests = []
+        for path in self.manifest_dir.glob("*.json"):
+            try:
+                manifests.append(json.loads(path.read_text()))
+            except (OSError, ValueError) as e:
+                if strict:
+                    raise ChunkStoreError(f"Unreadable manifest {path.name}: {e}")
+        return sorted(manifests, key=lambda m: m["timestamp"])
+
+    def restore(self, name: str, path: Path) -> Path:
+        """
+        Réassemble la sauvegarde name dans path. Une empreinte incorrecte lève
+        ChunkStoreError et ne laisse pas de fichier.
+        """
+        manifest = self.get_manifest(name)
+        path = Path(path)
+        part = path.with_name(path.name + ".part")
+        digest = hashlib.sha256()
+        try:
+            with self._lock(fcntl.LOCK_SH), open(part, "wb") as out:
+                for chunk_digest, size in manifest["chunks"]:
+                    try:
+                        chunk = self.chunk_path(chunk_digest).read_bytes()
+                    except FileNotFoundError:
+                        raise ChunkStoreError(f"Missing chunk {chunk_digest}")
+                    if len(chunk) != size or hashlib.sha256(chunk).hexdigest() != chunk_digest:
+                        raise ChunkStoreError(f"Corrupted chunk {chunk_digest}")
+                    digest.update(chunk)
+                    out.write(chunk)
+            if digest.hexdigest() != manifest["sha256"]:
+                raise ChunkStoreError(f"Checksum mismatch for backup {name}")
+            part.replace(path)
+        finally:
+            part.unlink(missing_ok=True)
+        return path
+
+    def delete(self, name: str):
+        self.manifest_path(name).unlink(missing_ok=True)
+
+    def apply_retention(self, retention: dict|None=None) -> list[str]:
+        """
+        Oublie les sauvegardes que la politique de rétention (voir
+        catalogue.select_kept) ne garde pas, et renvoie leurs noms. Les morceaux
+        sont effacés ensuite par collect_garbage.
+        """
+        entries = [
+            {"name": m["name"], "database": database_from_name(m["name"]), "timestamp": m["timestamp"]}
+            for m in self.manifests()]
+        kept = select_kept(entries, retention)
+        deleted = []
+        for entry in entries:
+            if entry["name"] not in kept:
+                self.delete(entry["name"])
+                deleted.append(entry["name"])
+        return deleted
+
+    def collect_garbage(self) -> tuple[int, int]:
+        """
+        Efface les morceaux qu'aucun manifeste ne référence. Renvoie le nombre et
+        la taille des morceaux effacés.
+        """
+        count = size = 0
+        with self._lock():
+            referenced = set()
+            # an unreadable manifest would lose its chunks
+            for manifest in self.manifests(strict=True):
+                referenced.update(chunk_digest for chunk_digest, _ in manifest["chunks"])
+            tmp_limit = time.time() - _TMP_MAX_AGE
+            for subdir in self.chunk_dir.iterdir():
+                for chunk_path in subdir.iterdir():
+                    if chunk_path.name in referenced:
+                        continue
+                    # being written by a put, outside the lock
+                    if chunk_path.suffix == ".tmp" and chunk_path.stat().st_mtime > tmp_limit:
+                        continue
+                    size += chunk_path.stat().st_size
+                    count += 1
+                    chunk_path.unlink()
+                if not any(subdir.iterdir()):
+                    subdir.rmdir()
+        return count, size
+
+    def disk_usage(self) -> int:
+        return sum(
+            os.path.getsize(chunk_path)
+            for subdir in self.chunk_dir.iterdir() for chunk_path in subdir.iterdir())
@@ -0,0 +1,251 @@
+"""
+date: 2026-10-19
+
+Compression des sauvegardes à la volée, et manifeste (fichier .json à côté de
+la sauvegarde) qui permet de les vérifier sans les restaurer.
+
+Les données sont découpées en blocs de ARCHIVES_COMPRESSION["block_size"]
+octets, compressés en parallèle par un groupe de threads (zlib, bz2 et lzma
+relâchent le GIL) puis écrits dans l'ordre. Chaque bloc est un flux complet :
+la concaténation reste un fichier gzip, bz2 ou xz valide, lisible par les
+outils habituels. Les empreintes sha256 de la sauvegarde brute et du fichier
+écrit sont calculées au passage.
+
+    ARCHIVES_COMPRESSION = {
+        "codec": "gzip",        # gzip, bz2, xz ou none
+        "level": 6,
+        "workers": 4,
+        "block_size": 4 * 1024 * 1024,
+    }
+
+Le format custom de pg_dump (-F c) est déjà compressé : pour en tirer parti,
+désactiver sa compression (-Z 0) dans DB_BACKUP_COMMANDS.
+"""
+import bz2
+import gzip
+import hashlib
+import json
+import lzma
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+# codec -> (compress(data, level), open(path), extension, default level)
+CODECS = {
+    "gzip": (lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+        gzip.open, ".gz", 6),
+    "bz2": (lambda data, level: bz2.compress(data, compresslevel=level), bz2.open, ".bz2", 9),
+    "xz": (lambda data, level: lzma.compress(data, preset=level), lzma.open, ".xz", 6),
+}
+BLOCK_SIZE = 1024 * 1024
+
+
+def get_compression(codec: str|None=None, level: int|None=None) -> dict:
+    """
+    Réglages de compression, ceux de ARCHIVES_COMPRESSION complétés par codec et
+    level s'ils sont donnés. codec vaut None si la compression est désactivée.
+    """
+    config = dict(getattr(settings, "ARCHIVES_COMPRESSION", None) or {})
+    if codec is not None:
+        config["codec"] = codec
+        config.pop("level", None)
+    if level is not None:
+        config["level"] = level
+    codec = config.get("codec")
+    if codec in (None, "", "none"):
+        config["codec"] = None
+        return config
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec {codec}, use one of {', '.join(CODECS)}")
+    config.setdefault("level", CODECS[codec][3])
+    return config
+
+
+def get_extension(codec: str|None) -> str:
+    return CODECS[codec][2] if codec else ""
+
+
+class CompressingWriter():
+    """
+    Fichier binaire en écriture qui compresse ce qu'on y écrit dans f.
+
+    Usage :
+
+        with open(path, "wb") as f, CompressingWriter(f, "gzip") as writer:
+            writer.write(data)
+        writer.info()  # tailles et empreintes
+
+    Sans codec, les données sont écrites telles quelles (et hachées).
+    """
+
+    def __init__(self, f, codec: str|None=None, level: int|None=None,
+            workers: int|None=None, block_size: int|None=None):
+        self.f = f
+        self.codec = codec
+        self.level = level if level is not None or not codec else CODECS[codec][3]
+        self.block_size = block_size or 4 * 1024 * 1024
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.raw_digest = hashlib.sha256()
+        self.digest = hashlib.sha256()
+        self.raw_size = 0
+        self.size = 0
+        self._buffer = bytearray()
+        self._pending = []
+        self._pool = ThreadPoolExecutor(self.workers) if codec else None
+        self.closed = False
+
+    def _emit(self, data: bytes):
+        self.f.write(data)
+        self.digest.update(data)
+        self.size += len(data)
+
+    def _submit(self, block: bytes):
+        compress = CODECS[self.codec][0]
+        self._pending.append(self._pool.submit(compress, block, self.level))
+        # bounded memory : at most two blocks per worker in flight
+        while len(self._pending) > 2 * self.workers:
+            self._emit(self._pending.pop(0).result())
+
+    def write(self, data) -> int:
+        self.raw_digest.update(data)
+        self.raw_size += len(data)
+        if not self.codec:
+            self._emit(data)
+            return len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.codec:
+            if self._buffer or not self.raw_size:
+                # an empty input still gives a valid compressed file
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            for future in self._pending:
+                self._emit(future.result())
+            self._pending = []
+            self._pool.shutdown()
+
+    def abort(self):
+        self.closed = True
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def info(self) -> dict:
+        return {
+            "codec": self.codec,
+            "level": self.level,
+            "size": self.size,
+            "sha256": self.digest.hexdigest(),
+            "raw_size": self.raw_size,
+            "raw_sha256": self.raw_digest.hexdigest(),
+        }
+
+
+def get_codec(path: Path) -> str|None:
+    """
+    Codec d'une sauvegarde, d'après son extension.
+    """
+    for codec, (_, _, extension, _) in CODECS.items():
+        if Path(path).name.endswith(extension):
+            return codec
+    return None
+
+
+def decompress(path: Path, target: Path) -> Path:
+    with CODECS[get_codec(path)][1](path, "rb") as f, open(target, "wb") as out:
+        while block := f.read(BLOCK_SIZE):
+            out.write(block)
+    return target
+
+
+def copy_to(path: Path, writer: CompressingWriter):
+    with open(path, "rb") as f:
+        while block := f.read(BLOCK_SIZE):
+            writer.write(block)
+
+
+def get_sidecar_path(path: Path) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + ".json")
+
+
+def write_sidecar(path: Path, info: dict, **extra):
+    """
+    Manifeste de la sauvegarde path. info vient de CompressingWriter.info.
+    """
+    sidecar = get_sidecar_path(path)
+    tmp = sidecar.with_name(sidecar.name + ".tmp")
+    tmp.write_text(json.dumps(dict(info, file=Path(path).name, **extra), indent=2))
+    tmp.replace(sidecar)
+
+
+def file_sha256(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def checksum_info(path: Path) -> dict:
+    """
+    Comme CompressingWriter.info, pour un fichier non compressé déjà écrit.
+    """
+    size = Path(path).stat().st_size
+    sha256 = file_sha256(path)
+    return {
+        "codec": None,
+        "level": None,
+        "size": size,
+        "sha256": sha256,
+        "raw_size": size,
+        "raw_sha256": sha256,
+    }
+
+
+def verify(path: Path, deep: bool=False) -> str|None:
+    """
+    Vérifie la sauvegarde path d'après son manifeste : None si tout va bien,
+    sinon l'erreur. deep : décompresse aussi la sauvegarde pour vérifier
+    l'empreinte des données brutes.
+    """
+    path = Path(path)
+    try:
+        info = json.loads(get_sidecar_path(path).read_text())
+    except (OSError, ValueError) as e:
+        return f"unreadable manifest: {e}"
+    try:
+        if path.stat().st_size != info["size"]:
+            return f"size {path.stat().st_size} instead of {info['size']}"
+        if file_sha256(path) != info["sha256"]:
+            return "sha256 mismatch"
+        if deep:
+            opener = CODECS[info["codec"]][1] if info["codec"] else open
+            digest = hashlib.sha256()
+            size = 0
+            with opener(path, "rb") as f:
+                while block := f.read(BLOCK_SIZE):
+                    digest.update(block)
+                    size += len(block)
+            if size != info["raw_size"] or digest.hexdigest() != info["raw_sha256"]:
+                return "uncompressed data mismatch"
+    except FileNotFoundError:
+        return "missing backup file"
+    except (OSError, EOFError, lzma.LZMAError, KeyError) as e:
+        return f"unreadable backup: {e}"
+    return None
@@ -1,24 +1,40 @@
 """
 date: 2025-07-02
 """
+import contextlib
 import datetime
+import fcntl
+import json
+import logging
 import shlex
+import shutil
 import subprocess
+import tarfile
+import time
 
 from pathlib import Path
 
 from django.conf import settings
 
+from base_archives import sqlite_backup
+from base_archives.catalogue import record_backup
+from base_archives.compression import (
+    CompressingWriter, checksum_info, copy_to, get_compression, get_extension, write_sidecar)
+from base_archives.fanout import FanOutWriter
+from base_archives.resources import ResourcePolicy, format_rate
+
 PARAMS = ["USER", "NAME", "HOST", "PORT"]
 
+logger = logging.getLogger(__name__)
+
 def get_file_path(dbname: str, path: Path|None=None) -> Path:
     """
     Chemin du fichier de sauvegarde.
 
     `path` permet au consommateur d'imposer sa destination, pour une sauvegarde
     qui ne doit pas suivre le sort des sauvegardes courantes : celles-ci sont
-    datées et effacées au bout de 60 jours par `backup_db.clean_old_backups`,
-    dont le glob (`BACKUP_PATH/*.sql`) ne descend pas dans les sous-dossiers.
+    datées, inscrites au catalogue (voir base_archives.catalogue) et effacées
+    selon la politique de rétention par `backup_db.clean_old_backups`.
     Le dossier parent est créé au besoin, comme pour la destination par défaut.
     """
     if path is not None:
@@ -30,33 +46,493 @@ def get_file_path(dbname: str, path: Path|None=None) -> Path:
         settings.BACKUP_PATH.mkdir(parents=True, exist_ok=True)
     return settings.BACKUP_PATH / f"{dbname}_backup-{timestamp}.sql"
 
-def construct_command(dbname: str, path: Path|None=None) -> list[str]:
+def _get_template(dbname: str, commands: dict, kind: str) -> tuple[dict, dict]:
     db_settings = settings.DATABASES.get(dbname)
     if not db_settings:
         raise ValueError(f"Database '{dbname}' not found in settings.")
 
-    command_template = settings.DB_BACKUP_COMMANDS.get(db_settings['ENGINE'])
+    command_template = commands.get(db_settings['ENGINE'])
     if not command_template:
-        raise ValueError(f"No backup command configured for database engine {db_settings['ENGINE']}.")
+        raise ValueError(f"No {kind} command configured for database engine {db_settings['ENGINE']}.")
+    return db_settings, command_template
 
+def _base_command(command_template: dict, db_settings: dict, jobs: int|None=None) -> list[str]:
     # Build an argv list (no shell) : each template fragment is tokenized with
     # shlex, then each token is formatted individually so substituted values
     # (USER, HOST, FILE, ...) always land in their own argument and can never
     # be re-split or interpreted by a shell.
     command_list = [command_template['command']]
-    if "base" in command_template:
-        command_list.extend(shlex.split(command_template['base']))
+    base = command_template.get("base")
+    if jobs:
+        base = command_template.get("parallel_base", base)
+    if base:
+        command_list.extend(shlex.split(base))
     for param in PARAMS:
         if param in db_settings and db_settings[param]:
             command_list.extend(
                 tok.format(**db_settings) for tok in shlex.split(command_template[param]))
+    if jobs:
+        if "jobs" not in command_template:
+            raise ValueError("No parallel jobs option configured for this database engine.")
+        command_list.extend(
+            tok.format(JOBS=int(jobs)) for tok in shlex.split(command_template["jobs"]))
+    return command_list
+
+def construct_command(dbname: str, path: Path|None=None, stream: bool=False,
+        jobs: int|None=None, store: bool=False) -> list[str]:
+    """
+    Commande de sauvegarde (argv, sans shell).
+
+    Avec stream=True, la sauvegarde est écrite sur la sortie standard : le
+    fragment "output" du modèle est remplacé par le fragment optionnel "stdout"
+    (vide par défaut, pg_dump écrivant sur stdout sans -f).
+
+    Avec jobs, la sauvegarde utilise jobs processus en parallèle : le fragment
+    "parallel_base" remplace "base" (format répertoire pour pg_dump) et le
+    fragment "jobs" est ajouté. path est alors un répertoire.
+
+    Avec store=True, pour le magasin dédupliqué (voir base_archives.chunkstore),
+    le fragment optionnel "store" est ajouté : il désactive la compression de la
+    commande ("-Z 0" pour pg_dump), qui empêcherait la déduplication.
+    """
+    db_settings, command_template = _get_template(dbname, settings.DB_BACKUP_COMMANDS, "backup")
+    if stream and jobs:
+        raise ValueError("A parallel backup cannot be written to standard output.")
+    command_list = _base_command(command_template, db_settings, jobs)
+    if store:
+        command_list.extend(shlex.split(command_template.get("store", "")))
+    if stream:
+        command_list.extend(shlex.split(command_template.get("stdout", "")))
+        return command_list
     FILE = get_file_path(dbname, path)
     command_list.extend(
         tok.format(FILE=FILE) for tok in shlex.split(command_template['output']))
     return command_list
 
-def run_save_command(command: list[str]) -> subprocess.CompletedProcess:
-    return subprocess.run(command, shell=False, check=True)
+def _open_output(output):
+    if isinstance(output, (str, Path)):
+        return open(output, "wb")
+    return contextlib.nullcontext(output)
+
+def run_save_command(command: list[str], policy: ResourcePolicy|None=None,
+        output: Path|None=None) -> subprocess.CompletedProcess:
+    """
+    Lance command selon policy (par défaut ARCHIVES_RESOURCE_POLICY, voir
+    base_archives.resources). Un code de retour non nul lève CalledProcessError,
+    un dépassement du temps maximal TimeoutExpired.
+
+    Avec output (chemin ou fichier ouvert en écriture binaire), la commande
+    écrit sur sa sortie standard (construite avec stream=True) : Python la
+    recopie dans output, au débit maximal de policy.
+    """
+    if policy is None:
+        policy = ResourcePolicy.from_settings()
+    logger.info("Running %s with resource policy: %s", command, policy)
+    start = time.monotonic()
+    process = subprocess.Popen(
+        policy.wrap(command), shell=False, stdout=subprocess.PIPE if output else None)
+    timer = policy.start_timer(process)
+    try:
+        if output is not None:
+            throttle = policy.throttle()
+            chunk_size = getattr(settings, "ARCHIVES_STREAM_CHUNK_SIZE", 1024 * 1024)
+            with process.stdout, _open_output(output) as f:
+                while chunk := process.stdout.read(chunk_size):
+                    f.write(chunk)
+                    if throttle is not None:
+                        throttle(len(chunk))
+        returncode = process.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    if timer is not None and timer.expired:
+        raise subprocess.TimeoutExpired(command, policy.timeout)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    logger.info("Command finished in %.1fs", time.monotonic() - start)
+    return subprocess.CompletedProcess(command, returncode)
+
+
+# sauvegardes faites dans le processus, sans commande externe
+IN_PROCESS_ENGINES = {
+    "django.db.backends.sqlite3": sqlite_backup.backup,
+}
+
+def get_in_process_engine(dbname: str):
+    """
+    Fonction de sauvegarde dans le processus pour dbname, None s'il faut passer
+    par une commande. Une commande configurée dans DB_BACKUP_COMMANDS pour le
+    moteur reste prioritaire.
+    """
+    check_dbname(dbname)
+    engine = settings.DATABASES[dbname]["ENGINE"]
+    if engine in settings.DB_BACKUP_COMMANDS:
+        return None
+    return IN_PROCESS_ENGINES.get(engine)
+
+
+def check_dbname(dbname: str):
+    """
+    dbname sert à nommer des fichiers : on n'accepte que les bases déclarées.
+    """
+    if dbname not in settings.DATABASES:
+        raise ValueError(f"Database '{dbname}' not found in settings.")
+
+
+class DumpLock():
+    """
+    Verrou (flock) par base, partagé entre processus : une seule sauvegarde
+    courante d'une base à la fois.
+
+    Usage : `with DumpLock(dbname):` (bloquant), ou acquire(blocking=False) puis
+    release().
+    """
+
+    def __init__(self, dbname: str):
+        check_dbname(dbname)
+        get_file_path(dbname)  # creates BACKUP_PATH
+        self.path = settings.BACKUP_PATH / f".{dbname}.lock"
+        self._file = None
+
+    def acquire(self, blocking: bool=True) -> bool:
+        self._file = open(self.path, "a")
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._file, flags)
+        except BlockingIOError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def get_manifest_path(dbname: str) -> Path:
+    """
+    Fichier décrivant la dernière sauvegarde courante de dbname, à côté de
+    celle-ci.
+    """
+    return get_file_path(dbname).parent / f"{dbname}_latest.json"
+
+
+def write_manifest(dbname: str, path: Path):
+    manifest = get_manifest_path(dbname)
+    tmp = manifest.with_name(manifest.name + ".tmp")
+    tmp.write_text(json.dumps({
+        "path": str(path),
+        "timestamp": time.time(),
+        "size": path.stat().st_size,
+    }))
+    tmp.replace(manifest)
+
+
+def recent_dump(dbname: str, max_age: datetime.timedelta|None=None) -> Path|None:
+    """
+    Dernière sauvegarde de dbname si elle a moins de max_age (par défaut
+    ARCHIVES_DUMP_REUSE_MINUTES minutes) et n'a pas changé de taille depuis.
+    """
+    if max_age is None:
+        max_age = datetime.timedelta(
+            minutes=getattr(settings, "ARCHIVES_DUMP_REUSE_MINUTES", 5))
+    try:
+        manifest = json.loads(get_manifest_path(dbname).read_text())
+        path = Path(manifest["path"])
+        if time.time() - manifest["timestamp"] > max_age.total_seconds():
+            return None
+        if path.stat().st_size != manifest["size"]:
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return path
+
+
+def get_dump_path(dbname: str, path: Path|None=None, codec: str|None=None) -> Path:
+    """
+    Chemin final d'une sauvegarde : get_file_path avec l'extension du codec
+    (par défaut celui de ARCHIVES_COMPRESSION, "none" : pas de compression).
+    """
+    final = get_file_path(dbname, path)
+    return final.with_name(final.name + get_extension(get_compression(codec)["codec"]))
+
+
+def get_part_path(path: Path) -> Path:
+    """
+    Nom temporaire de la sauvegarde path pendant son écriture.
+    """
+    return path.with_name(path.name + ".part")
+
+
+def create_dump(dbname: str, path: Path|None=None, jobs: int|None=None, progress=None,
+        codec: str|None=None, level: int|None=None, copies: list[Path]|None=None,
+        store: bool=False) -> Path:
+    """
+    Sauvegarde de dbname, écrite sous un nom temporaire puis renommée : un
+    fichier du nom final est toujours complet. Un manifeste (voir
+    compression.write_sidecar : tailles, empreintes sha256) est écrit à côté.
+    Le manifeste de réutilisation (write_manifest) et le catalogue ne sont mis à
+    jour que pour la destination par défaut.
+
+    La sauvegarde est compressée selon ARCHIVES_COMPRESSION, ou codec et level
+    (codec "none" : pas de compression), et le nom du fichier reçoit
+    l'extension du codec.
+
+    Avec jobs, la sauvegarde parallèle (format répertoire) est regroupée dans
+    une archive tar (voir pack_directory), restaurable par restore_db.
+
+    Pour un moteur sauvegardé dans le processus (voir get_in_process_engine),
+    progress(copied, total) suit l'avancement ; jobs n'a pas de sens.
+
+    Avec une compression ou une limite de débit (ARCHIVES_RESOURCE_POLICY), la
+    sortie de la commande passe par Python. Une sauvegarde parallèle ou faite
+    dans le processus est compressée une fois écrite ; seuls nice, ionice et le
+    temps maximal s'appliquent à la sauvegarde parallèle.
+
+    copies : dossiers où écrire aussi la sauvegarde, sous le même nom, dans la
+    même passe (voir fanout.FanOutWriter). Chaque copie a son manifeste, avec
+    l'empreinte de ce qui y a été écrit ; une copie en erreur est signalée dans
+    le manifeste de la sauvegarde sans interrompre les autres destinations.
+    Si la sauvegarde elle-même échoue, OSError est levée une fois les copies
+    terminées.
+
+    store : sauvegarde destinée au magasin dédupliqué, voir construct_command.
+
+    Ne prend pas le verrou, voir get_or_create_dump.
+    """
+    compression = get_compression(codec, level)
+    codec = compression["codec"]
+    final = get_dump_path(dbname, path, codec or "none")
+    part = get_part_path(final)
+    raw = final.with_name(final.name + ".raw")
+    directory = final.with_name(final.name + ".d")
+    engine = get_in_process_engine(dbname)
+    if engine is not None and jobs:
+        raise ValueError("Parallel backups need a backup command.")
+    policy = ResourcePolicy.from_settings() if engine is None else None
+
+    def produce(target):
+        """
+        Sauvegarde dans le processus ou parallèle, écrite dans target.
+        """
+        if engine is not None:
+            engine(settings.DATABASES[dbname], target, progress=progress)
+        elif jobs:
+            if policy.bandwidth:
+                logger.warning("Bandwidth limit not applied to parallel backups")
+            shutil.rmtree(directory, ignore_errors=True)
+            run_save_command(construct_command(dbname, directory, jobs=jobs, store=store))
+            pack_directory(directory, target)
+
+    targets = [final] + [Path(directory) / final.name for directory in copies or []]
+    results = None
+    start = time.monotonic()
+    try:
+        if codec is None and len(targets) == 1:
+            # the checksum is computed by reading the file back
+            produce(part)
+            if engine is None and not jobs:
+                if policy.bandwidth:
+                    run_save_command(construct_command(dbname, stream=True, store=store), output=part)
+                else:
+                    run_save_command(construct_command(dbname, part, store=store))
+            info = checksum_info(part)
+            part.replace(final)
+        else:
+            # FanOutWriter writes each target under its .part name, then renames it
+            with FanOutWriter(targets) as out, CompressingWriter(
+                    out, codec, compression.get("level"), compression.get("workers"),
+                    compression.get("block_size")) as writer:
+                if engine is not None or jobs:
+                    produce(raw)
+                    copy_to(raw, writer)
+                else:
+                    run_save_command(construct_command(dbname, stream=True, store=store), output=writer)
+            info = writer.info()
+            results = out.results()
+    finally:
+        part.unlink(missing_ok=True)
+        raw.unlink(missing_ok=True)
+        shutil.rmtree(directory, ignore_errors=True)
+    duration = time.monotonic() - start
+    extra = {}
+    if results is not None:
+        for result in results[1:]:
+            if result["error"] is None:
+                write_sidecar(Path(result["path"]), dict(
+                    info, size=result["size"], sha256=result["sha256"]),
+                    database=dbname, duration=round(duration, 3))
+            else:
+                logger.error("Backup copy of %s to %s failed: %s",
+                    dbname, result["path"], result["error"])
+        if results[0]["error"] is not None:
+            raise OSError(f"Backup to {final} failed: {results[0]['error']}")
+        if copies:
+            extra["copies"] = results[1:]
+    write_sidecar(final, info, database=dbname, duration=round(duration, 3), **extra)
+    logger.info("Backup of %s written to %s: %s bytes (%s raw) in %.1fs (%s), "
+        "resource policy: %s", dbname, final, info["size"], info["raw_size"], duration,
+        format_rate(info["raw_size"] / duration) if duration else "-", policy or "in-process")
+    if path is None:
+        write_manifest(dbname, final)
+        record_backup(final, info, dbname)
+    return final
+
+
+def get_or_create_dump(dbname: str, max_age: datetime.timedelta|None=None) -> Path:
+    """
+    Sauvegarde récente de dbname (voir recent_dump), créée au besoin.
+
+    Les appels simultanés attendent la sauvegarde en cours sous le verrou puis
+    la réutilisent, au lieu de lancer chacun la leur.
+    """
+    check_dbname(dbname)
+    path = recent_dump(dbname, max_age)
+    if path is not None:
+        return path
+    with DumpLock(dbname):
+        # another request may have finished a dump while we were waiting
+        path = recent_dump(dbname, max_age)
+        if path is not None:
+            return path
+        return create_dump(dbname)
+
+
+class DumpStream():
+    """
+    Sortie standard d'une commande de sauvegarde (construite avec stream=True),
+    itérée par morceaux de chunk_size octets, pour un StreamingHttpResponse.
+
+    Le processus est lancé dès la construction : une commande introuvable lève
+    donc une exception avant l'envoi du premier octet. Un code de retour non nul
+    lève subprocess.CalledProcessError à la fin de l'itération, ce qui coupe la
+    réponse : le client reçoit un téléchargement incomplet, pas un fichier
+    tronqué présenté comme complet.
+
+    tee : chemin où écrire aussi la sauvegarde. Le fichier n'apparaît sous ce nom
+    qu'une fois la commande terminée avec succès, on_complete(tee) est alors
+    appelé.
+    lock : DumpLock déjà acquis, relâché à la fermeture.
+    policy : ResourcePolicy, par défaut ARCHIVES_RESOURCE_POLICY. Le débit est
+    limité à l'itération, la commande est tuée au-delà du temps maximal.
+    """
+
+    def __init__(self, command: list[str], chunk_size: int|None=None, tee: Path|None=None,
+            on_complete=None, lock: DumpLock|None=None, policy: ResourcePolicy|None=None):
+        self.command = command
+        self.on_complete = on_complete
+        self.lock = lock
+        self.chunk_size = chunk_size or getattr(
+            settings, "ARCHIVES_STREAM_CHUNK_SIZE", 1024 * 1024)
+        self.tee = tee
+        self._tee_part = None
+        self._tee_file = None
+        self.policy = policy or ResourcePolicy.from_settings()
+        logger.info("Streaming %s with resource policy: %s", command, self.policy)
+        self.process = subprocess.Popen(
+            self.policy.wrap(command), stdout=subprocess.PIPE, shell=False)
+        self._timer = self.policy.start_timer(self.process)
+        self._start = time.monotonic()
+        if tee is not None:
+            self._tee_part = tee.with_name(tee.name + ".part")
+            self._tee_file = open(self._tee_part, "wb")
+        self.bytes_sent = 0
+
+    def __iter__(self):
+        stdout = self.process.stdout
+        throttle = self.policy.throttle()
+        while chunk := stdout.read(self.chunk_size):
+            if self._tee_file is not None:
+                self._tee_file.write(chunk)
+            self.bytes_sent += len(chunk)
+            yield chunk
+            if throttle is not None:
+                throttle(len(chunk))
+        returncode = self.process.wait()
+        if self._timer is not None:
+            self._timer.cancel()
+        duration = time.monotonic() - self._start
+        logger.info("Streamed %s bytes in %.1fs (%s)", self.bytes_sent, duration,
+            format_rate(self.bytes_sent / duration) if duration else "-")
+        if returncode != 0:
+            logger.error("Backup command failed with status %s after %s bytes: %s",
+                returncode, self.bytes_sent, self.command)
+            self._discard_tee()
+            raise subprocess.CalledProcessError(returncode, self.command)
+        if self._tee_file is not None:
+            self._tee_file.close()
+            self._tee_file = None
+            self._tee_part.replace(self.tee)
+            if self.on_complete is not None:
+                self.on_complete(self.tee)
+
+    def _discard_tee(self):
+        if self._tee_file is not None:
+            self._tee_file.close()
+            self._tee_file = None
+            self._tee_part.unlink(missing_ok=True)
+
+    def close(self):
+        """
+        Appelé par Django en fin de réponse, y compris si le client a coupé la
+        connexion : la commande encore en cours est alors arrêtée.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+        self._discard_tee()
+        if self.lock is not None:
+            self.lock.release()
+
+def construct_restore_command(dbname: str, path: Path, jobs: int|None=None) -> list[str]:
+    """
+    Commande de restauration de path (fichier ou répertoire de sauvegarde) dans
+    dbname, construite comme construct_command à partir de DB_RESTORE_COMMANDS.
+    """
+    db_settings, command_template = _get_template(
+        dbname, getattr(settings, "DB_RESTORE_COMMANDS", {}), "restore")
+    command_list = _base_command(command_template, db_settings, jobs)
+    command_list.extend(
+        tok.format(FILE=path) for tok in shlex.split(command_template['input']))
+    return command_list
+
+
+def pack_directory(directory: Path, path: Path):
+    """
+    Regroupe une sauvegarde au format répertoire dans l'archive tar path, puis
+    supprime le répertoire. Pas de compression : pg_dump compresse déjà
+    chaque fichier du répertoire.
+    """
+    with tarfile.open(path, "w") as tar:
+        for child in sorted(directory.iterdir()):
+            tar.add(child, arcname=child.name)
+    shutil.rmtree(directory)
+
+
+def unpack_archive(path: Path, directory: Path):
+    """
+    Inverse de pack_directory.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(path, "r") as tar:
+        tar.extractall(directory, filter="data")
+
 
-# TODO: implement the restore command
-# pg_restore --verbose --clean --no-acl --no-owner -h localhost -U myprojectuser -d myprojectdb {path}
\ No newline at end of file
+def is_packed_directory(path: Path) -> bool:
+    return Path(path).is_file() and tarfile.is_tarfile(path)
\ No newline at end of file
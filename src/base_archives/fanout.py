@@ -0,0 +1,160 @@
+"""
+date: 2026-10-19
+
+Écriture d'une même sauvegarde dans plusieurs fichiers en une passe (copies sur
+des volumes distincts), sans relire la sauvegarde pour la copier.
+
+Chaque destination a son thread d'écriture et sa file d'attente bornée : les
+disques travaillent en parallèle, le plus lent donne le rythme. Une destination
+en erreur (disque plein...) est abandonnée sans interrompre les autres ; seules
+les erreurs de toutes les destinations arrêtent l'écriture.
+"""
+import hashlib
+import os
+import queue
+import threading
+from pathlib import Path
+
+_END = None
+
+
+class Destination():
+    """
+    Un fichier de FanOutWriter, écrit sous le nom path.part puis renommé.
+    """
+
+    def __init__(self, path: Path, queue_size: int):
+        self.path = Path(path)
+        self.part = self.path.with_name(self.path.name + ".part")
+        self.queue = queue.Queue(queue_size)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.error = None
+        self.file = None
+        self.thread = threading.Thread(
+            target=self.run, name=f"fanout-{self.path.name}", daemon=True)
+
+    def start(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.part, "wb")
+        except OSError as e:
+            self.fail(e)
+        self.thread.start()
+
+    def fail(self, error: Exception):
+        self.error = error
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+        try:
+            self.part.unlink(missing_ok=True)
+        except OSError:
+            # the directory itself is unusable
+            pass
+
+    def run(self):
+        while (data := self.queue.get()) is not _END:
+            if self.error is not None:
+                # keep draining, the producer must not block on a failed disk
+                continue
+            try:
+                self.file.write(data)
+            except OSError as e:
+                self.fail(e)
+                continue
+            self.digest.update(data)
+            self.size += len(data)
+
+    def finish(self):
+        """
+        Fichier complet : mis sur disque (fsync) puis renommé.
+        """
+        if self.error is not None:
+            return
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+            self.part.replace(self.path)
+        except OSError as e:
+            self.fail(e)
+
+    def info(self) -> dict:
+        return {
+            "path": str(self.path),
+            "size": self.size,
+            "sha256": self.digest.hexdigest() if self.error is None else None,
+            "error": None if self.error is None else str(self.error),
+        }
+
+
+class FanOutWriter():
+    """
+    Fichier binaire en écriture qui recopie ce qu'on y écrit dans chacun des
+    fichiers paths.
+
+    Usage :
+
+        with FanOutWriter([path, copy]) as out:
+            out.write(data)
+        out.results()  # taille, empreinte ou erreur de chaque destination
+
+    write lève OSError quand toutes les destinations sont en erreur. À la
+    sortie du bloc sur une exception, aucun fichier n'est créé.
+    """
+
+    def __init__(self, paths: list[Path], queue_size: int=8):
+        if not paths:
+            raise ValueError("No destination")
+        self.destinations = [Destination(path, queue_size) for path in paths]
+        for destination in self.destinations:
+            destination.start()
+        self.closed = False
+
+    def write(self, data) -> int:
+        alive = [d for d in self.destinations if d.error is None]
+        if not alive:
+            raise OSError(f"Every destination failed: {self.destinations[0].error}")
+        data = bytes(data)
+        for destination in alive:
+            destination.queue.put(data)
+        return len(data)
+
+    def _stop(self):
+        for destination in self.destinations:
+            destination.queue.put(_END)
+        for destination in self.destinations:
+            destination.thread.join()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop()
+        for destination in self.destinations:
+            destination.finish()
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._stop()
+        for destination in self.destinations:
+            destination.fail(destination.error or OSError("aborted"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def results(self) -> list[dict]:
+        return [destination.info() for destination in self.destinations]
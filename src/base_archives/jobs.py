@@ -0,0 +1,238 @@
+"""
+date: 2026-10-19
+
+Sauvegardes lancées depuis le web, exécutées en arrière-plan dans un thread du
+processus : la requête rend la main tout de suite, le client suit l'avancement
+(vue BackupJobStatus) puis télécharge la sauvegarde terminée.
+
+Chaque tâche est décrite par un fichier BACKUP_PATH/jobs/<id>.json, mis à jour
+par le thread (état, octets écrits) et lisible par tous les processus du
+serveur. Un battement (heartbeat) est écrit toutes les ARCHIVES_JOB_HEARTBEAT
+secondes : une tâche « en cours » qui n'en donne plus (processus redémarré) est
+signalée en échec. L'ETA est estimée d'après la taille de la dernière
+sauvegarde de la base inscrite au catalogue.
+"""
+import datetime
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+
+from base_archives import db_save
+from base_archives.catalogue import Catalogue
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+# running threads, by job id (tests wait for them)
+_threads = {}
+
+
+def get_jobs_dir() -> Path:
+    path = settings.BACKUP_PATH / "jobs"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def get_heartbeat() -> float:
+    return getattr(settings, "ARCHIVES_JOB_HEARTBEAT", 1.0)
+
+
+class JobNotFound(Exception):
+    pass
+
+
+class BackupJob():
+
+    def __init__(self, record: dict):
+        self.record = record
+
+    @property
+    def id(self) -> str:
+        return self.record["id"]
+
+    @staticmethod
+    def get_path(job_id: str) -> Path:
+        if not _ID_RE.match(job_id or ""):
+            raise JobNotFound(job_id)
+        return get_jobs_dir() / f"{job_id}.json"
+
+    @classmethod
+    def get(cls, job_id: str, user=None) -> "BackupJob":
+        """
+        Tâche job_id, réservée à l'utilisateur qui l'a lancée si user est
+        donné.
+        """
+        try:
+            record = json.loads(cls.get_path(job_id).read_text())
+        except (OSError, ValueError):
+            raise JobNotFound(job_id)
+        if user is not None and record["user"] != user.pk:
+            raise JobNotFound(job_id)
+        return cls(record)
+
+    def save(self):
+        path = self.get_path(self.id)
+        tmp = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(self.record))
+        os.replace(tmp, path)
+
+    def update(self, **data):
+        self.record.update(data)
+        self.save()
+
+    @classmethod
+    def clean_old(cls, max_age: datetime.timedelta|None=None):
+        max_age = max_age or getattr(
+            settings, "ARCHIVES_JOB_MAX_AGE", datetime.timedelta(days=1))
+        limit = time.time() - max_age.total_seconds()
+        for path in get_jobs_dir().glob("*.json"):
+            try:
+                if path.stat().st_mtime < limit:
+                    path.unlink()
+            except OSError:
+                continue
+
+    @classmethod
+    def start(cls, dbname: str, user) -> "BackupJob":
+        """
+        Lance la sauvegarde de dbname en arrière-plan.
+
+        Une sauvegarde récente est réutilisée (la tâche est aussitôt terminée),
+        et des tâches simultanées sur la même base partagent une seule
+        sauvegarde (voir run).
+        """
+        db_save.check_dbname(dbname)
+        cls.clean_old()
+        job = cls({
+            "id": uuid.uuid4().hex,
+            "database": dbname,
+            "user": user.pk,
+            "state": PENDING,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "heartbeat": time.time(),
+            "bytes_written": 0,
+            "expected_bytes": cls.expected_bytes(dbname),
+            "file": None,
+            "error": None,
+        })
+        recent = db_save.recent_dump(dbname)
+        if recent is not None:
+            job.record.update(state=DONE, finished=time.time(), file=recent.name,
+                bytes_written=recent.stat().st_size)
+            job.save()
+            return job
+        job.save()
+        thread = threading.Thread(target=job.run, name=f"backup-job-{job.id}", daemon=True)
+        _threads[job.id] = thread
+        thread.start()
+        return job
+
+    @staticmethod
+    def expected_bytes(dbname: str) -> int|None:
+        entries = Catalogue.read().entries(dbname)
+        return entries[-1]["size"] if entries else None
+
+    def run(self):
+        """
+        Corps du thread : sauvegarde sous le verrou de la base (une autre
+        sauvegarde en cours est attendue puis réutilisée, voir
+        get_or_create_dump), en publiant l'avancement.
+        """
+        dbname = self.record["database"]
+        part = db_save.get_part_path(db_save.get_dump_path(dbname))
+        stop = threading.Event()
+
+        def watch():
+            while not stop.wait(get_heartbeat()):
+                try:
+                    written = part.stat().st_size
+                except OSError:
+                    written = self.record["bytes_written"]
+                self.update(heartbeat=time.time(), bytes_written=written)
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        try:
+            self.update(state=RUNNING, started=time.time())
+            watcher.start()
+            path = db_save.get_or_create_dump(dbname)
+        except Exception as e:
+            logger.exception("Backup job %s failed", self.id)
+            stop.set()
+            watcher.join()
+            self.update(state=FAILED, finished=time.time(), error=str(e))
+        else:
+            stop.set()
+            watcher.join()
+            self.update(state=DONE, finished=time.time(), file=path.name,
+                bytes_written=path.stat().st_size)
+        finally:
+            _threads.pop(self.id, None)
+
+    def wait(self, timeout: float|None=None):
+        thread = _threads.get(self.id)
+        if thread is not None:
+            thread.join(timeout)
+        self.record = self.get(self.id).record
+
+    @property
+    def state(self) -> str:
+        """
+        État, FAILED pour une tâche active sans battement récent.
+        """
+        state = self.record["state"]
+        if state in (PENDING, RUNNING):
+            stale = getattr(settings, "ARCHIVES_JOB_STALE_AFTER", 30 * get_heartbeat())
+            if time.time() - self.record["heartbeat"] > stale:
+                return FAILED
+        return state
+
+    def get_file(self) -> Path|None:
+        if self.state != DONE or not self.record["file"]:
+            return None
+        path = settings.BACKUP_PATH / self.record["file"]
+        return path if path.exists() else None
+
+    def status(self) -> dict:
+        """
+        État publié par la vue BackupJobStatus. progress (entre 0 et 1) et eta
+        (secondes) valent None faute de sauvegarde précédente pour comparer.
+        """
+        record = self.record
+        state = self.state
+        written = record["bytes_written"]
+        expected = record["expected_bytes"]
+        progress = eta = None
+        if state == DONE:
+            progress, eta = 1.0, 0
+        elif state == RUNNING and expected:
+            progress = min(written / expected, 0.99)
+            elapsed = time.time() - record["started"]
+            if written:
+                eta = max(elapsed * (expected - written) / written, 0)
+        error = record["error"]
+        if state == FAILED and error is None:
+            error = "Sauvegarde interrompue"
+        return {
+            "job": self.id,
+            "database": record["database"],
+            "state": state,
+            "bytes_written": written,
+            "expected_bytes": expected,
+            "progress": progress,
+            "eta": eta,
+            "error": error,
+        }
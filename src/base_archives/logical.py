@@ -0,0 +1,231 @@
+"""
+date: 2026-10-19
+
+Sauvegardes logiques partielles : le contenu de quelques applications (ou
+modèles), lu par l'ORM, quel que soit le moteur de la base.
+
+Chaque modèle est écrit dans son propre fichier JSON Lines compressé
+(<app>.<modèle>.jsonl.gz, une ligne par objet, valeurs de values()), par un
+processus d'un groupe (un processus par table). Les lectures se font par
+paquets de ARCHIVES_LOGICAL_CHUNK_SIZE lignes (.iterator) pour garder une
+mémoire bornée. Un manifeste (manifest.json) décrit le dossier.
+
+La restauration remplace le contenu des tables sauvegardées, par insertions
+groupées (bulk_create), dans une seule transaction. Les clés étrangères vers
+les autres tables ne sont vérifiées qu'à la fin : les objets restaurés gardent
+leur clé primaire.
+
+Ces sauvegardes ne sont pas inscrites au catalogue.
+"""
+import base64
+import datetime
+import json
+import multiprocessing
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+
+from base_archives.compression import (
+    CODECS, CompressingWriter, get_codec, get_compression, get_extension)
+
+MANIFEST = "manifest.json"
+
+
+def get_chunk_size() -> int:
+    return getattr(settings, "ARCHIVES_LOGICAL_CHUNK_SIZE", 2000)
+
+
+class Encoder(DjangoJSONEncoder):
+    """
+    Les dates gardent leurs microsecondes (DjangoJSONEncoder les tronque à la
+    milliseconde) et les données binaires sont écrites en base64 (relues par
+    BinaryField.to_python).
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, (bytes, memoryview)):
+            return base64.b64encode(o).decode("ascii")
+        return super().default(o)
+
+
+def get_models(labels: list[str], dbname: str="default") -> list:
+    """
+    Modèles désignés par labels ("app" ou "app.Modele"), avec leurs tables
+    de liaison many-to-many automatiques. Seuls les modèles concrets gérés par
+    Django et routés vers dbname sont retenus.
+    """
+    models = []
+    for label in labels:
+        try:
+            if "." in label:
+                model = apps.get_model(label)
+                candidates = [model] + [
+                    field.remote_field.through for field in model._meta.local_many_to_many
+                    if field.remote_field.through._meta.auto_created]
+            else:
+                candidates = apps.get_app_config(label).get_models(include_auto_created=True)
+        except LookupError as e:
+            raise ValueError(str(e)) from e
+        for model in candidates:
+            opts = model._meta
+            if opts.proxy or not opts.managed or model in models:
+                continue
+            if router.allow_migrate_model(dbname, model):
+                models.append(model)
+    if not models:
+        raise ValueError(f"No model to backup for {', '.join(labels)}")
+    return models
+
+
+def get_backup_path(dbname: str) -> Path:
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d")
+    return settings.BACKUP_PATH / f"{dbname}_logical-{timestamp}"
+
+
+def is_logical_backup(path: Path) -> bool:
+    return (Path(path) / MANIFEST).is_file()
+
+
+def dump_model(dbname: str, label: str, directory: Path, codec: str|None=None,
+        level: int|None=None, chunk_size: int|None=None) -> dict:
+    """
+    Écrit les lignes du modèle label dans directory. Appelée dans un
+    processus du groupe (voir dump).
+    """
+    model = apps.get_model(label)
+    fields = [field.attname for field in model._meta.concrete_fields]
+    path = Path(directory) / f"{label}.jsonl{get_extension(codec)}"
+    queryset = model._base_manager.using(dbname).order_by("pk").values_list(*fields)
+    rows = 0
+    start = time.monotonic()
+    with open(path, "wb") as f, CompressingWriter(f, codec, level) as writer:
+        for values in queryset.iterator(chunk_size=chunk_size or get_chunk_size()):
+            line = json.dumps(dict(zip(fields, values)), cls=Encoder, separators=(",", ":"))
+            writer.write(line.encode() + b"\n")
+            rows += 1
+    return dict(writer.info(), model=label, file=path.name, rows=rows,
+        duration=time.monotonic() - start)
+
+
+def _can_fork(dbname: str) -> bool:
+    # an in-memory SQLite database is not shared with child processes
+    connection = connections[dbname]
+    return not getattr(connection, "is_in_memory_db", lambda: False)()
+
+
+def dump(labels: list[str], dbname: str="default", path: Path|None=None,
+        workers: int|None=None, codec: str|None=None, level: int|None=None,
+        chunk_size: int|None=None) -> Path:
+    """
+    Sauvegarde logique des modèles de labels dans le dossier path (par défaut
+    BACKUP_PATH/<dbname>_logical-<date>), remplacé s'il existe. Le dossier
+    n'apparaît qu'une fois complet.
+
+    Avec workers > 1, les tables sont lues en parallèle par des processus
+    fils, chacun avec sa propre connexion : chaque table est cohérente, mais
+    pas l'ensemble (une sauvegarde complète reste l'affaire de create_dump).
+    """
+    models = get_models(labels, dbname)
+    compression = get_compression(codec, level)
+    final = Path(path) if path is not None else get_backup_path(dbname)
+    part = final.with_name(final.name + ".part")
+    shutil.rmtree(part, ignore_errors=True)
+    part.mkdir(parents=True)
+    args = [
+        (dbname, model._meta.label, part, compression["codec"], compression.get("level"),
+            chunk_size)
+        for model in models]
+    workers = min(workers or 1, len(args))
+    try:
+        if workers > 1 and _can_fork(dbname):
+            # children must not share the connection of the parent
+            connections.close_all()
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                results = list(pool.map(dump_model, *zip(*args)))
+        else:
+            results = [dump_model(*arg) for arg in args]
+        (part / MANIFEST).write_text(json.dumps({
+            "database": dbname,
+            "created": time.time(),
+            "labels": labels,
+            "models": results,
+        }, indent=2))
+    except BaseException:
+        shutil.rmtree(part, ignore_errors=True)
+        raise
+    shutil.rmtree(final, ignore_errors=True)
+    part.rename(final)
+    return final
+
+
+def read_manifest(path: Path) -> dict:
+    try:
+        return json.loads((Path(path) / MANIFEST).read_text())
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Not a logical backup: {path} ({e})") from e
+
+
+def read_rows(path: Path, model):
+    """
+    Objets du fichier path, valeurs converties par les champs du modèle.
+    """
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    codec = get_codec(path)
+    opener = CODECS[codec][1] if codec else open
+    with opener(path, "rt") as f:
+        for line in f:
+            row = json.loads(line)
+            yield model(**{
+                name: value if value is None else fields[name].to_python(value)
+                for name, value in row.items()})
+
+
+def load(path: Path, dbname: str="default", batch_size: int|None=None) -> list[tuple[str, int]]:
+    """
+    Restaure la sauvegarde logique path dans dbname : le contenu des tables
+    sauvegardées est remplacé. Renvoie le nombre d'objets par modèle.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    batch_size = batch_size or get_chunk_size()
+    models = [(apps.get_model(entry["model"]), entry) for entry in manifest["models"]]
+    connection = connections[dbname]
+    quote = connection.ops.quote_name
+    counts = []
+    with transaction.atomic(using=dbname):
+        with connection.constraint_checks_disabled():
+            with connection.cursor() as cursor:
+                for model, _ in reversed(models):
+                    cursor.execute(f"DELETE FROM {quote(model._meta.db_table)}")
+            for model, entry in models:
+                queryset = model._base_manager.using(dbname)
+                batch = []
+                count = 0
+                for obj in read_rows(path / entry["file"], model):
+                    batch.append(obj)
+                    if len(batch) >= batch_size:
+                        queryset.bulk_create(batch)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    queryset.bulk_create(batch)
+                    count += len(batch)
+                counts.append((entry["model"], count))
+        # as loaddata : foreign keys checked once every table is loaded
+        connection.check_constraints(table_names=[model._meta.db_table for model, _ in models])
+        sequences = connection.ops.sequence_reset_sql(no_style(), [model for model, _ in models])
+        if sequences:
+            with connection.cursor() as cursor:
+                for sql in sequences:
+                    cursor.execute(sql)
+    return counts
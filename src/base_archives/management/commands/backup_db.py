@@ -2,12 +2,16 @@
 date: 2025-07-01
 """
 
-import datetime
+import argparse
+import json
+from pathlib import Path
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
-from base_archives import db_save
+from base_archives import chunkstore, compression, db_save, logical, metrics
+from base_archives.catalogue import Catalogue
+from base_archives.resources import format_rate
 
 class Command(BaseCommand):
     help = "Backup the database"
@@ -20,25 +24,176 @@ class Command(BaseCommand):
             help='The setting name of the database to backup',
             default="default"
         )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            help='Number of parallel dump jobs (directory format, packed as a tar archive)',
+            default=None
+        )
+        parser.add_argument(
+            '--store',
+            action=argparse.BooleanOptionalAction,
+            help='Keep the backup in the deduplicating chunk store '
+                '(default: ARCHIVES_BACKUP_TO_STORE setting)',
+            default=getattr(settings, "ARCHIVES_BACKUP_TO_STORE", False)
+        )
+        parser.add_argument(
+            '--compress',
+            choices=["none", *compression.CODECS],
+            help='Compression codec (default: ARCHIVES_COMPRESSION setting)',
+            default=None
+        )
+        parser.add_argument(
+            '--level',
+            type=int,
+            help='Compression level',
+            default=None
+        )
+        parser.add_argument(
+            '--copy',
+            type=Path,
+            action='append',
+            dest='copies',
+            metavar='DIRECTORY',
+            help='Also write the backup into this directory, in the same pass (repeatable, '
+                'default: ARCHIVES_BACKUP_COPIES setting)',
+            default=None
+        )
+        parser.add_argument(
+            '--apps',
+            nargs='+',
+            metavar='APP_LABEL[.MODEL]',
+            help='Logical backup of these applications or models only (JSON Lines, see '
+                'base_archives.logical)',
+            default=None
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of tables read in parallel by a logical backup',
+            default=4
+        )
+
+    def progress(self, copied, total):
+        """
+        Avancement d'une sauvegarde faite dans le processus (SQLite).
+        """
+        if self.verbosity > 1 and total:
+            self.stdout.write(f"Copied {copied}/{total} pages ({100 * copied // total}%)")
 
     def clean_old_backups(self):
-        backup_path = settings.BACKUP_PATH
-        for file in backup_path.glob("*.sql"):
-            if file.stat().st_mtime < (datetime.datetime.now() - datetime.timedelta(days=60)).timestamp():
-                file.unlink()
-                self.stdout.write(f"Deleted old backup: {file.name}")
+        """
+        Applique la rétention (ARCHIVES_RETENTION) d'après le catalogue, sans
+        parcourir le dossier.
+        """
+        with Catalogue.edit() as catalogue:
+            deleted = catalogue.apply_retention()
+        for entry in deleted:
+            self.stdout.write(f"Deleted old backup: {entry['name']}")
+            # the copies follow the retention of the backup
+            for directory in self.copies:
+                path = directory / entry["name"]
+                path.unlink(missing_ok=True)
+                compression.get_sidecar_path(path).unlink(missing_ok=True)
+
+    def clean_store(self, store):
+        """
+        Oublie les sauvegardes du magasin que la rétention ne garde pas, puis
+        efface les morceaux qui ne servent plus.
+        """
+        for name in store.apply_retention():
+            self.stdout.write(f"Deleted old backup: {name}")
+        count, size = store.collect_garbage()
+        self.stdout.write(f"Deleted {count} unreferenced chunks ({size} bytes)")
+
+    def store_dump(self, dbname, options):
+        """
+        Sauvegarde dans le magasin dédupliqué (voir base_archives.chunkstore) :
+        le fichier de la sauvegarde n'est que temporaire.
+        """
+        store = chunkstore.ChunkStore()
+        path = db_save.get_file_path(dbname)
+        tmp = store.root / path.name
+        try:
+            # compressed blocks would not deduplicate, neither ours nor pg_dump's
+            with db_save.DumpLock(dbname):
+                db_save.create_dump(
+                    dbname, tmp, jobs=options.get("jobs"), progress=self.progress, codec="none",
+                    store=True)
+            manifest = store.put(path.stem, tmp)
+        finally:
+            tmp.unlink(missing_ok=True)
+            compression.get_sidecar_path(tmp).unlink(missing_ok=True)
+        self.stdout.write(
+            f"Backup stored as {manifest['name']}: {manifest['size']} bytes, "
+            f"{len(manifest['chunks'])} chunks, {manifest['new_chunks']} new "
+            f"({manifest['new_bytes']} bytes)")
+        self.clean_store(store)
+        return manifest["size"]
+
+    def logical_dump(self, dbname, options):
+        path = logical.dump(
+            options["apps"], dbname, workers=options["workers"],
+            codec=options.get("compress"), level=options.get("level"))
+        entries = logical.read_manifest(path)["models"]
+        for entry in entries:
+            self.stdout.write(
+                f"{entry['model']}: {entry['rows']} rows, {entry['size']} bytes "
+                f"in {entry['duration']:.1f}s")
+        self.stdout.write(f"Logical backup written to {path}")
+        return sum(entry["size"] for entry in entries)
+
+    def dump(self, dbname, options):
+        # the lock keeps a download (DownloadDb) from dumping at the same time
+        with db_save.DumpLock(dbname):
+            path = db_save.create_dump(
+                dbname, jobs=options.get("jobs"), progress=self.progress,
+                codec=options.get("compress"), level=options.get("level"), copies=self.copies)
+        self.stdout.write(f"Backup written to {path}")
+        if self.copies:
+            info = json.loads(compression.get_sidecar_path(path).read_text())
+            for copy in info["copies"]:
+                if copy["error"] is None:
+                    self.stdout.write(f"Copy written to {copy['path']} (sha256 {copy['sha256']})")
+                else:
+                    self.stderr.write(self.style.ERROR(
+                        f"Copy to {copy['path']} failed: {copy['error']}"))
+        # clean up old backups
+        self.clean_old_backups()
+        return path.stat().st_size
+
+    def report(self, measure):
+        """
+        Durée et taille de la sauvegarde, comparées à l'historique (voir
+        base_archives.metrics).
+        """
+        entry = measure.entry
+        rate = f", {format_rate(entry['throughput'])}" if entry["throughput"] else ""
+        self.stdout.write(f"Backup of {entry['size']} bytes in {entry['duration']:.1f}s{rate}")
+        if not measure.regressions:
+            return
+        message = f"Backup regression: {'; '.join(measure.regressions)}"
+        if measure.config["action"] == "fail":
+            raise CommandError(message)
+        self.stderr.write(self.style.WARNING(message))
 
     def handle(self, *args, **options):
         dbname = options.get("dbname", "default")
+        self.verbosity = options.get("verbosity", 1)
+        self.copies = [Path(directory) for directory in (
+            options.get("copies") or getattr(settings, "ARCHIVES_BACKUP_COPIES", []))]
         self.stdout.write(f"Starting backup for database: {dbname}")
 
+        if options["apps"]:
+            kind, backup = "logical", self.logical_dump
+        elif options["store"]:
+            kind, backup = "store", self.store_dump
+        else:
+            kind, backup = "dump", self.dump
         try:
-            command = db_save.construct_command(dbname)
-            self.stdout.write(f"Executing backup command: {command}")
-            # Execute the backup command
-            db_save.run_save_command(command)
-            # clean up old backups
-            self.clean_old_backups()
+            # every run, failed or not, goes into the history
+            with metrics.Measure(dbname, kind) as measure:
+                measure.size = backup(dbname, options)
         except Exception as e:
             # CommandError, et non un simple message sur stderr : la commande
             # sortait en 0 même après un pg_dump raté, donc le service systemd
@@ -48,4 +203,5 @@ class Command(BaseCommand):
             # nul pour que OnFailure= se déclenche.
             raise CommandError(f"Error during backup: {e}") from e
         else:
+            self.report(measure)
             self.stdout.write(self.style.SUCCESS("Database backup completed successfully"))
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""
+date: 2026-10-19
+"""
+
+import datetime
+import json
+
+from django.core.management.base import BaseCommand
+
+from base_archives.catalogue import Catalogue, select_kept
+
+class Command(BaseCommand):
+    help = "List the backups of the catalogue, and the retention periods keeping them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dbname',
+            type=str,
+            help='Only list the backups of this database',
+            default=None
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='JSON output',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Rebuild the catalogue from the files of BACKUP_PATH first',
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            Catalogue.rebuild()
+        catalogue = Catalogue.read()
+        kept = select_kept(catalogue.entries())
+        entries = catalogue.entries(options["dbname"])
+        if options["json"]:
+            self.stdout.write(json.dumps(
+                [dict(entry, kept_by=kept.get(entry["name"], [])) for entry in entries], indent=2))
+            return
+        for entry in entries:
+            date = datetime.datetime.fromtimestamp(entry["timestamp"])
+            self.stdout.write(
+                f"{entry['name']:<45} {date:%Y-%m-%d %H:%M} {entry['size']:>14} "
+                f"{(entry['sha256'] or '-')[:12]:<12} {','.join(kept.get(entry['name'], []))}")
+        total = sum(entry["size"] for entry in entries)
+        self.stdout.write(f"{len(entries)} backups, {total} bytes")
@@ -0,0 +1,124 @@
+"""
+date: 2026-10-19
+"""
+
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base_archives import chunkstore, compression, db_save, logical
+from base_archives.resources import ResourcePolicy
+
+class Command(BaseCommand):
+    help = "Restore a database backup made by backup_db (with or without --jobs or --apps)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            type=Path,
+            help='Backup file (or logical backup directory) to restore, '
+                'or backup name with --from-store',
+        )
+        parser.add_argument(
+            '--from-store',
+            action='store_true',
+            help='Restore a backup of the deduplicating chunk store (see backup_db --store)',
+        )
+        parser.add_argument(
+            '--dbname',
+            type=str,
+            help='The setting name of the database to restore into',
+            default="default"
+        )
+        parser.add_argument(
+            '--jobs',
+            type=int,
+            help='Number of parallel restore jobs',
+            default=None
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not ask for confirmation',
+        )
+
+    def phase(self, name, func, *args):
+        """
+        Run func(*args) and report its duration.
+        """
+        start = time.perf_counter()
+        result = func(*args)
+        self.stdout.write(f"{name}: {time.perf_counter() - start:.1f}s")
+        return result
+
+    def confirm(self, options, message):
+        if options["interactive"]:
+            answer = input(f"{message} Type 'yes' to continue: ")
+            if answer != "yes":
+                raise CommandError("Restore cancelled.")
+
+    def logical_restore(self, dbname, path, options):
+        """
+        Sauvegarde logique (backup_db --apps) : seules les tables sauvegardées
+        sont remplacées.
+        """
+        models = [entry["model"] for entry in logical.read_manifest(path)["models"]]
+        self.confirm(
+            options, f"The content of {', '.join(models)} in database '{dbname}' "
+            f"will be replaced by {path}.")
+        start = time.perf_counter()
+        try:
+            counts = logical.load(path, dbname)
+        except Exception as e:
+            raise CommandError(f"Error during restore: {e}") from e
+        for model, count in counts:
+            self.stdout.write(f"{model}: {count} rows")
+        self.stdout.write(self.style.SUCCESS(
+            f"Database restore completed successfully in {time.perf_counter() - start:.1f}s"))
+
+    def handle(self, *args, **options):
+        dbname = options["dbname"]
+        path = options["path"]
+        jobs = options["jobs"]
+        store = None
+        if options["from_store"]:
+            store = chunkstore.ChunkStore()
+            try:
+                store.get_manifest(str(path))
+            except chunkstore.ChunkStoreError as e:
+                raise CommandError(str(e))
+        elif logical.is_logical_backup(path):
+            return self.logical_restore(dbname, path, options)
+        elif not path.is_file():
+            raise CommandError(f"No backup file {path}")
+        self.confirm(options, f"The content of database '{dbname}' will be replaced by {path}.")
+        start = time.perf_counter()
+        settings.BACKUP_PATH.mkdir(parents=True, exist_ok=True)
+        try:
+            with tempfile.TemporaryDirectory(dir=settings.BACKUP_PATH) as tmp:
+                if store is not None:
+                    # chunks are checked against their hash while reassembled
+                    path = self.phase(
+                        "reassemble", store.restore, str(path), Path(tmp) / "backup")
+                if compression.get_codec(path) is not None:
+                    path = self.phase(
+                        "decompress", compression.decompress, path, Path(tmp) / "backup.raw")
+                if db_save.is_packed_directory(path):
+                    # parallel backup : directory format packed in a tar archive
+                    source = Path(tmp) / "dump"
+                    self.phase("unpack", db_save.unpack_archive, path, source)
+                else:
+                    source = path
+                command = db_save.construct_restore_command(dbname, source, jobs=jobs)
+                self.stdout.write(f"Executing restore command: {command}")
+                # restoring is an explicit operation : no resource limits
+                self.phase("restore", db_save.run_save_command, command, ResourcePolicy())
+        except Exception as e:
+            # non zero exit status, see backup_db
+            raise CommandError(f"Error during restore: {e}") from e
+        self.stdout.write(self.style.SUCCESS(
+            f"Database restore completed successfully in {time.perf_counter() - start:.1f}s"))
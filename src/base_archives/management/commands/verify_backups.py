@@ -0,0 +1,66 @@
+"""
+date: 2026-10-19
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base_archives import compression
+
+class Command(BaseCommand):
+    help = "Check backups against their manifest (size and sha256)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='*',
+            type=Path,
+            help='Backup files to check (default: all backups in BACKUP_PATH)',
+        )
+        parser.add_argument(
+            '--deep',
+            action='store_true',
+            help='Also decompress the backups and check the uncompressed data',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of backups checked in parallel',
+            default=4
+        )
+
+    def get_paths(self):
+        """
+        Sauvegardes de BACKUP_PATH : fichiers .sql, compressés ou non. Celles
+        qui n'ont pas de manifeste (antérieures aux manifestes) sont signalées
+        et ignorées.
+        """
+        paths = []
+        for path in sorted(settings.BACKUP_PATH.glob("*.sql*")):
+            if path.name.endswith((".json", ".tmp", ".part", ".raw")) or not path.is_file():
+                continue
+            if compression.get_sidecar_path(path).exists():
+                paths.append(path)
+            else:
+                self.stdout.write(f"SKIPPED {path.name}: no manifest")
+        return paths
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or self.get_paths()
+        deep = options["deep"]
+        with ThreadPoolExecutor(max(options["workers"], 1)) as pool:
+            errors = pool.map(lambda path: compression.verify(path, deep=deep), paths)
+            failed = 0
+            for path, error in zip(paths, errors):
+                if error is None:
+                    self.stdout.write(f"OK {path.name}")
+                else:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f"FAILED {path.name}: {error}"))
+        if failed:
+            # non zero exit status, see backup_db
+            raise CommandError(f"{failed} of {len(paths)} backups failed verification")
+        self.stdout.write(self.style.SUCCESS(f"{len(paths)} backups verified"))
@@ -2,12 +2,22 @@
 date: 2025-07-01
 """
 
+import gzip
+import json
+import shutil
+import time
 from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import Group
 from django.core.management import call_command
 from django.core.management.base import CommandError
 from django.test import tag
 
-from base_archives import db_save
+from base_archives import chunkstore, compression, db_save, logical, metrics
+from base_archives.catalogue import Catalogue
 from dev.test_utils import TestCase
 
 class TestBackupDBCommand(TestCase):
@@ -36,4 +46,277 @@ class TestBackupDBCommand(TestCase):
         out = StringIO()
         with self.assertRaises(CommandError) as ctx:
             call_command("backup_db", dbname="invalid_db", stdout=out)
-        self.assertIn("Error during backup", str(ctx.exception))
\ No newline at end of file
+        self.assertIn("Error during backup", str(ctx.exception))
+
+class TestRestoreDBCommand(TestCase):
+
+    def setUp(self):
+        self.dir = settings.BACKUP_PATH / "restore"
+        self.dir.mkdir(parents=True)
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def test_restore_packed(self):
+        source = self.dir / "source"
+        source.mkdir()
+        (source / "toc.dat").write_bytes(b"toc")
+        archive = self.dir / "backup.sql"
+        db_save.pack_directory(source, archive)
+        restored = []
+
+        def fake_restore(command, policy=None):
+            directory = Path(command[-1])
+            restored.append(sorted(p.name for p in directory.iterdir()))
+            self.assertEqual(command[command.index("-j") + 1], "4")
+
+        out = StringIO()
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_restore):
+            call_command("restore_db", str(archive), jobs=4, interactive=False, stdout=out)
+        self.assertEqual(restored, [["toc.dat"]])
+        self.assertIn("unpack:", out.getvalue())
+        self.assertIn("restore:", out.getvalue())
+        self.assertIn("completed successfully", out.getvalue())
+        # temporary directory removed
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["backup.sql"])
+
+    def test_restore_errors(self):
+        with self.assertRaises(CommandError):
+            call_command("restore_db", str(self.dir / "missing"), interactive=False)
+        backup = self.dir / "backup.sql"
+        backup.write_bytes(b"custom format")
+        with self.assertRaises(CommandError):
+            call_command("restore_db", str(backup), dbname="invalid_db", interactive=False)
+
+
+class TestChunkStoreCommands(TestCase):
+    """
+    backup_db --store et restore_db --from-store, sans pg_dump.
+    """
+
+    def setUp(self):
+        self.addCleanup(shutil.rmtree, settings.BACKUP_PATH / "store", ignore_errors=True)
+
+    def test_backup_and_restore(self):
+        def fake_dump(command):
+            Path(command[command.index("-f") + 1]).write_bytes(b"dump" * 1000)
+
+        out = StringIO()
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_dump):
+            call_command("backup_db", store=True, stdout=out)
+        name = db_save.get_file_path("default").stem
+        self.assertIn(f"Backup stored as {name}", out.getvalue())
+        self.assertIn("Deleted 0 unreferenced chunks", out.getvalue())
+        self.assertFalse(db_save.get_file_path("default").exists())
+        store = chunkstore.ChunkStore()
+        self.assertEqual(store.get_manifest(name)["size"], 4000)
+        self.assertEqual(list(store.root.glob("*.sql")), [])
+
+        restored = []
+
+        def fake_restore(command, policy=None):
+            restored.append(Path(command[-1]).read_bytes())
+
+        out = StringIO()
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_restore):
+            call_command("restore_db", name, from_store=True, interactive=False, stdout=out)
+        self.assertEqual(restored, [b"dump" * 1000])
+        self.assertIn("reassemble:", out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("restore_db", "missing", from_store=True, interactive=False)
+
+
+class TestVerifyBackupsCommand(TestCase):
+
+    def setUp(self):
+        self.addCleanup(self.clean)
+
+    def clean(self):
+        for path in settings.BACKUP_PATH.glob("verify*"):
+            path.unlink()
+
+    def make_backup(self, name, codec):
+        path = settings.BACKUP_PATH / name
+        with open(path, "wb") as f, compression.CompressingWriter(f, codec) as writer:
+            writer.write(b"dump" * 1000)
+        compression.write_sidecar(path, writer.info())
+        return path
+
+    def test_verify(self):
+        self.make_backup("verify1.sql.gz", "gzip")
+        second = self.make_backup("verify2.sql", None)
+        (settings.BACKUP_PATH / "verify3.sql").write_bytes(b"old backup")
+        out = StringIO()
+        call_command("verify_backups", deep=True, stdout=out)
+        self.assertIn("OK verify1.sql.gz", out.getvalue())
+        self.assertIn("OK verify2.sql", out.getvalue())
+        self.assertIn("SKIPPED verify3.sql", out.getvalue())
+
+        second.write_bytes(b"dump" * 999 + b"dumq")
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command("verify_backups", stdout=out)
+        self.assertIn("FAILED verify2.sql: sha256 mismatch", out.getvalue())
+        out = StringIO()
+        call_command("verify_backups", str(settings.BACKUP_PATH / "verify1.sql.gz"), stdout=out)
+        self.assertIn("1 backups verified", out.getvalue())
+
+    def test_restore_compressed(self):
+        path = self.make_backup("verify.sql.gz", "gzip")
+        restored = []
+
+        def fake_restore(command, policy=None):
+            restored.append(Path(command[-1]).read_bytes())
+
+        out = StringIO()
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_restore):
+            call_command("restore_db", str(path), interactive=False, stdout=out)
+        self.assertEqual(restored, [b"dump" * 1000])
+        self.assertIn("decompress:", out.getvalue())
+
+
+class TestListBackupsCommand(TestCase):
+
+    def setUp(self):
+        self.addCleanup(self.clean)
+
+    def clean(self):
+        for path in settings.BACKUP_PATH.glob("*catalogue*"):
+            path.unlink()
+        for path in settings.BACKUP_PATH.glob("*_backup-*"):
+            path.unlink()
+        db_save.get_manifest_path("default").unlink(missing_ok=True)
+
+    def test_backup_retention_and_list(self):
+        old = settings.BACKUP_PATH / "default_backup-2026-01-01.sql"
+        old.write_bytes(b"old")
+        with Catalogue.edit() as catalogue:
+            catalogue.record(old, compression.checksum_info(old), "default",
+                timestamp=time.time() - 86400)
+
+        def fake_dump(command):
+            Path(command[command.index("-f") + 1]).write_bytes(b"dump")
+
+        out = StringIO()
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_dump), \
+                self.settings(ARCHIVES_RETENTION={"daily": 1}):
+            call_command("backup_db", compress="none", stdout=out)
+        self.assertIn(f"Deleted old backup: {old.name}", out.getvalue())
+        self.assertFalse(old.exists())
+
+        out = StringIO()
+        call_command("list_backups", stdout=out)
+        name = db_save.get_file_path("default").name
+        self.assertIn(name, out.getvalue())
+        self.assertIn("1 backups, 4 bytes", out.getvalue())
+        out = StringIO()
+        call_command("list_backups", json=True, dbname="default", stdout=out)
+        entries = json.loads(out.getvalue())
+        self.assertEqual([(e["name"], e["kept_by"]) for e in entries], [(name, ["daily"])])
+
+
+class TestLogicalBackupCommands(TestCase):
+
+    def setUp(self):
+        self.addCleanup(self.clean)
+
+    def clean(self):
+        for path in settings.BACKUP_PATH.glob("default_logical-*"):
+            shutil.rmtree(path)
+
+    def test_backup_and_restore(self):
+        Group.objects.create(name="colleurs")
+        out = StringIO()
+        call_command("backup_db", apps=["auth.Group"], workers=1, stdout=out)
+        path = logical.get_backup_path("default")
+        self.assertIn(f"Logical backup written to {path}", out.getvalue())
+        self.assertIn("auth.Group: 1 rows", out.getvalue())
+        Group.objects.all().delete()
+        out = StringIO()
+        call_command("restore_db", str(path), interactive=False, stdout=out)
+        self.assertIn("auth.Group: 1 rows", out.getvalue())
+        self.assertTrue(Group.objects.filter(name="colleurs").exists())
+
+    def test_unknown_app(self):
+        with self.assertRaises(CommandError):
+            call_command("backup_db", apps=["missing"], stdout=StringIO())
+
+
+class TestBackupMetrics(TestCase):
+
+    def setUp(self):
+        self.addCleanup(self.clean)
+        for _ in range(3):
+            metrics.record(metrics.make_entry("default", "dump", 0, 100, 10))
+
+    def clean(self):
+        metrics.get_history_path().unlink(missing_ok=True)
+        for path in settings.BACKUP_PATH.glob("*catalogue*"):
+            path.unlink()
+        for path in settings.BACKUP_PATH.glob("default_backup-*"):
+            path.unlink()
+
+    def backup(self, **settings):
+        def fake_dump(command):
+            Path(command[command.index("-f") + 1]).write_bytes(b"x" * 30)
+
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_dump), \
+                self.settings(**settings):
+            call_command("backup_db", compress="none", stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_warn(self):
+        out, err = self.backup()
+        self.assertIn("Backup of 30 bytes", out)
+        self.assertIn("Backup regression: size 30 is 3.0 times the median", err)
+        entry = metrics.read_history("default")[-1]
+        self.assertEqual((entry["kind"], entry["status"], entry["size"]), ("dump", "ok", 30))
+
+    def test_fail(self):
+        with self.assertRaisesMessage(CommandError, "Backup regression: size 30"):
+            self.backup(ARCHIVES_METRICS={"action": "fail"})
+        out, err = self.backup(ARCHIVES_METRICS={"factor": 5})
+        self.assertEqual(err, "")
+
+    def test_failed_backup_recorded(self):
+        with mock.patch.object(db_save, "run_save_command", side_effect=OSError("disk full")):
+            with self.assertRaises(CommandError):
+                call_command("backup_db", compress="none", stdout=StringIO())
+        entry = metrics.read_history("default")[-1]
+        self.assertEqual((entry["status"], entry["error"]), ("failed", "disk full"))
+
+
+class TestBackupCopies(TestCase):
+
+    def setUp(self):
+        self.copy = settings.BACKUP_PATH / "copies"
+        self.addCleanup(self.clean)
+
+    def clean(self):
+        shutil.rmtree(self.copy, ignore_errors=True)
+        metrics.get_history_path().unlink(missing_ok=True)
+        for path in settings.BACKUP_PATH.glob("*catalogue*"):
+            path.unlink()
+        for path in settings.BACKUP_PATH.glob("default_*"):
+            path.unlink()
+
+    def test_copy_and_retention(self):
+        old = self.copy / "default_backup-2026-01-01.sql"
+        self.copy.mkdir(parents=True)
+        old.write_bytes(b"old")
+        (settings.BACKUP_PATH / old.name).write_bytes(b"old")
+        with Catalogue.edit() as catalogue:
+            catalogue.record(settings.BACKUP_PATH / old.name, {}, "default",
+                timestamp=time.time() - 86400)
+
+        def fake_dump(command, output=None):
+            output.write(b"dump")
+
+        out = StringIO()
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_dump), \
+                self.settings(ARCHIVES_RETENTION={"daily": 1}):
+            call_command("backup_db", compress="none", copies=[self.copy], stdout=out)
+        path = db_save.get_file_path("default")
+        self.assertIn(f"Copy written to {self.copy / path.name}", out.getvalue())
+        self.assertEqual((self.copy / path.name).read_bytes(), b"dump")
+        self.assertIsNone(compression.verify(self.copy / path.name))
+        self.assertFalse(old.exists())
@@ -0,0 +1,145 @@
+"""
+date: 2026-10-19
+
+Historique des sauvegardes (BACKUP_PATH/metrics.jsonl, une ligne JSON par
+exécution de backup_db) : durée, taille, débit et issue. Une sauvegarde dont la
+durée ou la taille dépasse factor fois la médiane des window dernières
+sauvegardes réussies de la même base (et du même type) est signalée :
+
+    ARCHIVES_METRICS = {
+        "window": 10,
+        "factor": 2.0,
+        "min_runs": 3,      # pas d'alerte avec un historique plus court
+        "action": "warn",   # ou "fail" : backup_db sort en erreur
+    }
+"""
+import fcntl
+import json
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+DEFAULT_METRICS = {"window": 10, "factor": 2.0, "min_runs": 3, "action": "warn"}
+ACTIONS = ("warn", "fail")
+OK = "ok"
+FAILED = "failed"
+
+
+def get_config() -> dict:
+    config = dict(DEFAULT_METRICS)
+    configured = getattr(settings, "ARCHIVES_METRICS", None) or {}
+    unknown = set(configured) - set(DEFAULT_METRICS)
+    if unknown:
+        raise ValueError(f"Unknown ARCHIVES_METRICS keys: {', '.join(sorted(unknown))}")
+    config.update(configured)
+    if config["action"] not in ACTIONS:
+        raise ValueError(f"ARCHIVES_METRICS action must be one of {', '.join(ACTIONS)}")
+    return config
+
+
+def get_history_path() -> Path:
+    return settings.BACKUP_PATH / "metrics.jsonl"
+
+
+def make_entry(database: str, kind: str, started: float, duration: float,
+        size: int|None=None, error: str|None=None) -> dict:
+    return {
+        "database": database,
+        "kind": kind,
+        "started": started,
+        "duration": duration,
+        "size": size,
+        "throughput": size / duration if size and duration else None,
+        "status": FAILED if error else OK,
+        "error": error,
+    }
+
+
+def record(entry: dict):
+    path = get_history_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.write(json.dumps(entry) + "\n")
+
+
+def read_history(database: str|None=None, kind: str|None=None) -> list[dict]:
+    """
+    Exécutions enregistrées, de la plus ancienne à la plus récente. Les lignes
+    illisibles (écriture interrompue) sont ignorées.
+    """
+    entries = []
+    try:
+        with open(get_history_path()) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if database is not None and entry.get("database") != database:
+                    continue
+                if kind is not None and entry.get("kind") != kind:
+                    continue
+                entries.append(entry)
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def check_regression(entry: dict, history: list[dict], config: dict|None=None) -> list[str]:
+    """
+    Écarts de entry par rapport à la médiane des dernières sauvegardes
+    réussies de history (qui ne contient pas entry) : liste de messages, vide
+    si tout va bien.
+    """
+    config = config or get_config()
+    previous = [e for e in history if e["status"] == OK][-config["window"]:]
+    if entry["status"] != OK or len(previous) < config["min_runs"]:
+        return []
+    messages = []
+    for key in ("duration", "size"):
+        values = [e[key] for e in previous if e.get(key)]
+        if not values or not entry.get(key):
+            continue
+        median = statistics.median(values)
+        if entry[key] > config["factor"] * median:
+            messages.append(
+                f"{key} {entry[key]:.6g} is {entry[key] / median:.1f} times the median "
+                f"of the last {len(values)} backups ({median:.6g})")
+    return messages
+
+
+class Measure():
+    """
+    Mesure une sauvegarde et l'enregistre dans l'historique à la sortie du
+    bloc, réussie ou non :
+
+        with Measure("default", "dump") as measure:
+            path = create_dump("default")
+            measure.size = path.stat().st_size
+        measure.regressions  # voir check_regression
+    """
+
+    def __init__(self, database: str, kind: str):
+        self.database = database
+        self.kind = kind
+        self.size = None
+        self.entry = None
+        self.regressions = []
+        # an invalid setting fails before the backup
+        self.config = get_config()
+
+    def __enter__(self):
+        self.started = time.time()
+        self._start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.entry = make_entry(
+            self.database, self.kind, self.started, time.monotonic() - self._start,
+            self.size, None if exc is None else str(exc) or exc_type.__name__)
+        history = read_history(self.database, self.kind)
+        record(self.entry)
+        self.regressions = check_regression(self.entry, history, self.config)
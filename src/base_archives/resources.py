@@ -0,0 +1,125 @@
+"""
+date: 2026-10-19
+
+Limites de ressources des commandes de sauvegarde, pour ne pas pénaliser les
+utilisateurs pendant une sauvegarde.
+
+Réglage ARCHIVES_RESOURCE_POLICY, par exemple :
+
+    ARCHIVES_RESOURCE_POLICY = {
+        "nice": 10,                      # priorité CPU (nice -n)
+        "ionice_class": 2,               # classe d'E/S (ionice -c), 3 : au repos
+        "ionice_level": 7,               # priorité dans la classe (ionice -n)
+        "bandwidth": 20 * 1024 * 1024,   # octets/s lus sur la sortie de la commande
+        "timeout": 2 * 3600,             # secondes, la commande est tuée au-delà
+    }
+
+nice et ionice préfixent la commande (argv), ils doivent être installés. La
+limite de débit est appliquée par le lecteur Python de la sortie standard : le
+tube plein fait attendre la commande, qui ne lit donc pas la base plus vite.
+"""
+import logging
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+POLICY_KEYS = ("nice", "ionice_class", "ionice_level", "bandwidth", "timeout")
+
+
+class Throttle():
+    """
+    Limite le débit moyen à rate octets/s : appeler throttle(n) après chaque
+    bloc de n octets.
+    """
+
+    def __init__(self, rate: float, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self.start = clock()
+        self.total = 0
+
+    def __call__(self, nbytes: int):
+        self.total += nbytes
+        delay = self.total / self.rate - (self.clock() - self.start)
+        if delay > 0:
+            self.sleep(delay)
+
+
+class ResourcePolicy():
+
+    def __init__(self, nice: int|None=None, ionice_class: int|None=None,
+            ionice_level: int|None=None, bandwidth: int|None=None, timeout: float|None=None):
+        if bandwidth is not None and bandwidth <= 0:
+            raise ValueError("bandwidth must be positive")
+        if timeout is not None and timeout <= 0:
+            raise ValueError("timeout must be positive")
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
+        self.bandwidth = bandwidth
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls) -> "ResourcePolicy":
+        policy = getattr(settings, "ARCHIVES_RESOURCE_POLICY", None) or {}
+        unknown = set(policy) - set(POLICY_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown ARCHIVES_RESOURCE_POLICY keys: {', '.join(sorted(unknown))}")
+        return cls(**policy)
+
+    def __str__(self):
+        parts = []
+        if self.nice is not None:
+            parts.append(f"nice={self.nice}")
+        if self.ionice_class is not None:
+            level = f"/{self.ionice_level}" if self.ionice_level is not None else ""
+            parts.append(f"ionice={self.ionice_class}{level}")
+        if self.bandwidth is not None:
+            parts.append(f"bandwidth={format_rate(self.bandwidth)}")
+        if self.timeout is not None:
+            parts.append(f"timeout={self.timeout}s")
+        return " ".join(parts) or "unrestricted"
+
+    def wrap(self, command: list[str]) -> list[str]:
+        """
+        command préfixée par nice et ionice.
+        """
+        prefix = []
+        if self.ionice_class is not None:
+            prefix += ["ionice", "-c", str(self.ionice_class)]
+            if self.ionice_level is not None:
+                prefix += ["-n", str(self.ionice_level)]
+        if self.nice is not None:
+            prefix += ["nice", "-n", str(self.nice)]
+        return prefix + command
+
+    def throttle(self) -> Throttle|None:
+        return Throttle(self.bandwidth) if self.bandwidth else None
+
+    def start_timer(self, process: subprocess.Popen) -> threading.Timer|None:
+        """
+        Minuteur qui tue process après timeout secondes (timer.expired vaut
+        alors True). À arrêter par cancel() en fin de commande.
+        """
+        if self.timeout is None:
+            return None
+
+        def kill():
+            timer.expired = True
+            logger.error("Backup command killed after %ss", self.timeout)
+            process.kill()
+
+        timer = threading.Timer(self.timeout, kill)
+        timer.expired = False
+        timer.daemon = True
+        timer.start()
+        return timer
+
+
+def format_rate(rate: float) -> str:
+    return f"{rate / (1024 * 1024):.1f} MiB/s"
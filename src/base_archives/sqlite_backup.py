@@ -0,0 +1,80 @@
+"""
+date: 2026-10-19
+
+Sauvegarde d'une base SQLite dans le processus, sans binaire externe, par
+l'API de sauvegarde de SQLite (sqlite3.Connection.backup).
+
+La copie se fait par paquets de ARCHIVES_SQLITE_BACKUP_PAGES pages : entre deux
+paquets le verrou en lecture est relâché et les écritures de l'application
+peuvent passer. Une écriture pendant la copie la fait reprendre au début, la
+sauvegarde est donc toujours un instantané cohérent. Le résultat est vérifié par
+PRAGMA integrity_check.
+"""
+import logging
+import sqlite3
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class IntegrityCheckError(Exception):
+    """
+    La copie ne passe pas PRAGMA integrity_check.
+    """
+
+
+def connect_source(name) -> sqlite3.Connection:
+    """
+    Connexion en lecture seule à la base NAME des réglages Django, qui peut être
+    un chemin ou une URI "file:" (bases de test en mémoire partagée).
+    """
+    name = str(name)
+    if name.startswith("file:"):
+        return sqlite3.connect(name, uri=True)
+    if name == ":memory:":
+        raise ValueError("A private in-memory SQLite database cannot be backed up.")
+    if not Path(name).is_file():
+        raise ValueError(f"No SQLite database {name}.")
+    return sqlite3.connect(f"file:{quote(name)}?mode=ro", uri=True)
+
+
+def integrity_check(connection: sqlite3.Connection):
+    rows = connection.execute("PRAGMA integrity_check").fetchall()
+    if rows != [("ok",)]:
+        raise IntegrityCheckError("; ".join(row[0] for row in rows[:10]))
+
+
+def backup(db_settings: dict, path: Path, pages: int|None=None, progress=None) -> Path:
+    """
+    Copie la base décrite par db_settings (un élément de settings.DATABASES)
+    dans le fichier path, remplacé s'il existe.
+
+    progress(copied, total) est appelé après chaque paquet de pages.
+    """
+    if pages is None:
+        pages = getattr(settings, "ARCHIVES_SQLITE_BACKUP_PAGES", 1024)
+    path = Path(path)
+    path.unlink(missing_ok=True)
+
+    def report(status, remaining, total):
+        logger.debug("SQLite backup of %s: %s/%s pages", db_settings["NAME"], total - remaining, total)
+        if progress is not None:
+            progress(total - remaining, total)
+
+    source = connect_source(db_settings["NAME"])
+    try:
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target, pages=pages, progress=report)
+            integrity_check(target)
+        finally:
+            target.close()
+    except Exception:
+        path.unlink(missing_ok=True)
+        raise
+    finally:
+        source.close()
+    return path
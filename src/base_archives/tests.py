@@ -3,9 +3,32 @@ See content.archive for more tests.
 Most parts of this app used to be in content.archive, but were moved
 to archives app to allow for a more generic backup system.
 """
+import bz2
+import datetime
+import fcntl
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+import unittest
+from unittest import mock
+
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
 
-from base_archives import db_save
+from base_archives import (
+    catalogue, chunkstore, compression, db_save, fanout, jobs, logical, metrics, resources,
+    sqlite_backup)
 from dev.test_utils import TestCase
 from dev import test_view, test_data
 
@@ -51,6 +74,856 @@ class TestExplicitPath(TestCase):
         target.parent.rmdir()
 
 
+def python_command(code: str) -> list[str]:
+    """
+    Commande de sauvegarde factice, pour tester sans pg_dump.
+    """
+    return [sys.executable, "-c", code]
+
+WRITE_300K = "import sys; sys.stdout.buffer.write(b'x' * 300000)"
+
+
+class TestDumpStream(TestCase):
+
+    def test_chunks_and_tee(self):
+        tee = settings.BACKUP_PATH / "tee.dump"
+        stream = db_save.DumpStream(python_command(WRITE_300K), chunk_size=65536, tee=tee)
+        chunks = list(stream)
+        self.assertEqual(len(chunks[0]), 65536)
+        self.assertEqual(b"".join(chunks), b"x" * 300000)
+        stream.close()
+        self.assertEqual(tee.read_bytes(), b"x" * 300000)
+        tee.unlink()
+
+    def test_failure(self):
+        tee = settings.BACKUP_PATH / "tee.dump"
+        stream = db_save.DumpStream(
+            python_command("import sys; sys.stdout.write('partial'); sys.exit(3)"), tee=tee)
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            list(stream)
+        self.assertEqual(ctx.exception.returncode, 3)
+        stream.close()
+        self.assertEqual(list(settings.BACKUP_PATH.glob("tee.dump*")), [])
+
+    def test_client_disconnect(self):
+        stream = db_save.DumpStream(
+            python_command("import time; print('a', flush=True); time.sleep(30)"), chunk_size=1)
+        next(iter(stream))
+        stream.close()
+        self.assertIsNotNone(stream.process.returncode)
+
+    def test_stream_command(self):
+        command = db_save.construct_command("default", stream=True)
+        self.assertNotIn("-f", command)
+
+
+def fake_dump(command):
+    """
+    Remplace run_save_command : écrit le fichier de sortie (après -f).
+    """
+    fake_dump.calls += 1
+    Path(command[command.index("-f") + 1]).write_bytes(b"dump")
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        fake_dump.calls = 0
+        patcher = mock.patch.object(db_save, "run_save_command", side_effect=fake_dump)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.clean_files)
+
+    def clean_files(self):
+        db_save.get_file_path("default").unlink(missing_ok=True)
+        compression.get_sidecar_path(db_save.get_file_path("default")).unlink(missing_ok=True)
+        catalogue.Catalogue.get_path().unlink(missing_ok=True)
+        db_save.get_manifest_path("default").unlink(missing_ok=True)
+
+    def test_reuse_recent(self):
+        path = db_save.get_or_create_dump("default")
+        self.assertEqual(path, db_save.get_file_path("default"))
+        self.assertEqual(path.read_bytes(), b"dump")
+        self.assertIsNone(compression.verify(path))
+        self.assertEqual(db_save.recent_dump("default"), path)
+        self.assertEqual(db_save.get_or_create_dump("default"), path)
+        self.assertEqual(fake_dump.calls, 1)
+        # too old
+        self.assertIsNone(db_save.recent_dump("default", max_age=datetime.timedelta(0)))
+        db_save.get_or_create_dump("default", max_age=datetime.timedelta(0))
+        self.assertEqual(fake_dump.calls, 2)
+        # changed since
+        path.write_bytes(b"other")
+        self.assertIsNone(db_save.recent_dump("default"))
+
+    def test_lock(self):
+        lock = db_save.DumpLock("default")
+        self.assertTrue(lock.acquire(blocking=False))
+        other = db_save.DumpLock("default")
+        self.assertFalse(other.acquire(blocking=False))
+        lock.release()
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
+    def test_concurrent_requests(self):
+        """
+        Deux demandes simultanées : la seconde attend la sauvegarde de la
+        première et la réutilise.
+        """
+        lock = db_save.DumpLock("default")
+        lock.acquire()
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(db_save.get_or_create_dump("default")))
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(results, [])  # waiting for the lock
+        db_save.create_dump("default")
+        lock.release()
+        thread.join()
+        self.assertEqual(results, [db_save.get_file_path("default")])
+        self.assertEqual(fake_dump.calls, 1)
+
+    def test_unknown_db(self):
+        with self.assertRaises(ValueError):
+            db_save.get_or_create_dump("../../etc")
+
+
+def fake_parallel_dump(command):
+    """
+    Remplace run_save_command pour une sauvegarde parallèle : écrit un
+    répertoire de sauvegarde.
+    """
+    directory = Path(command[command.index("-f") + 1])
+    directory.mkdir()
+    (directory / "toc.dat").write_bytes(b"toc")
+    (directory / "3000.dat.gz").write_bytes(b"table")
+
+
+class TestParallel(TestCase):
+
+    def test_commands(self):
+        command = db_save.construct_command("default", settings.BACKUP_PATH / "dir", jobs=4)
+        self.assertEqual(command[1:3], ["-F", "d"])
+        self.assertIn("-j", command)
+        self.assertEqual(command[command.index("-j") + 1], "4")
+        self.assertNotIn("-j", db_save.construct_command("default", settings.BACKUP_PATH / "f"))
+        with self.assertRaises(ValueError):
+            db_save.construct_command("default", stream=True, jobs=2)
+        self.assertNotIn("-Z", db_save.construct_command("default", stream=True))
+        command = db_save.construct_command("default", stream=True, store=True)
+        self.assertEqual(command[command.index("-Z") + 1], "0")
+        path = settings.BACKUP_PATH / "a backup.tar"
+        command = db_save.construct_restore_command("default", path, jobs=3)
+        self.assertTrue(command[0].endswith("pg_restore"))
+        self.assertEqual(command[-1], str(path))
+        self.assertEqual(command[command.index("-j") + 1], "3")
+
+    def test_pack_round_trip(self):
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_parallel_dump):
+            path = db_save.create_dump("default", settings.BACKUP_PATH / "par" / "p.sql", jobs=2)
+        self.assertTrue(db_save.is_packed_directory(path))
+        self.assertEqual(sorted(p.name for p in path.parent.iterdir()), ["p.sql", "p.sql.json"])
+        target = settings.BACKUP_PATH / "par" / "out"
+        db_save.unpack_archive(path, target)
+        self.assertEqual((target / "3000.dat.gz").read_bytes(), b"table")
+        shutil.rmtree(path.parent)
+
+
+class TestResourcePolicy(TestCase):
+
+    def test_wrap(self):
+        policy = db_save.ResourcePolicy(nice=10, ionice_class=2, ionice_level=7)
+        self.assertEqual(policy.wrap(["pg_dump"]),
+            ["ionice", "-c", "2", "-n", "7", "nice", "-n", "10", "pg_dump"])
+        self.assertEqual(str(policy), "nice=10 ionice=2/7")
+        self.assertEqual(db_save.ResourcePolicy().wrap(["pg_dump"]), ["pg_dump"])
+        self.assertEqual(str(db_save.ResourcePolicy()), "unrestricted")
+
+    def test_settings(self):
+        with self.settings(ARCHIVES_RESOURCE_POLICY={"nice": 5, "bandwidth": 1024}):
+            policy = db_save.ResourcePolicy.from_settings()
+        self.assertEqual((policy.nice, policy.bandwidth), (5, 1024))
+        with self.settings(ARCHIVES_RESOURCE_POLICY={"nicety": 5}):
+            with self.assertRaises(ValueError):
+                db_save.ResourcePolicy.from_settings()
+
+    def test_throttle(self):
+        sleeps = []
+        throttle = resources.Throttle(1000, clock=lambda: 0, sleep=sleeps.append)
+        throttle(500)
+        throttle(1500)
+        self.assertEqual(sleeps, [0.5, 2.0])
+
+    def test_nice_and_output(self):
+        output = settings.BACKUP_PATH / "nice.out"
+        self.addCleanup(output.unlink)
+        db_save.run_save_command(
+            python_command("import os; print(os.nice(0))"),
+            db_save.ResourcePolicy(nice=5), output=output)
+        self.assertEqual(int(output.read_text()), os.nice(0) + 5)
+
+    def test_bandwidth(self):
+        output = settings.BACKUP_PATH / "slow.out"
+        self.addCleanup(output.unlink)
+        start = time.monotonic()
+        with self.settings(ARCHIVES_STREAM_CHUNK_SIZE=65536):
+            db_save.run_save_command(
+                python_command(WRITE_300K), db_save.ResourcePolicy(bandwidth=1_000_000),
+                output=output)
+        self.assertGreater(time.monotonic() - start, 0.25)
+        self.assertEqual(output.read_bytes(), b"x" * 300000)
+
+    def test_timeout_and_failure(self):
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            db_save.run_save_command(
+                python_command("import time; time.sleep(30)"), db_save.ResourcePolicy(timeout=0.2))
+        self.assertLess(time.monotonic() - start, 10)
+        with self.assertRaises(subprocess.CalledProcessError):
+            db_save.run_save_command(
+                python_command("import sys; sys.exit(2)"), db_save.ResourcePolicy(timeout=10))
+
+    def test_stream_timeout(self):
+        stream = db_save.DumpStream(
+            python_command("import time; print('a', flush=True); time.sleep(30)"),
+            chunk_size=1, policy=db_save.ResourcePolicy(timeout=0.2))
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(stream)
+        stream.close()
+
+    def test_create_dump_bandwidth(self):
+        """
+        Avec une limite de débit, la sortie de la commande passe par Python.
+        """
+        calls = []
+
+        def fake_stream_dump(command, policy=None, output=None):
+            calls.append(command)
+            output.write_bytes(b"dump")
+
+        target = settings.BACKUP_PATH / "limited" / "dump.sql"
+        self.addCleanup(shutil.rmtree, target.parent)
+        with self.settings(ARCHIVES_RESOURCE_POLICY={"bandwidth": 1024}), \
+                mock.patch.object(db_save, "run_save_command", side_effect=fake_stream_dump):
+            db_save.create_dump("default", target)
+        self.assertNotIn("-f", calls[0])
+        self.assertEqual(target.read_bytes(), b"dump")
+
+
+class TestCompression(TestCase):
+
+    def setUp(self):
+        self.dir = settings.BACKUP_PATH / "compression"
+        self.dir.mkdir(parents=True)
+        self.addCleanup(shutil.rmtree, self.dir)
+        rng = random.Random(1)
+        self.data = b"".join(rng.choice([b"insert ", b"into ", b"values ", b"1, ", b"2;\n"])
+            for _ in range(40000))
+
+    def test_codecs(self):
+        for codec in compression.CODECS:
+            with self.subTest(codec=codec):
+                path = self.dir / f"data.{codec}"
+                with open(path, "wb") as f, compression.CompressingWriter(
+                        f, codec, 1, workers=3, block_size=10000) as writer:
+                    for i in range(0, len(self.data), 7000):
+                        writer.write(self.data[i:i + 7000])
+                info = writer.info()
+                with compression.CODECS[codec][1](path, "rb") as f:
+                    self.assertEqual(f.read(), self.data)
+                self.assertEqual(info["size"], path.stat().st_size)
+                self.assertLess(info["size"], len(self.data))
+                self.assertEqual(info["sha256"], compression.file_sha256(path))
+                self.assertEqual(info["raw_sha256"], hashlib.sha256(self.data).hexdigest())
+
+    def test_empty(self):
+        path = self.dir / "empty.gz"
+        with open(path, "wb") as f, compression.CompressingWriter(f, "gzip") as writer:
+            pass
+        with gzip.open(path) as f:
+            self.assertEqual(f.read(), b"")
+
+    def test_settings(self):
+        with self.settings(ARCHIVES_COMPRESSION={"codec": "xz", "level": 2, "workers": 2}):
+            self.assertEqual(compression.get_compression(),
+                {"codec": "xz", "level": 2, "workers": 2})
+            self.assertEqual(compression.get_compression("gzip")["level"], 6)
+            self.assertIsNone(compression.get_compression("none")["codec"])
+        with self.assertRaises(ValueError):
+            compression.get_compression("zip")
+
+    def test_create_dump(self):
+        """
+        La sortie de la commande est compressée au fil de l'eau, le manifeste
+        permet de vérifier la sauvegarde.
+        """
+        target = self.dir / "dump.sql"
+        with mock.patch.object(db_save, "construct_command",
+                return_value=python_command(WRITE_300K)):
+            path = db_save.create_dump("default", target, codec="bz2", level=1)
+        self.assertEqual(path.name, "dump.sql.bz2")
+        self.assertEqual(bz2.decompress(path.read_bytes()), b"x" * 300000)
+        info = json.loads(compression.get_sidecar_path(path).read_text())
+        self.assertEqual((info["codec"], info["raw_size"], info["file"]), ("bz2", 300000, path.name))
+        self.assertIsNone(compression.verify(path, deep=True))
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir()), ["dump.sql.bz2", "dump.sql.bz2.json"])
+
+        data = path.read_bytes()
+        path.write_bytes(data[:-1] + bytes([data[-1] ^ 1]))
+        self.assertEqual(compression.verify(path), "sha256 mismatch")
+        path.write_bytes(data[:-1])
+        self.assertIn("size", compression.verify(path))
+        path.unlink()
+        self.assertEqual(compression.verify(path), "missing backup file")
+
+
+class FullDisk():
+
+    def __init__(self, f, limit):
+        self.f = f
+        self.limit = limit
+
+    def write(self, data):
+        if self.f.tell() + len(data) > self.limit:
+            raise OSError(28, "No space left on device")
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+class TestFanOut(TestCase):
+
+    def setUp(self):
+        self.dir = settings.BACKUP_PATH / "fanout"
+        self.dir.mkdir(parents=True)
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.data = [bytes([i]) * 1000 for i in range(50)]
+
+    def test_isolation(self):
+        (self.dir / "file").write_bytes(b"")
+        paths = [self.dir / "a" / "dump", self.dir / "b" / "dump", self.dir / "file" / "dump"]
+        with fanout.FanOutWriter(paths, queue_size=2) as out:
+            full = out.destinations[1]
+            full.file = FullDisk(full.file, 10000)
+            for block in self.data:
+                out.write(block)
+        first, second, third = out.results()
+        data = b"".join(self.data)
+        self.assertEqual((first["size"], first["sha256"], first["error"]),
+            (len(data), hashlib.sha256(data).hexdigest(), None))
+        self.assertEqual(paths[0].read_bytes(), data)
+        self.assertIn("No space left", second["error"])
+        self.assertIsNone(second["sha256"])
+        self.assertIsNotNone(third["error"])
+        self.assertEqual(sorted(p.name for p in paths[1].parent.iterdir()), [])
+
+    def test_all_failed_and_abort(self):
+        (self.dir / "file").write_bytes(b"")
+        with self.assertRaises(OSError):
+            with fanout.FanOutWriter([self.dir / "file" / "dump"]) as out:
+                out.write(b"data")
+        path = self.dir / "dump"
+        with self.assertRaises(RuntimeError):
+            with fanout.FanOutWriter([path]) as out:
+                out.write(b"data")
+                raise RuntimeError("boom")
+        self.assertEqual(list(self.dir.iterdir()), [self.dir / "file"])
+
+    def test_create_dump_copies(self):
+        target = self.dir / "dump.sql"
+        copies = [self.dir / "copy1", self.dir / "file" / "copy2"]
+        (self.dir / "file").write_bytes(b"")
+        with mock.patch.object(db_save, "construct_command",
+                return_value=python_command(WRITE_300K)):
+            path = db_save.create_dump("default", target, codec="none", copies=copies)
+        self.assertEqual(path.read_bytes(), b"x" * 300000)
+        copy = copies[0] / "dump.sql"
+        self.assertEqual(copy.read_bytes(), b"x" * 300000)
+        self.assertIsNone(compression.verify(copy, deep=True))
+        info = json.loads(compression.get_sidecar_path(path).read_text())
+        self.assertEqual([c["error"] is None for c in info["copies"]], [True, False])
+        self.assertEqual(info["copies"][0]["sha256"], info["sha256"])
+
+        # the copies are kept even if the backup itself fails
+        copy.unlink()
+        finish = fanout.Destination.finish
+
+        def fail_primary(destination):
+            if destination.path.parent == self.dir:
+                destination.fail(OSError("disk full"))
+            else:
+                finish(destination)
+
+        with mock.patch.object(db_save, "construct_command",
+                return_value=python_command(WRITE_300K)), \
+                mock.patch.object(fanout.Destination, "finish", fail_primary):
+            with self.assertRaisesMessage(OSError, "disk full"):
+                db_save.create_dump("default", target, codec="gzip", copies=copies[:1])
+        self.assertFalse((self.dir / "dump.sql.gz").exists())
+        copy = copies[0] / "dump.sql.gz"
+        self.assertEqual(gzip.decompress(copy.read_bytes()), b"x" * 300000)
+        self.assertIsNone(compression.verify(copy))
+
+
+class TestCatalogue(TestCase):
+
+    def setUp(self):
+        self.addCleanup(self.clean)
+
+    def clean(self):
+        for path in settings.BACKUP_PATH.glob("*catalogue*"):
+            path.unlink()
+        for path in settings.BACKUP_PATH.glob("*_backup-*"):
+            path.unlink()
+
+    def test_select_kept(self):
+        """
+        Une sauvegarde par jour pendant 400 jours, jusqu'au lundi 19 octobre
+        2026.
+        """
+        last = datetime.datetime(2026, 10, 19, 3)
+        entries = []
+        for i in range(400):
+            date = last - datetime.timedelta(days=i)
+            entries.append({"name": f"{date:%Y-%m-%d}", "database": "default",
+                "timestamp": date.timestamp()})
+        kept = catalogue.select_kept(entries, {"daily": 7, "weekly": 4, "monthly": 12})
+        expected = [f"2026-10-{day}" for day in range(13, 20)]  # daily
+        expected += ["2026-10-04", "2026-10-11"]  # weekly, with 18 and 19
+        expected += ["2025-11-30", "2025-12-31", "2026-01-31", "2026-02-28", "2026-03-31",
+            "2026-04-30", "2026-05-31", "2026-06-30", "2026-07-31", "2026-08-31",
+            "2026-09-30"]  # monthly, with 19
+        self.assertEqual(sorted(kept), sorted(expected))
+        self.assertEqual(kept["2026-10-19"], ["daily", "weekly", "monthly"])
+        self.assertEqual(kept["2026-10-18"], ["daily", "weekly"])
+        # each database has its own points
+        other = [dict(entry, name="other" + entry["name"], database="other") for entry in entries[:3]]
+        kept = catalogue.select_kept(entries + other, {"daily": 2})
+        self.assertEqual(sorted(kept), ["2026-10-18", "2026-10-19", "other2026-10-18", "other2026-10-19"])
+
+    def test_retention(self):
+        now = time.time()
+        names = []
+        with self.settings(ARCHIVES_RETENTION={"daily": 2}):
+            with catalogue.Catalogue.edit() as cat:
+                for days in range(3):
+                    path = settings.BACKUP_PATH / f"default_backup-{days}.sql"
+                    path.write_bytes(b"dump")
+                    compression.write_sidecar(path, compression.checksum_info(path))
+                    cat.record(path, compression.checksum_info(path), "default",
+                        timestamp=now - days * 86400)
+                    names.append(path.name)
+            with catalogue.Catalogue.edit() as cat:
+                deleted = cat.apply_retention()
+        self.assertEqual([entry["name"] for entry in deleted], [names[2]])
+        self.assertFalse((settings.BACKUP_PATH / names[2]).exists())
+        self.assertFalse((settings.BACKUP_PATH / (names[2] + ".json")).exists())
+        self.assertTrue((settings.BACKUP_PATH / names[1]).exists())
+        self.assertEqual(
+            [entry["name"] for entry in catalogue.Catalogue.read().entries()], names[1::-1])
+
+    def test_create_dump_and_scan(self):
+        with mock.patch.object(db_save, "run_save_command", side_effect=fake_dump):
+            fake_dump.calls = 0
+            path = db_save.create_dump("default")
+        entry = catalogue.Catalogue.read().get(path.name)
+        self.assertEqual((entry["database"], entry["size"]), ("default", 4))
+        self.assertEqual(entry["sha256"], hashlib.sha256(b"dump").hexdigest())
+        # missing catalogue : rebuilt from the directory
+        old = settings.BACKUP_PATH / "other_backup-2020-01-01.sql"
+        old.write_bytes(b"old")
+        os.utime(old, (0, datetime.datetime(2020, 1, 1).timestamp()))
+        catalogue.Catalogue.get_path().unlink()
+        entries = catalogue.Catalogue.read().entries()
+        self.assertEqual([e["name"] for e in entries], [old.name, path.name])
+        self.assertEqual(entries[0]["database"], "other")
+        self.assertEqual(entries[1]["sha256"], entry["sha256"])
+
+
+class TestSqliteBackup(TestCase):
+
+    def setUp(self):
+        self.dir = settings.BACKUP_PATH / "sqlite"
+        self.dir.mkdir(parents=True)
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.source = self.dir / "source.db"
+        with sqlite3.connect(self.source) as conn:
+            conn.execute("create table t (id integer primary key, data text)")
+            conn.executemany("insert into t (data) values (?)", [("x" * 500,)] * 2000)
+        conn.close()
+        self.db_settings = {"ENGINE": "django.db.backends.sqlite3", "NAME": str(self.source)}
+
+    def count(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("select count(*) from t").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_backup_progress(self):
+        steps = []
+        target = self.dir / "copy.db"
+        sqlite_backup.backup(self.db_settings, target, pages=20,
+            progress=lambda copied, total: steps.append((copied, total)))
+        self.assertGreater(len(steps), 5)
+        self.assertEqual(steps[-1][0], steps[-1][1])
+        self.assertEqual(self.count(target), 2000)
+
+    def test_write_during_backup(self):
+        """
+        Une écriture entre deux paquets de pages se retrouve dans la copie.
+        """
+        target = self.dir / "copy.db"
+        written = []
+
+        def write(copied, total):
+            # the copy restarts after the write : write only once
+            if copied == 100 and not written:
+                written.append(copied)
+                with sqlite3.connect(self.source) as conn:
+                    conn.execute("insert into t (data) values ('new')")
+                conn.close()
+
+        sqlite_backup.backup(self.db_settings, target, pages=100, progress=write)
+        self.assertEqual(self.count(target), 2001)
+
+    def test_integrity_failure(self):
+        target = self.dir / "copy.db"
+        with mock.patch.object(sqlite_backup, "integrity_check",
+                side_effect=sqlite_backup.IntegrityCheckError("corrupt")):
+            with self.assertRaises(sqlite_backup.IntegrityCheckError):
+                sqlite_backup.backup(self.db_settings, target)
+        self.assertFalse(target.exists())
+
+    def test_missing_source(self):
+        with self.assertRaises(ValueError):
+            sqlite_backup.backup({"NAME": str(self.dir / "missing.db")}, self.dir / "copy.db")
+        with self.assertRaises(ValueError):
+            sqlite_backup.backup({"NAME": ":memory:"}, self.dir / "copy.db")
+
+    def test_create_dump(self):
+        """
+        Sans commande configurée pour SQLite, create_dump utilise la sauvegarde
+        dans le processus et alimente le manifeste comme une autre sauvegarde.
+        """
+        databases = {"archive_sqlite": self.db_settings}
+        with mock.patch.dict(settings.DATABASES, databases), self.settings(DB_BACKUP_COMMANDS={}):
+            self.assertIs(db_save.get_in_process_engine("archive_sqlite"), sqlite_backup.backup)
+            path = db_save.create_dump("archive_sqlite")
+            self.addCleanup(path.unlink)
+            self.addCleanup(compression.get_sidecar_path(path).unlink)
+            self.addCleanup(db_save.get_manifest_path("archive_sqlite").unlink)
+            self.addCleanup(catalogue.Catalogue.get_path().unlink)
+            self.assertEqual(path, db_save.get_file_path("archive_sqlite"))
+            self.assertEqual(db_save.recent_dump("archive_sqlite"), path)
+            self.assertEqual(self.count(path), 2000)
+            with self.assertRaises(ValueError):
+                db_save.create_dump("archive_sqlite", self.dir / "p.sql", jobs=2)
+        with mock.patch.dict(settings.DATABASES, databases), \
+                self.settings(DB_BACKUP_COMMANDS={"django.db.backends.sqlite3": {}}):
+            self.assertIsNone(db_save.get_in_process_engine("archive_sqlite"))
+
+
+class TestChunkStore(TestCase):
+
+    def setUp(self):
+        self.store = chunkstore.ChunkStore(settings.BACKUP_PATH / "store")
+        self.addCleanup(shutil.rmtree, self.store.root)
+        self.data = random.Random(1).randbytes(600_000)
+
+    def put(self, name, data):
+        path = self.store.root / "dump"
+        path.write_bytes(data)
+        manifest = self.store.put(name, path, avg_size=16384)
+        path.unlink()
+        return manifest
+
+    def restored(self, name):
+        path = self.store.restore(name, self.store.root / "restored")
+        data = path.read_bytes()
+        path.unlink()
+        return data
+
+    def test_chunk_sizes(self):
+        min_size, avg_size, max_size = chunkstore.get_chunk_sizes(16384)
+        sizes = [len(c) for c in chunkstore.iter_chunks(io.BytesIO(self.data), 16384)]
+        self.assertEqual(sum(sizes), len(self.data))
+        self.assertTrue(all(min_size <= size <= max_size for size in sizes[:-1]))
+        self.assertLess(len(sizes), len(self.data) // min_size)
+
+    @unittest.skipIf(chunkstore.numpy is None, "numpy is not installed")
+    def test_numpy_cut_points(self):
+        for avg_size in (256, 16384):
+            with mock.patch.object(chunkstore, "numpy", None):
+                expected = list(chunkstore.iter_chunks(io.BytesIO(self.data), avg_size))
+            self.assertEqual(
+                list(chunkstore.iter_chunks(io.BytesIO(self.data), avg_size)), expected)
+
+    def test_cdc_limit(self):
+        with mock.patch.object(chunkstore, "numpy", None), \
+                self.settings(ARCHIVES_CHUNK_CDC_LIMIT=100_000):
+            chunks = list(chunkstore.iter_chunks(io.BytesIO(self.data), 16384))
+            cdc = list(chunkstore.iter_chunks(io.BytesIO(self.data[:100_000]), 16384))
+        self.assertEqual(b"".join(chunks), self.data)
+        position = 0
+        for i, chunk in enumerate(chunks):
+            if position >= 100_000:
+                break
+            position += len(chunk)
+        # same content defined chunks, then fixed size ones
+        self.assertEqual(chunks[:i - 1], cdc[:i - 1])
+        self.assertEqual({len(chunk) for chunk in chunks[i:-1]}, {16384})
+
+    def test_dedup(self):
+        """
+        Une insertion au milieu ne change que le morceau qui la contient.
+        """
+        first = self.put("first", self.data)
+        self.assertEqual(first["new_chunks"], len(first["chunks"]))
+        changed = self.data[:300_000] + b"inserted" + self.data[300_000:]
+        second = self.put("second", changed)
+        self.assertLessEqual(second["new_chunks"], 2)
+        self.assertEqual(self.restored("first"), self.data)
+        self.assertEqual(self.restored("second"), changed)
+        self.assertEqual([m["name"] for m in self.store.manifests()], ["first", "second"])
+
+    def test_corrupted_chunk(self):
+        manifest = self.put("first", self.data)
+        chunk_path = self.store.chunk_path(manifest["chunks"][1][0])
+        chunk_path.write_bytes(b"x" + chunk_path.read_bytes()[1:])
+        with self.assertRaises(chunkstore.ChunkStoreError):
+            self.store.restore("first", self.store.root / "restored")
+        self.assertEqual(list(self.store.root.glob("restored*")), [])
+        chunk_path.unlink()
+        with self.assertRaises(chunkstore.ChunkStoreError):
+            self.store.restore("first", self.store.root / "restored")
+
+    def test_garbage_collection(self):
+        self.put("first", self.data)
+        changed = self.data[:300_000] + b"inserted" + self.data[300_000:]
+        second = self.put("second", changed)
+        self.assertEqual(self.store.collect_garbage(), (0, 0))
+        # chunks being written are kept, unless left over by an interrupted put
+        (self.store.chunk_dir / "00").mkdir(exist_ok=True)
+        writing = self.store.chunk_dir / "00" / "00ab.123.tmp"
+        writing.write_bytes(b"chunk")
+        interrupted = self.store.chunk_dir / "00" / "00cd.456.tmp"
+        interrupted.write_bytes(b"chunk")
+        old = time.time() - 2 * 24 * 3600
+        os.utime(interrupted, (old, old))
+        self.assertEqual(self.store.collect_garbage(), (1, 5))
+        self.assertTrue(writing.exists())
+        writing.unlink()
+        self.store.delete("first")
+        count, size = self.store.collect_garbage()
+        self.assertGreaterEqual(count, 1)
+        self.assertEqual(self.store.disk_usage(), second["size"])
+        self.assertEqual(self.restored("second"), changed)
+        # an unreadable manifest stops the collection
+        self.store.manifest_path("broken").write_text("{")
+        with self.assertRaises(chunkstore.ChunkStoreError):
+            self.store.collect_garbage()
+
+    def test_put_outside_lock(self):
+        """
+        Un collect_garbage pendant le découpage n'abîme pas la sauvegarde.
+        """
+        write_chunks = self.store._write_chunks
+
+        def collect_then_write(*args, **kwargs):
+            result = write_chunks(*args, **kwargs)
+            if kwargs.get("only") is None:
+                with open(self.store.root / ".lock", "a") as f:
+                    # not held while chunking
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.store.collect_garbage()
+            return result
+
+        with mock.patch.object(self.store, "_write_chunks", side_effect=collect_then_write):
+            manifest = self.put("first", self.data)
+        # every chunk written twice
+        self.assertEqual(manifest["new_chunks"], 2 * len(manifest["chunks"]))
+        self.assertEqual(manifest["new_bytes"], 2 * len(self.data))
+        self.assertEqual(self.restored("first"), self.data)
+
+    def test_invalid_name(self):
+        with self.assertRaises(chunkstore.ChunkStoreError):
+            self.store.get_manifest("../first")
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.addCleanup(metrics.get_history_path().unlink, missing_ok=True)
+
+    def entries(self, *durations):
+        return [metrics.make_entry("default", "dump", 0, duration, 1000) for duration in durations]
+
+    def test_history(self):
+        with metrics.Measure("default", "dump") as measure:
+            measure.size = 2000
+        with self.assertRaises(RuntimeError):
+            with metrics.Measure("default", "dump"):
+                raise RuntimeError("boom")
+        with open(metrics.get_history_path(), "a") as f:
+            f.write('{"truncated\n')
+        metrics.record(metrics.make_entry("other", "dump", 0, 1))
+        history = metrics.read_history("default")
+        self.assertEqual([(e["status"], e["size"], e["error"]) for e in history],
+            [(metrics.OK, 2000, None), (metrics.FAILED, None, "boom")])
+        self.assertEqual(len(metrics.read_history()), 3)
+        self.assertEqual(metrics.read_history("default", "store"), [])
+
+    def test_check_regression(self):
+        config = dict(metrics.DEFAULT_METRICS, window=3)
+        history = self.entries(100, 10, 11, 12)
+        entry = self.entries(20)[0]
+        self.assertEqual(metrics.check_regression(entry, history, config), [])
+        entry = self.entries(25)[0]
+        messages = metrics.check_regression(entry, history, config)
+        self.assertEqual(len(messages), 1)
+        self.assertIn("2.3 times the median of the last 3 backups", messages[0])
+        # not enough history
+        self.assertEqual(metrics.check_regression(entry, history[:2], config), [])
+        # failed runs are not compared, nor used as reference
+        history.append(metrics.make_entry("default", "dump", 0, 1, error="boom"))
+        self.assertEqual(len(metrics.check_regression(entry, history, config)), 1)
+
+    def test_config(self):
+        with self.settings(ARCHIVES_METRICS={"factor": 3}):
+            self.assertEqual(metrics.get_config()["factor"], 3)
+        with self.settings(ARCHIVES_METRICS={"factors": 3}):
+            self.assertRaises(ValueError, metrics.get_config)
+        with self.settings(ARCHIVES_METRICS={"action": "page"}):
+            self.assertRaises(ValueError, metrics.get_config)
+
+
+class TestLogicalBackup(TestCase, test_data.CreateUserMixin):
+
+    def setUp(self):
+        self.create_users(nb=3)
+        self.group = Group.objects.create(name="colleurs")
+        self.group.user_set.add(*self.users)
+        self.path = settings.BACKUP_PATH / "logical_test"
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+
+    def test_get_models(self):
+        models = logical.get_models(["auth.Group"])
+        self.assertEqual([model._meta.label for model in models],
+            ["auth.Group", "auth.Group_permissions"])
+        self.assertIn(Permission, logical.get_models(["auth"]))
+        self.assertRaises(ValueError, logical.get_models, ["auth.Missing"])
+        self.assertRaises(ValueError, logical.get_models, ["missing"])
+
+    def test_dump_and_load(self):
+        User = get_user_model()
+        path = logical.dump(["auth.Group", User._meta.label], path=self.path, codec="gzip",
+            chunk_size=2)
+        self.assertEqual(path, self.path)
+        manifest = logical.read_manifest(path)
+        rows = {entry["model"]: entry["rows"] for entry in manifest["models"]}
+        self.assertEqual(rows[User._meta.label], 5)
+        self.assertEqual(rows["auth.Group"], 1)
+        with gzip.open(path / f"{User._meta.label}.jsonl.gz", "rt") as f:
+            self.assertEqual(len(f.readlines()), 5)
+
+        joined = self.users[0].date_joined
+        User.objects.filter(pk=self.users[0].pk).update(username="renamed")
+        self.users[2].delete()
+        Group.objects.create(name="extra")
+        counts = dict(logical.load(path, batch_size=2))
+        self.assertEqual(counts[User._meta.label], 5)
+        self.assertEqual(list(Group.objects.values_list("name", flat=True)), ["colleurs"])
+        user = User.objects.get(pk=self.users[0].pk)
+        self.assertEqual((user.username, user.date_joined), ("user0", joined))
+        self.assertEqual(self.group.user_set.count(), 3)
+        # the sequences follow the restored primary keys
+        self.assertGreater(Group.objects.create(name="new").pk, self.group.pk)
+
+    def test_replaced_only_when_complete(self):
+        logical.dump(["auth.Group"], path=self.path)
+        with mock.patch.object(logical, "dump_model", side_effect=RuntimeError("boom")):
+            self.assertRaises(RuntimeError, logical.dump, ["auth.Group"], path=self.path)
+        self.assertTrue(logical.is_logical_backup(self.path))
+        self.assertFalse(self.path.with_name(self.path.name + ".part").exists())
+
+
+class TestBackupJobs(TestCase, test_data.CreateUserMixin):
+
+    def setUp(self):
+        self.create_users()
+        fake_dump.calls = 0
+        patcher = mock.patch.object(db_save, "run_save_command", side_effect=fake_dump)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.clean_files)
+
+    def clean_files(self):
+        shutil.rmtree(jobs.get_jobs_dir())
+        for path in settings.BACKUP_PATH.glob("*catalogue*"):
+            path.unlink()
+        for path in settings.BACKUP_PATH.glob("default_*"):
+            path.unlink()
+
+    def test_job(self):
+        self.client.force_login(self.admin_user)
+        response = self.client.post(
+            test_view.TestURL(self, "archives", "backup_job_start").url, {"db_name": "default"})
+        data = response.json()
+        self.assertEqual(data["status"], "OK")
+        job = jobs.BackupJob.get(data["job"])
+        job.wait(10)
+        self.assertEqual(job.state, jobs.DONE)
+        response = self.client.get(data["status_url"])
+        status = response.json()
+        self.assertEqual((status["state"], status["progress"], status["bytes_written"]),
+            (jobs.DONE, 1.0, 4))
+        response = self.client.get(status["download_url"])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("attachment", response["Content-Disposition"])
+        # a second job reuses the recent dump, without a thread
+        job = jobs.BackupJob.start("default", self.admin_user)
+        self.assertEqual(job.state, jobs.DONE)
+        self.assertEqual(fake_dump.calls, 1)
+        # reserved to the user who started it
+        self.assertRaises(jobs.JobNotFound, jobs.BackupJob.get, job.id, self.users[0])
+        self.client.force_login(self.users[0])
+        response = self.client.get(data["status_url"])
+        self.assertEqual(response.status_code, 403)
+
+    def test_failure(self):
+        with mock.patch.object(db_save, "run_save_command",
+                side_effect=subprocess.CalledProcessError(1, ["pg_dump"])):
+            job = jobs.BackupJob.start("default", self.admin_user)
+            job.wait(10)
+        status = job.status()
+        self.assertEqual(status["state"], jobs.FAILED)
+        self.assertIn("pg_dump", status["error"])
+        self.assertIsNone(job.get_file())
+        self.client.force_login(self.admin_user)
+        response = self.client.get(test_view.TestURL(
+            self, "archives", "backup_job_download", kwargs={"job_id": job.id}).url)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(test_view.TestURL(
+            self, "archives", "backup_job", kwargs={"job_id": "0" * 32}).url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_progress_and_stale(self):
+        now = time.time()
+        job = jobs.BackupJob({"id": "a" * 32, "database": "default", "user": self.admin_user.pk,
+            "state": jobs.RUNNING, "created": now - 10, "started": now - 10, "finished": None,
+            "heartbeat": now, "bytes_written": 250, "expected_bytes": 1000, "file": None,
+            "error": None})
+        status = job.status()
+        self.assertEqual(status["progress"], 0.25)
+        self.assertAlmostEqual(status["eta"], 30, delta=1)
+        job.record["heartbeat"] = now - 3600
+        status = job.status()
+        self.assertEqual((status["state"], status["error"]), (jobs.FAILED, "Sauvegarde interrompue"))
+
+
 class TestViews(TestCase, test_data.CreateUserMixin):
 
     def test_download_db(self):
@@ -75,4 +948,15 @@ class TestViews(TestCase, test_data.CreateUserMixin):
             "db_name": "non_existing_db"
         }
         url.status = 302
-        url.test()
\ No newline at end of file
+        url.test()
+
+    def test_stream_download(self):
+        self.create_users()
+        self.client.force_login(self.admin_user)
+        url = test_view.TestURL(self, "archives", "download_db").url
+        with mock.patch.object(db_save, "construct_command", return_value=python_command(WRITE_300K)):
+            response = self.client.get(url, {"db_name": "default", "stream": "1"})
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment", response["Content-Disposition"])
+        self.assertEqual(b"".join(response.streaming_content), b"x" * 300000)
+        self.assertFalse(db_save.get_file_path("default").exists())
@@ -5,4 +5,8 @@ app_name = "archives"
 
 urlpatterns = [
     path("download_db/", views.DownloadDb.as_view(), name="download_db"),
+    path("jobs/", views.BackupJobStart.as_view(), name="backup_job_start"),
+    path("jobs/<str:job_id>/", views.BackupJobStatus.as_view(), name="backup_job"),
+    path("jobs/<str:job_id>/download/", views.BackupJobDownload.as_view(),
+        name="backup_job_download"),
 ]
@@ -5,14 +5,17 @@ Dynamic view for archive home.
 """
 from django.conf import settings
 from django.contrib import messages
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect
+from django.urls import reverse
 from django.utils.module_loading import import_string
 
 from django_sendfile import sendfile
 
-from base_archives import db_save
+from base_archives import compression, db_save, jobs
+from base_archives.catalogue import record_backup
 from utils.permissions import AllowAll
-from utils.views import mixins, View
+from utils.views import json_utils, mixins, View
 
 
 def _download_permission():
@@ -26,22 +29,123 @@ def _download_permission():
     return import_string(dotted) if dotted else AllowAll()
 
 
+def send_backup(request, db_path):
+    sendfile_path = db_path.relative_to(settings.SENDFILE_ROOT)
+    return sendfile(request, str(sendfile_path),
+        attachment=True, attachment_filename=db_path.name)
+
+
 class DownloadDb(mixins.PermissionMixin, View):
     PERMISSION = _download_permission()
 
+    def streaming(self) -> bool:
+        """
+        Envoi de la sauvegarde au fil de l'eau (ARCHIVES_STREAM_DOWNLOAD, ou
+        paramètre GET stream=1) plutôt qu'après écriture complète sur disque.
+        """
+        if "stream" in self.request.GET:
+            return self.request.GET["stream"] not in ("", "0")
+        return getattr(settings, "ARCHIVES_STREAM_DOWNLOAD", False)
+
+    def send_dump(self, db_path):
+        return send_backup(self.request, db_path)
+
+    def tee_complete(self, db_name, path):
+        info = compression.checksum_info(path)
+        compression.write_sidecar(path, info, database=db_name)
+        db_save.write_manifest(db_name, path)
+        record_backup(path, info, db_name)
+
+    def stream_dump(self, db_name):
+        """
+        Réponse diffusant la sortie de la commande de sauvegarde. Avec
+        ARCHIVES_STREAM_TEE, la sauvegarde est aussi écrite à l'emplacement
+        habituel et pourra être réutilisée.
+
+        Une sauvegarde récente est envoyée telle quelle ; si une autre est en
+        cours, on l'attend pour l'envoyer.
+        """
+        recent = db_save.recent_dump(db_name)
+        if recent is not None:
+            return self.send_dump(recent)
+        if db_save.get_in_process_engine(db_name) is not None:
+            # no command output to stream
+            return self.send_dump(db_save.get_or_create_dump(db_name))
+        lock = db_save.DumpLock(db_name)
+        if not lock.acquire(blocking=False):
+            return self.send_dump(db_save.get_or_create_dump(db_name))
+        db_path = db_save.get_file_path(db_name)
+        tee = db_path if getattr(settings, "ARCHIVES_STREAM_TEE", False) else None
+        try:
+            stream = db_save.DumpStream(
+                db_save.construct_command(db_name, stream=True), tee=tee, lock=lock,
+                on_complete=lambda path: self.tee_complete(db_name, path))
+        except Exception:
+            lock.release()
+            raise
+        response = StreamingHttpResponse(stream, content_type="application/octet-stream")
+        response["Content-Disposition"] = f'attachment; filename="{db_path.name}"'
+        return response
+
     def get(self, request, *args, **kwargs):
         """
-        Download the database.
+        Download the database. A dump made less than ARCHIVES_DUMP_REUSE_MINUTES
+        ago is sent again, and concurrent requests share a single dump.
         """
         db_name = self.request.GET.get("db_name", "default")
         try:
-            db_path = db_save.get_file_path(db_name)
-            command = db_save.construct_command(db_name)
-            db_save.run_save_command(command)
-            sendfile_path = db_path.relative_to(settings.SENDFILE_ROOT)
-            return sendfile(request, str(sendfile_path),
-                attachment=True, attachment_filename=db_path.name)
+            if self.streaming():
+                return self.stream_dump(db_name)
+            return self.send_dump(db_save.get_or_create_dump(db_name))
         except Exception as e:
             messages.error(request,
                 f"Erreur lors de la sauvegarde de la base de données : {e}")
-            return redirect(getattr(settings, "ARCHIVES_ERROR_REDIRECT", "/"))
\ No newline at end of file
+            return redirect(getattr(settings, "ARCHIVES_ERROR_REDIRECT", "/"))
+
+
+class BackupJobStart(mixins.PermissionMixin, View):
+    """
+    Lance une sauvegarde en arrière-plan (POST, paramètre db_name) et renvoie
+    l'URL de son état. Le travailleur web est libéré pendant la sauvegarde.
+    """
+    PERMISSION = _download_permission()
+
+    def post(self, request, *args, **kwargs):
+        db_name = request.POST.get("db_name", "default")
+        try:
+            job = jobs.BackupJob.start(db_name, request.user)
+        except ValueError as e:
+            return JsonResponse(json_utils.error_data(str(e)), status=400)
+        return JsonResponse(json_utils.json_data(
+            job.status(), status_url=reverse("archives:backup_job", args=[job.id])))
+
+
+class BackupJobStatus(mixins.PermissionMixin, View):
+    """
+    État d'une tâche de sauvegarde (voir jobs.BackupJob.status), avec le lien de
+    téléchargement une fois la sauvegarde prête.
+    """
+    PERMISSION = _download_permission()
+
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            job = jobs.BackupJob.get(job_id, request.user)
+        except jobs.JobNotFound:
+            return JsonResponse(json_utils.error_data("Tâche inconnue"), status=404)
+        data = job.status()
+        if job.get_file() is not None:
+            data["download_url"] = reverse("archives:backup_job_download", args=[job.id])
+        return JsonResponse(json_utils.json_data(data))
+
+
+class BackupJobDownload(mixins.PermissionMixin, View):
+    PERMISSION = _download_permission()
+
+    def get(self, request, job_id, *args, **kwargs):
+        try:
+            path = jobs.BackupJob.get(job_id, request.user).get_file()
+        except jobs.JobNotFound:
+            path = None
+        if path is None:
+            raise Http404("Sauvegarde non disponible")
+        return send_backup(request, path)
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+date: 2026-10-19
+
+Import NDJSON (un objet json par ligne) par l'API REST, pour les imports
+enregistrés par ModelImportView.register.
+
+Le corps de la requête est lu ligne par ligne dans request.stream, sans jamais
+être chargé en entier. Les lignes sont validées par le formulaire atomique de
+l'import et enregistrées par paquets de BULKIMPORT_API_CHUNK_SIZE lignes, chaque
+paquet dans sa propre transaction : les lignes invalides sont rejetées sans
+bloquer les autres. Un paquet qui viole une contrainte de la base (deux lignes
+avec la même valeur unique) est repris ligne par ligne, et seules les lignes en
+échec sont rejetées. Le corps doit avoir une longueur (Content-Length).
+
+Les données communes (Meta.fields), la correspondance de noms
+(_name_mapping_<i>) sont passées en paramètres GET. Sans correspondance, les
+colonnes de DEFAULT_NAME_MAPPING (ou à défaut les noms des champs) sont
+attendues.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework import status
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from bulkimport import importers
+from bulkimport.models import ImportRecord
+from bulkimport.views import ModelImportView
+from utils.views import json_utils
+
+# maximum number of row errors detailed in the response, others are only counted
+MAX_ERRORS = 50
+
+
+class NDJSONImportView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAdminUser]
+    # the body is read from request.stream, never parsed as a whole
+    parser_classes = []
+
+    def get_form(self, view_name):
+        view_class = importers.get_view_class(view_name)
+        if view_class is None or not issubclass(view_class, ModelImportView):
+            return None
+        form = view_class.form_class(self.request.query_params)
+        form.fields["import_file"].required = False
+        return form
+
+    def iter_lines(self, stream, stats):
+        """
+        Generate (line number, dict or None) couples. None for lines which
+        are not a json object.
+        """
+        max_line = getattr(settings, "BULKIMPORT_API_MAX_LINE", 1024 * 1024)
+        digest = hashlib.sha256()
+        line_no = 0
+        while stream is not None:
+            raw = stream.readline(max_line + 1)
+            if not raw:
+                break
+            line_no += 1
+            digest.update(raw)
+            stats["file_size"] += len(raw)
+            if len(raw) > max_line and not raw.endswith(b"\n"):
+                # skip the end of an oversized line
+                while raw and not raw.endswith(b"\n"):
+                    raw = stream.readline(max_line + 1)
+                    digest.update(raw)
+                    stats["file_size"] += len(raw)
+                yield line_no, None
+                continue
+            if not raw.strip():
+                continue
+            try:
+                d = json.loads(raw)
+            except ValueError:
+                d = None
+            yield line_no, d if isinstance(d, dict) else None
+        stats["digest"] = digest.hexdigest()
+
+    def reject(self, stats, errors, line_no, row_errors):
+        stats["rows_rejected"] += 1
+        if len(errors) < MAX_ERRORS:
+            errors.append({"line": line_no, "errors": row_errors})
+
+    def save_chunk(self, form, valid, files, stats, errors):
+        """
+        Save the (line number, dict, (form, m2ms)) triples of valid. If the
+        chunk breaks a db constraint (e.g. two rows with the same unique
+        value), each row is saved again on its own and the failing ones are
+        rejected.
+        """
+        try:
+            with transaction.atomic():
+                return len(form.save_forms([built for _, _, built in valid]))
+        except IntegrityError:
+            pass
+        created = 0
+        for line_no, d, _ in valid:
+            # instances of the rolled back chunk may have a pk: built again
+            built = form.build_atomic_form(d, files)
+            if not built[0].is_valid():
+                # duplicate of a row saved just before
+                self.reject(stats, errors, line_no, built[0].errors.get_json_data())
+                continue
+            try:
+                with transaction.atomic():
+                    created += len(form.save_forms([built]))
+            except IntegrityError as e:
+                self.reject(stats, errors, line_no, {"__all__": [str(e)]})
+        return created
+
+    def import_chunk(self, form, chunk, stats, errors):
+        start = time.perf_counter()
+        files = form.base_files()
+        valid = []
+        for line_no, d in chunk:
+            stats["rows_read"] += 1
+            if d is None:
+                self.reject(stats, errors, line_no, {"__all__": ["Objet json invalide"]})
+                continue
+            d = next(form.map_dicts([d]), None)
+            if d is None:  # filtered out
+                continue
+            atomic, m2ms = form.build_atomic_form(d, files)
+            if atomic.is_valid():
+                valid.append((line_no, d, (atomic, m2ms)))
+            else:
+                self.reject(stats, errors, line_no, atomic.errors.get_json_data())
+        saved = time.perf_counter()
+        stats["validation_duration"] += saved - start
+        stats["rows_created"] += self.save_chunk(form, valid, files, stats, errors)
+        stats["save_duration"] += time.perf_counter() - saved
+
+    def post(self, request, view_name, *args, **kwargs):
+        form = self.get_form(view_name)
+        if form is None:
+            return Response(json_utils.error_data("Import inconnu"), status=status.HTTP_404_NOT_FOUND)
+        if not form.is_valid():
+            return Response(
+                json_utils.error_data("Paramètres invalides", {"errors": form.errors.get_json_data()}),
+                status=status.HTTP_400_BAD_REQUEST)
+        if request.stream is None:
+            # no body, or no Content-Length (chunked transfer encoding)
+            if request.META.get("CONTENT_LENGTH"):
+                return Response(json_utils.error_data("Corps de requête vide"),
+                    status=status.HTTP_400_BAD_REQUEST)
+            return Response(json_utils.error_data("En-tête Content-Length requis"),
+                status=status.HTTP_411_LENGTH_REQUIRED)
+        if not form.cleaned_data["_name_mapping"]:
+            form.cleaned_data["_name_mapping"] = form.default_name_mapping()
+        chunk_size = getattr(settings, "BULKIMPORT_API_CHUNK_SIZE", 500)
+        stats = {
+            "file_name": "", "file_size": 0, "rows_read": 0, "rows_created": 0,
+            "rows_rejected": 0, "validation_duration": 0, "save_duration": 0,
+        }
+        errors = []
+        chunk = []
+        for line in self.iter_lines(request.stream, stats):
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                self.import_chunk(form, chunk, stats, errors)
+                chunk = []
+        if chunk:
+            self.import_chunk(form, chunk, stats, errors)
+        ImportRecord.from_stats(view_name, request.user, stats, success=stats["rows_rejected"] == 0)
+        return Response(json_utils.json_data(
+            read=stats["rows_read"],
+            created=stats["rows_created"],
+            rejected=stats["rows_rejected"],
+            errors=errors,
+        ))
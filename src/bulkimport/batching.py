@@ -0,0 +1,94 @@
+"""
+date: 2026-10-19
+
+Découpage adaptatif des enregistrements en lots.
+
+La taille des lots suit la latence mesurée de chaque lot pour viser
+BULKIMPORT_BATCH_TARGET_LATENCY secondes, entre BULKIMPORT_BATCH_MIN_SIZE et
+BULKIMPORT_BATCH_MAX_SIZE. Si BULKIMPORT_DB_SHARE (entre 0 et 1) est défini, une
+pause est faite après chaque lot pour que le temps passé en base ne dépasse pas
+cette fraction du temps total : 0.5 laisse la base libre la moitié du temps.
+
+FileImportForm.save_all enregistre toujours par lots, chacun dans un savepoint
+de la transaction de l'import, qui reste atomique. Les pauses ont donc lieu
+transaction ouverte : elles laissent le processeur et les disques de la base aux
+autres requêtes, mais les verrous pris sur les lignes déjà écrites (toute la base
+avec SQLite) sont gardés jusqu'à la fin de l'import, allongée d'autant.
+"""
+import time
+
+from django.conf import settings
+
+
+class AdaptiveBatcher():
+    """
+    Usage :
+
+        batcher = AdaptiveBatcher()
+        for batch in batcher.batches(items):
+            ...  # traitement du lot, mesuré
+
+    Le temps mesuré est celui passé par l'appelant entre deux lots. clock et
+    sleep sont paramétrables pour les tests.
+    """
+
+    def __init__(self, min_size=None, max_size=None, target_latency=None,
+            db_share=None, clock=time.perf_counter, sleep=time.sleep):
+        self.min_size = min_size or getattr(settings, "BULKIMPORT_BATCH_MIN_SIZE", 10)
+        self.max_size = max_size or getattr(settings, "BULKIMPORT_BATCH_MAX_SIZE", 1000)
+        if self.min_size < 1 or self.max_size < self.min_size:
+            raise ValueError("Bornes de taille de lot incohérentes")
+        self.target_latency = target_latency or getattr(
+            settings, "BULKIMPORT_BATCH_TARGET_LATENCY", 0.2)
+        if db_share is None:
+            db_share = getattr(settings, "BULKIMPORT_DB_SHARE", None)
+        if db_share is not None and not 0 < db_share <= 1:
+            raise ValueError("BULKIMPORT_DB_SHARE doit être dans ]0, 1]")
+        self.db_share = db_share
+        self.clock = clock
+        self.sleep = sleep
+        self.size = self.min_size
+        self.batch_count = 0
+        self.paused = 0.0
+
+    def record(self, count: int, elapsed: float, last: bool = False):
+        """
+        Ajuste la taille du prochain lot après un lot de count éléments traité
+        en elapsed secondes, puis fait la pause éventuelle, sauf après le dernier
+        lot (last).
+
+        La taille varie au plus d'un facteur 2 d'un lot à l'autre, pour ne pas
+        suivre une mesure isolée.
+        """
+        self.batch_count += 1
+        if elapsed > 0 and count > 0:
+            ideal = count * self.target_latency / elapsed
+            ideal = min(max(ideal, self.size / 2), self.size * 2)
+            self.size = int(min(max(ideal, self.min_size), self.max_size))
+        elif count >= self.size:
+            self.size = min(self.size * 2, self.max_size)
+        if self.db_share is not None and self.db_share < 1 and elapsed > 0 and not last:
+            pause = elapsed * (1 - self.db_share) / self.db_share
+            self.paused += pause
+            self.sleep(pause)
+
+    def batches(self, items):
+        """
+        Generate successive slices of the sequence items.
+        """
+        i = 0
+        n = len(items)
+        while i < n:
+            batch = items[i:i + self.size]
+            start = self.clock()
+            yield batch
+            i += len(batch)
+            self.record(len(batch), self.clock() - start, last=i >= n)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "batches": self.batch_count,
+            "batch_size": self.size,
+            "throttle_duration": self.paused,
+        }
@@ -0,0 +1,138 @@
+"""
+date: 2026-10-19
+
+Export de données au format lu par FileImportForm.
+
+Les colonnes sont celles de `Meta.name_fields` du formulaire d'import, nommées
+d'après `DEFAULT_NAME_MAPPING` quand il est défini : un fichier exporté se
+réimporte donc avec la correspondance de noms proposée par défaut.
+
+Le queryset est parcouru par `values_list(...).iterator(chunk_size=...)` : aucune
+instance de modèle n'est créée et la mémoire consommée ne dépend pas du nombre
+de lignes. Les fonctions renvoient des générateurs de chaînes, à passer tels
+quels à un StreamingHttpResponse.
+
+Les champs plusieurs-à-plusieurs ne sont pas exportés (values_list donnerait
+une ligne par objet lié). En csv, None est écrit comme une chaîne vide : les
+champs nullables dont le formulaire ne relit pas "" comme None ne peuvent être
+exportés qu'en jsonl.
+"""
+import csv
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+}
+
+
+def get_chunk_size() -> int:
+    return getattr(settings, "BULKIMPORT_EXPORT_CHUNK_SIZE", 2000)
+
+
+def get_columns(form_class) -> list[tuple[str, str]]:
+    """
+    Liste de couples (nom du champ, nom de colonne) pour form_class.
+
+    Raise ValueError pour un champ plusieurs-à-plusieurs.
+    """
+    mapping = getattr(form_class, "DEFAULT_NAME_MAPPING", {})
+    opts = form_class._meta.model._meta
+    for name in form_class.Meta.name_fields:
+        if opts.get_field(name).many_to_many:
+            raise ValueError(f"Champ plusieurs-à-plusieurs non exportable : {name}")
+    return [(name, mapping.get(name, name)) for name in form_class.Meta.name_fields]
+
+
+def check_csv(form_class, columns: list[tuple[str, str]]):
+    """
+    Raise ValueError si un champ nullable de columns ne se réimporte pas en None
+    depuis la chaîne vide écrite en csv.
+    """
+    opts = form_class._meta.model._meta
+    form_fields = form_class.atomic_form.base_fields
+    for name, _ in columns:
+        if not opts.get_field(name).null or name not in form_fields:
+            continue
+        try:
+            empty = form_fields[name].clean("")
+        except ValidationError:
+            empty = ""
+        if empty is not None:
+            raise ValueError(f"Champ nullable non exportable en csv : {name}, utiliser jsonl")
+
+
+class _Echo():
+    """
+    Pseudo-fichier pour csv.writer : writerow renvoie la ligne au lieu de
+    l'écrire quelque part.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _rows(queryset, fields, chunk_size):
+    return queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def iter_csv(form_class, queryset, chunk_size=None, delimiter=","):
+    """
+    Génère le fichier csv, ligne d'en-tête comprise.
+
+    None est exporté comme une chaîne vide, comme le ferait csv.writer.
+    Raise ValueError, avant de générer quoi que ce soit, si form_class ne
+    convient pas (voir get_columns et check_csv).
+    """
+    columns = get_columns(form_class)
+    check_csv(form_class, columns)
+    return _iter_csv(columns, queryset, chunk_size, delimiter)
+
+
+def _iter_csv(columns, queryset, chunk_size, delimiter):
+    writer = csv.writer(_Echo(), delimiter=delimiter)
+    yield writer.writerow([col for _, col in columns])
+    fields = [name for name, _ in columns]
+    for row in _rows(queryset, fields, chunk_size or get_chunk_size()):
+        yield writer.writerow(row)
+
+
+def iter_jsonl(form_class, queryset, chunk_size=None):
+    """
+    Génère un objet json par ligne.
+
+    Raise ValueError, avant de générer quoi que ce soit, pour un champ
+    plusieurs-à-plusieurs.
+    """
+    return _iter_jsonl(get_columns(form_class), queryset, chunk_size)
+
+
+def _iter_jsonl(columns, queryset, chunk_size):
+    keys = [col for _, col in columns]
+    fields = [name for name, _ in columns]
+    encode = DjangoJSONEncoder(ensure_ascii=False).encode
+    for row in _rows(queryset, fields, chunk_size or get_chunk_size()):
+        yield encode(dict(zip(keys, row))) + "\n"
+
+
+def streaming_response(form_class, queryset, fmt="csv", filename="export",
+        chunk_size=None) -> StreamingHttpResponse:
+    """
+    Réponse HTTP diffusant queryset au format fmt ("csv" ou "jsonl").
+
+    Raise ValueError si le format est inconnu ou ne convient pas à form_class.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt}")
+    content_type, ext = FORMATS[fmt]
+    if fmt == "csv":
+        content = iter_csv(form_class, queryset, chunk_size=chunk_size)
+    else:
+        content = iter_jsonl(form_class, queryset, chunk_size=chunk_size)
+    response = StreamingHttpResponse(content, content_type=f"{content_type}; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{ext}"'
+    return response
@@ -0,0 +1,35 @@
+"""
+date: 2026-10-19
+
+Fichiers json lines : un objet json par ligne, format produit par
+bulkimport.export.iter_jsonl.
+"""
+
+import json
+
+import bulkimport.dict_utils as du
+
+
+def get_seq(file):
+    """
+    Returns a DictIterable from a json lines file.
+
+    Empty lines are ignored. All objects must have the keys of the first one.
+    """
+    l = []
+    for line in file:
+        if not line.strip():
+            continue
+        try:
+            d = json.loads(line)
+        except json.JSONDecodeError:
+            raise du.NotIterable
+        if not isinstance(d, dict):
+            raise du.NotIterable
+        l.append(d)
+    keys = list(l[0]) if l else []
+    for d in l[1:]:
+        for k in keys:
+            if k not in d:
+                raise du.DifferentKeys('%s non trouvé' % str(k))
+    return du.DictIterable(keys, l)
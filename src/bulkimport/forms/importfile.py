@@ -3,6 +3,8 @@ Created on Fri Sep 25 07:43:57 2015
 """
 
 import encodings
+import hashlib
+import time
 from io import TextIOWrapper
 
 import django.forms
@@ -16,6 +18,7 @@ import django.db.transaction
 from django.template.defaultfilters import pluralize
 
 import bulkimport.forms.fields
+from bulkimport.batching import AdaptiveBatcher
 import bulkimport.forms.widgets as widgets
 import bulkimport.filetypes as ft
 import bulkimport.dict_utils as du
@@ -128,6 +131,9 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
 
     Each created atomic form instance will have a master_form attribute
     which is a reference to the FileImportForm instance.
+
+    After validation and save, import_stats holds the file size and digest,
+    row counts and per-stage durations (see bulkimport.models.ImportRecord).
     """
     add_css_classes = {
         "import_file": "m-2",
@@ -137,7 +143,7 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
 
     import_file = django.forms.FileField(
         label=_("Fichier à importer"),
-        help_text=_("Json ou csv"),
+        help_text=_("Json, jsonl ou csv"),
         widget=django.forms.FileInput(attrs={
             "class": "p-2 rounded-sm border w-80",
             "placeholder": "Choisir un fichier"
@@ -177,6 +183,7 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
             initial.update(_name_mapping=list(nm.values()))
         kwargs["initial"] = initial
         super().__init__(*args, **kwargs)
+        self.import_stats = {}
 
     def _create_model_key_mapping(self, d, key_mapping):
         # key_mapping is the value of name_mapping field.
@@ -195,17 +202,31 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
                     nm[name] = name
         return nm
 
-    def _generate_dicts(self):
+    @classmethod
+    def default_name_mapping(cls):
+        """
+        Column name -> field name mapping used when none is given :
+        DEFAULT_NAME_MAPPING if complete, else columns named after the fields.
+        """
+        nm = cls._get_initial_name_mapping()
+        if nm is None:
+            return {name: name for name in cls.Meta.name_fields}
+        return {cls.DEFAULT_NAME_MAPPING[name]: name for name in cls.Meta.name_fields}
+
+    def map_dicts(self, dicts):
         # generator of the dictionnary to use for model creation
-        # data are read directly from a file, no transformation is done
+        # data are read directly from dicts, no transformation is done
         # apart from the key translation
         nm = self.cleaned_data['_name_mapping']
-        for d in self.cleaned_data['import_file']:
+        for d in dicts:
             km = self._create_model_key_mapping(d, nm)
             result = du.map_keys(d, km)
             if self.filter_dict(result):
                 yield result
 
+    def _generate_dicts(self):
+        return self.map_dicts(self.cleaned_data['import_file'])
+
     @property
     def import_fields(self):
         return (self["_encoding"], self["_name_mapping"])
@@ -224,26 +245,45 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
             self._base_data = d
         return self._base_data
 
+    def base_files(self):
+        """
+        Files shared by all subforms
+        """
+        files = self.files.copy()
+        files.pop('import_file', None)
+        return files
+
+    def build_atomic_form(self, d, files):
+        """
+        Create and validate the atomic form for dict d (already mapped).
+        Returns a (form, m2ms) couple, m2ms being the base data to save after
+        the instance.
+        """
+        form = self.atomic_form(d, files, **self.get_extra_form_kwargs())
+        form.master_form = self
+        inst = form.instance
+        m2ms = []
+        # copy base data in each created instance
+        for k, v in self.base_data.items():
+            if is_m2m(k, inst):  # instance is not saved, so it may not have pk
+                m2ms.append((k, v))
+            else:
+                setattr(inst, k, v)
+        if form.is_valid():
+            form._generated_data = d
+        return form, m2ms
+
     def _clean_subforms(self):
         # create and validate all subforms
         # all errors in form/model validation will be reported as a file_import field error
-        files = self.files.copy()
-        del files['import_file']  # after that, files contains base data files
+        files = self.base_files()
         forms = []
         errors = []
+        rows_read = 0
         for d in self._generate_dicts():
-            form = self.atomic_form(d, files, **self.get_extra_form_kwargs())
-            form.master_form = self
-            inst = form.instance
-            m2ms = []
-            # copy base data in each created instance
-            for k, v in self.base_data.items():
-                if is_m2m(k, inst):  # instance is not saved, so it may not have pk
-                    m2ms.append((k, v))
-                else:
-                    setattr(inst, k, v)
+            rows_read += 1
+            form, m2ms = self.build_atomic_form(d, files)
             if form.is_valid():
-                form._generated_data = d
                 forms.append((form, m2ms))
             else:
                 errors.append((d, form.errors))
@@ -266,6 +306,7 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
                     )
                 )
         self._forms = forms
+        self.import_stats.update(rows_read=rows_read, rows_rejected=len(errors))
 
     def clean(self):
         # we doesn't really have a model to clean here, so the warning in Django doc
@@ -276,6 +317,8 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
         encoding = self.cleaned_data.get('_encoding', None)
         if uplf is None or encoding is None:
             return self.cleaned_data
+        self.import_stats.update(file_name=uplf.name, **self._file_info(uplf))
+        start = time.perf_counter()
         f = TextIOWrapper(uplf.file, encoding=encoding)
         try:
             f_data = ft.load(f, uplf.name)
@@ -297,10 +340,27 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
             ) from e
         self._data_formatter = f_data.formatter
         self.cleaned_data['import_file'] = f_data
+        parsed = time.perf_counter()
         self._clean_subforms()
         f.close()
+        self.import_stats.update(
+            parse_duration=parsed - start,
+            validation_duration=time.perf_counter() - parsed,
+        )
         return self.cleaned_data
 
+    def _file_info(self, uplf):
+        # size and sha256 of the uploaded file, read by chunks then rewound
+        if getattr(uplf, "sha256", None):  # chunked upload, already checked
+            return {"file_size": uplf.size, "digest": uplf.sha256}
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in uplf.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        uplf.seek(0)
+        return {"file_size": size, "digest": digest.hexdigest()}
+
     def filter_dict(self, d):
         """
         Override to filter some generated dict.
@@ -325,30 +385,52 @@ class FileImportForm(with_metaclass(FileImportFormMeta, dfm.ModelForm)):
         Save all atomic forms (one for each entry in data file).
         Returns the list of all instances, saved to db if commit=True.
 
+        Forms are saved in a single transaction, in batches sized by an
+        AdaptiveBatcher, each batch in a savepoint. If BULKIMPORT_DB_SHARE is
+        set, the batcher pauses between batches, with the transaction open
+        (see bulkimport.batching).
+
         Raise ValueError if an instance could not be created
         """
         if not self.is_valid():
             raise ValidationError("Cannot save a non valid form")
-        forms = self._forms
+        return self.save_forms(self._forms, commit=commit)
+
+    def save_forms(self, forms, commit=True):
+        """
+        Save the (form, m2ms) couples built by build_atomic_form. See save_all.
+        """
         instances = []
+        start = time.perf_counter()
+        # nothing written without commit, no reason to pause
+        batcher = AdaptiveBatcher(db_share=None if commit else 1)
+
+        def save_m2m_field(f, values):
+            for k, v in values:
+                f.instance._meta.get_field(k).save_form_data(f.instance, v)
+
+        def save_batch(batch):
+            for form, _ in batch:
+                instances.append(form.save(commit=commit))
+            if commit:
+                for form, m2ms in batch:
+                    save_m2m_field(form, m2ms)
+                    form.post_save(commit=commit)
+
         with django.db.transaction.atomic():
-            for form, _ in forms:
-                inst = form.save(commit=commit)
-                instances.append(inst)
-
-            def save_m2m_field(f, values):
-                for k, v in values:
-                    f.instance._meta.get_field(k).save_form_data(f.instance, v)
-
-            if not commit:
-                def save_m2m():
-                    for form, m2ms in forms:
-                        form.save_m2m()
-                        save_m2m_field(form, m2ms)
-                        form.post_save(commit=True)
-                self.save_m2m = save_m2m
-            else:
+            for batch in batcher.batches(forms):
+                with django.db.transaction.atomic():
+                    save_batch(batch)
+        if not commit:
+            def save_m2m():
                 for form, m2ms in forms:
+                    form.save_m2m()
                     save_m2m_field(form, m2ms)
-                    form.post_save(commit=commit)
+                    form.post_save(commit=True)
+            self.save_m2m = save_m2m
+        self.import_stats.update(
+            rows_created=len(instances) if commit else 0,
+            save_duration=time.perf_counter() - start,
+            **batcher.stats
+        )
         return instances
@@ -7,6 +7,7 @@ class ViewList():
 
     def __init__(self):
         self.views = {}
+        self.classes = {}
         self.urlpatterns = []
 
     def register(self, view_name: str, name: str, cls):
@@ -17,6 +18,7 @@ class ViewList():
         if view_name in self.views:
             raise ValueError(f"Same view name : {self.views[view_name]}")
         self.views[view_name] = name
+        self.classes[view_name] = cls
         self.urlpatterns.append(
             urls.path(view_name, cls.as_view(), name=view_name))
     
@@ -27,6 +29,13 @@ class ViewList():
         if view_name not in self.views:
             raise ValueError("View not registered")
         del self.views[view_name]
+        del self.classes[view_name]
+
+    def get_view_class(self, view_name: str):
+        """
+        Registered view class, or None
+        """
+        return self.classes.get(view_name)
 
     def get_urls(self):
         res_urls = []
@@ -39,4 +48,13 @@ _vl = ViewList()
 register = _vl.register
 unregister = _vl.unregister
 get_urls = _vl.get_urls
+get_view_class = _vl.get_view_class
 urlpatterns = _vl.urlpatterns
+
+# export views, listed apart from the import views
+_exports = ViewList()
+
+register_export = _exports.register
+unregister_export = _exports.unregister
+get_export_urls = _exports.get_urls
+export_urlpatterns = _exports.urlpatterns
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_name', models.CharField(max_length=128)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('file_name', models.CharField(blank=True, max_length=255)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('digest', models.CharField(blank=True, max_length=64)),
+                ('rows_read', models.PositiveIntegerField(default=0)),
+                ('rows_created', models.PositiveIntegerField(default=0)),
+                ('rows_rejected', models.PositiveIntegerField(default=0)),
+                ('parse_duration', models.FloatField(default=0)),
+                ('validation_duration', models.FloatField(default=0)),
+                ('save_duration', models.FloatField(default=0)),
+                ('success', models.BooleanField(default=False)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['view_name', '-date'], name='bulkimport__view_na_fd3b0f_idx')],
+            },
+        ),
+    ]
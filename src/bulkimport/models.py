@@ -0,0 +1,109 @@
+"""
+date: 2026-10-19
+
+Historique des imports, pour comparer un import avec les précédents.
+"""
+import statistics
+
+from django.conf import settings
+from django.db import models
+
+
+class ImportRecordQuerySet(models.QuerySet):
+
+    def recent(self, limit=20, window=10):
+        """
+        Liste des `limit` derniers imports, du plus récent au plus ancien.
+
+        Chaque enregistrement reçoit un attribut `trend` : rapport entre son débit
+        et le débit médian des (au plus) `window` imports réussis précédents de la
+        même vue. None faute de point de comparaison. Un trend de 0.1 signale un
+        import dix fois plus lent que d'habitude.
+        """
+        order = ("-date", "-pk")
+        records = list(self.select_related("user").order_by(*order)[:limit])
+        # les `window` imports réussis précédant le plus ancien affiché, par vue
+        previous = {}  # view_name -> débits des imports plus anciens
+        for rec in reversed(records):
+            if rec.view_name in previous:
+                continue
+            older = (
+                self.filter(view_name=rec.view_name, success=True)
+                .filter(models.Q(date__lt=rec.date) | models.Q(date=rec.date, pk__lt=rec.pk))
+                .alias(duration=models.F("parse_duration") + models.F("validation_duration")
+                    + models.F("save_duration"))
+                .filter(duration__gt=0)
+                .order_by(*order)[:window])
+            previous[rec.view_name] = [r.throughput for r in reversed(older)]
+        for rec in reversed(records):
+            history = previous[rec.view_name]
+            rec.trend = None
+            tp = rec.throughput
+            if history and tp is not None:
+                median = statistics.median(history[-window:])
+                if median > 0:
+                    rec.trend = tp / median
+            if rec.success and tp is not None:
+                history.append(tp)
+        return records
+
+
+class ImportRecord(models.Model):
+    """
+    Un import de fichier via FileImportForm. Les durées sont en secondes.
+    """
+
+    view_name = models.CharField(max_length=128)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    date = models.DateTimeField(auto_now_add=True)
+    file_name = models.CharField(max_length=255, blank=True)
+    file_size = models.BigIntegerField(default=0)
+    digest = models.CharField(max_length=64, blank=True)  # sha256
+    rows_read = models.PositiveIntegerField(default=0)
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_rejected = models.PositiveIntegerField(default=0)
+    parse_duration = models.FloatField(default=0)
+    validation_duration = models.FloatField(default=0)
+    save_duration = models.FloatField(default=0)
+    success = models.BooleanField(default=False)
+
+    objects = ImportRecordQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["-date"]
+        indexes = [models.Index(fields=["view_name", "-date"])]
+
+    def __str__(self):
+        return f"{self.view_name} ({self.date:%Y-%m-%d %H:%M}) : {self.rows_created}/{self.rows_read}"
+
+    @property
+    def duration(self) -> float:
+        return self.parse_duration + self.validation_duration + self.save_duration
+
+    @property
+    def error_rate(self) -> float:
+        if self.rows_read == 0:
+            return 0
+        return self.rows_rejected / self.rows_read
+
+    @property
+    def throughput(self) -> float|None:
+        """
+        Lignes lues par seconde.
+        """
+        if self.duration <= 0:
+            return None
+        return self.rows_read / self.duration
+
+    @classmethod
+    def from_stats(cls, view_name: str, user, stats: dict, success: bool) -> "ImportRecord":
+        """
+        Enregistre un import à partir de FileImportForm.import_stats.
+        """
+        if user is not None and not user.is_authenticated:
+            user = None
+        fields = {f.name for f in cls._meta.get_fields()}
+        return cls.objects.create(
+            view_name=view_name, user=user, success=success,
+            **{k: v for k, v in stats.items() if k in fields})
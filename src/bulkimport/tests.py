@@ -1,16 +1,32 @@
 # -*- coding: utf-8 -*-
+import fcntl
+import hashlib
+import io
+import json
 import os.path
+import tempfile
+from unittest import mock
 
+from django.contrib.auth import get_user_model
 import django.db.models as models
 from django.core.files.uploadedfile import InMemoryUploadedFile
 import django.core.exceptions as excs
 import django.forms as forms
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.urls import reverse
 from django.views import View
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 
 from bulkimport.forms.importfile import FileImportForm, is_m2m 
 from bulkimport import dict_utils
 from bulkimport.forms import fields as bf
-from bulkimport import importers
+from bulkimport import batching, export, importers, views
+from bulkimport.api import NDJSONImportView
+from bulkimport.models import ImportRecord
+from bulkimport.uploads import ChunkedUpload
+from bulkimport import filetypes as ft
 from dev.test_utils import TestCase
 
 class DummyModel(models.Model):
@@ -214,4 +230,459 @@ class TestFileImport(TestCase):
         importers.unregister("name")
         with self.assertRaises(ValueError):
             importers.unregister("name")
-    
\ No newline at end of file
+    
+
+class UserImport(FileImportForm):
+    DEFAULT_NAME_MAPPING = {"username": "identifiant", "first_name": "prénom", "email": "email"}
+
+    class Meta:
+        model = get_user_model()
+        fields = []
+        name_fields = ["username", "first_name", "email"]
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        User.objects.create_user("jdoe", first_name="John", email="jdoe@example.com")
+        User.objects.create_user("avecvirgule", first_name="a, b; \"c\"", email="")
+
+    def _round_trip(self, fmt):
+        User = get_user_model()
+        response = export.streaming_response(
+            UserImport, User.objects.order_by("pk"), fmt=fmt, chunk_size=1)
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content)
+        exported = list(User.objects.order_by("pk").values_list(*UserImport.Meta.name_fields))
+        User.objects.all().delete()
+        upl = InMemoryUploadedFile(
+            io.BytesIO(content), None, f"export.{fmt}", "text/plain", len(content), "utf-8")
+        form = UserImport({"_name_mapping_0": "identifiant", "_name_mapping_1": "prénom",
+            "_name_mapping_2": "email", "_encoding": "utf8"}, {"import_file": upl})
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(form.import_stats["rows_read"], 2)
+        self.assertEqual(form.import_stats["rows_created"], 2)
+        self.assertEqual(form.import_stats["file_size"], len(content))
+        self.assertEqual(len(form.import_stats["digest"]), 64)
+        self.assertEqual(
+            list(User.objects.order_by("pk").values_list(*UserImport.Meta.name_fields)),
+            exported)
+
+    def test_columns(self):
+        self.assertEqual(export.get_columns(UserImport), [
+            ("username", "identifiant"), ("first_name", "prénom"), ("email", "email")])
+        self.assertEqual(export.get_columns(Test), [("field2", "field2"), ("field3", "field3")])
+
+    def test_csv_round_trip(self):
+        self._round_trip("csv")
+
+    def test_jsonl_round_trip(self):
+        self._round_trip("jsonl")
+
+    def test_jsonl_load(self):
+        f = io.StringIO('{"a": 1, "b": 2}\n\n{"a": 3, "b": 4}\n')
+        data = ft.load(f, "file.jsonl")
+        self.assertEqual(data.keys, ["a", "b"])
+        self.assertEqual(len(list(data)), 2)
+        with self.assertRaises(dict_utils.DifferentKeys):
+            ft.load(io.StringIO('{"a": 1}\n{"b": 2}\n'), "file.jsonl")
+        with self.assertRaises(ft.NotIterable):
+            ft.load(io.StringIO('[1, 2]\n'), "file.jsonl")
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            export.streaming_response(UserImport, get_user_model().objects.all(), fmt="xml")
+
+    def test_unexportable_fields(self):
+        User = get_user_model()
+
+        class GroupsImport(FileImportForm):
+            class Meta:
+                model = User
+                fields = []
+                name_fields = ["username", "groups"]
+
+        for fmt in export.FORMATS:
+            with self.assertRaises(ValueError):
+                export.streaming_response(GroupsImport, User.objects.all(), fmt=fmt)
+
+        class LastLoginForm(forms.ModelForm):
+            last_login = forms.CharField(required=False)
+
+            class Meta:
+                model = User
+                fields = ["username", "last_login"]
+
+        class LastLoginImport(FileImportForm):
+            class Meta:
+                model = User
+                fields = []
+                name_fields = ["username", "last_login"]
+                form = LastLoginForm
+
+        # None would come back as ""
+        with self.assertRaises(ValueError):
+            export.streaming_response(LastLoginImport, User.objects.all(), fmt="csv")
+        export.streaming_response(LastLoginImport, User.objects.all(), fmt="jsonl")
+
+        class DatesImport(FileImportForm):
+            class Meta:
+                model = User
+                fields = []
+                name_fields = ["username", "last_login"]
+
+        # "" is read back as None
+        export.streaming_response(DatesImport, User.objects.all(), fmt="csv")
+
+    def test_register(self):
+        class UserExportView(views.ModelExportView):
+            form_class = UserImport
+            model_name = "user"
+
+        UserExportView.register("Utilisateurs")
+        self.addCleanup(importers.unregister_export, "export_user")
+        self.assertIs(importers._exports.get_view_class("export_user"), UserExportView)
+        # not listed with the import views
+        self.assertNotIn("export_user", importers._vl.views)
+
+
+class TestImportRecord(TestCase):
+
+    def _record(self, rows, duration, success=True):
+        return ImportRecord.objects.create(
+            view_name="users", rows_read=rows, rows_created=rows if success else 0,
+            save_duration=duration, success=success)
+
+    def test_from_stats(self):
+        rec = ImportRecord.from_stats("users", None, {
+            "file_name": "f.csv", "rows_read": 10, "rows_rejected": 2,
+            "parse_duration": 1, "validation_duration": 1, "unknown": 3}, False)
+        self.assertEqual(rec.duration, 2)
+        self.assertEqual(rec.error_rate, 0.2)
+        self.assertEqual(rec.throughput, 5)
+
+    def test_trend(self):
+        for _ in range(3):
+            self._record(100, 1)
+        self._record(100, 0, success=False)  # no throughput, ignored
+        slow = self._record(100, 10)
+        records = ImportRecord.objects.recent()
+        self.assertEqual(records[0], slow)
+        self.assertAlmostEqual(records[0].trend, 0.1)
+        self.assertIsNone(records[-1].trend)
+
+    def test_trend_window_per_view(self):
+        for _ in range(3):
+            self._record(100, 1)
+        # many recent imports of another view do not shorten the history of "users"
+        for _ in range(5):
+            ImportRecord.objects.create(view_name="other", rows_read=10, save_duration=1,
+                success=True)
+        slow = self._record(100, 10)
+        records = ImportRecord.objects.recent(limit=1, window=3)
+        self.assertEqual(records, [slow])
+        self.assertAlmostEqual(records[0].trend, 0.1)
+
+
+class TestAdaptiveBatcher(TestCase):
+
+    def _run(self, batcher, items, cost):
+        # fake clock : processing an item costs `cost` seconds
+        now = [0]
+        batcher.clock = lambda: now[0]
+        sizes = []
+        for batch in batcher.batches(items):
+            sizes.append(len(batch))
+            now[0] += cost * len(batch)
+        return sizes
+
+    def test_grows_when_fast(self):
+        batcher = batching.AdaptiveBatcher(min_size=2, max_size=64, target_latency=1)
+        sizes = self._run(batcher, list(range(200)), 0.001)
+        self.assertEqual(sizes[:5], [2, 4, 8, 16, 32])
+        self.assertEqual(max(sizes), 64)
+        self.assertEqual(sum(sizes), 200)
+
+    def test_shrinks_when_slow(self):
+        batcher = batching.AdaptiveBatcher(min_size=2, max_size=64, target_latency=1)
+        batcher.size = 64
+        sizes = self._run(batcher, list(range(200)), 0.1)
+        # at most halved at each step
+        self.assertEqual(sizes[:5], [64, 32, 16, 10, 10])
+        self.assertEqual(batcher.size, 10)
+
+    def test_db_share(self):
+        pauses = []
+        batcher = batching.AdaptiveBatcher(
+            min_size=10, max_size=10, target_latency=1, db_share=0.25, sleep=pauses.append)
+        self._run(batcher, list(range(30)), 0.1)
+        # no pause after the last batch
+        self.assertEqual(len(pauses), 2)
+        for p in pauses:
+            self.assertAlmostEqual(p, 3)
+        self.assertEqual(batcher.stats["batches"], 3)
+        self.assertAlmostEqual(batcher.stats["throttle_duration"], 6)
+
+    def test_bounds(self):
+        with self.assertRaises(ValueError):
+            batching.AdaptiveBatcher(min_size=10, max_size=5)
+        with self.assertRaises(ValueError):
+            batching.AdaptiveBatcher(db_share=2)
+
+
+class TestThrottledSave(TransactionTestCase):
+
+    def _form(self, usernames):
+        content = "identifiant,prénom,email\n" + "".join(f"{u},P,\n" for u in usernames)
+        upl = InMemoryUploadedFile(
+            io.BytesIO(content.encode()), None, "users.csv", "text/plain", len(content), "utf-8")
+        form = UserImport({"_name_mapping_0": "identifiant", "_name_mapping_1": "prénom",
+            "_name_mapping_2": "email", "_encoding": "utf8"}, {"import_file": upl})
+        self.assertTrue(form.is_valid(), form.errors)
+        return form
+
+    def _import(self, usernames):
+        form = self._form(usernames)
+        pauses = []
+
+        def sleep(pause):
+            # batches already saved, in the still open transaction
+            pauses.append((connection.in_atomic_block, get_user_model().objects.count()))
+
+        def Batcher(**kwargs):
+            return batching.AdaptiveBatcher(sleep=sleep, **kwargs)
+
+        with mock.patch("bulkimport.forms.importfile.AdaptiveBatcher", Batcher):
+            form.save()
+        self.assertEqual(form.import_stats["batches"], 3)
+        return pauses
+
+    @override_settings(BULKIMPORT_DB_SHARE=0.5, BULKIMPORT_BATCH_MIN_SIZE=2,
+        BULKIMPORT_BATCH_MAX_SIZE=2)
+    def test_pauses_between_batches(self):
+        self.assertEqual(self._import([f"u{i}" for i in range(5)]), [(True, 2), (True, 4)])
+        self.assertEqual(get_user_model().objects.count(), 5)
+
+    @override_settings(BULKIMPORT_BATCH_MIN_SIZE=2, BULKIMPORT_BATCH_MAX_SIZE=2)
+    def test_no_pause_without_db_share(self):
+        self.assertEqual(self._import([f"u{i}" for i in range(5)]), [])
+        self.assertEqual(get_user_model().objects.count(), 5)
+
+    @override_settings(BULKIMPORT_DB_SHARE=0.5, BULKIMPORT_BATCH_MIN_SIZE=2,
+        BULKIMPORT_BATCH_MAX_SIZE=2)
+    def test_atomic(self):
+        # the duplicate in the last batch cancels the first batches
+        form = self._form(["u0", "u1", "u2", "u3", "u0"])
+        with self.assertRaises(IntegrityError):
+            form.save()
+        self.assertEqual(get_user_model().objects.count(), 0)
+
+
+class UserImportView(views.ModelImportView):
+    form_class = UserImport
+    model_name = "users"
+
+
+class TestChunkedUpload(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.enterContext(override_settings(BULKIMPORT_UPLOAD_DIR=self.tmp.name))
+        self.addCleanup(self.tmp.cleanup)
+        User = get_user_model()
+        self.user = User.objects.create_user("staff", is_staff=True)
+        self.factory = RequestFactory()
+        self.content = "identifiant,prénom,email\njdoe,John,j@example.com\nasmith,Ann,\n".encode()
+
+    def _call(self, method, params, data=b"", content_type="application/octet-stream", user=None,
+            view_class=UserImportView):
+        fetch = getattr(self.factory, method)
+        if method == "get":
+            request = fetch("/", params)
+        else:
+            query = "&".join(f"{k}={v}" for k, v in params.items())
+            request = fetch(f"/?{query}", data, content_type=content_type)
+        request.user = user or self.user
+        response = view_class.as_view()(request)
+        return response.status_code, json.loads(response.content)
+
+    def _start(self):
+        status, data = self._call("post", {"upload": "new", "filename": "users.csv"})
+        self.assertEqual(status, 200)
+        return data["upload_id"]
+
+    def test_upload_and_resume(self):
+        upload_id = self._start()
+        first, second = self.content[:10], self.content[10:]
+        status, data = self._call("post", {"upload": upload_id, "index": 0, "offset": 0}, first)
+        self.assertEqual((data["index"], data["offset"]), (1, 10))
+        # replayed chunk is refused with the position to resume from
+        status, data = self._call("post", {"upload": upload_id, "index": 0, "offset": 0}, first)
+        self.assertEqual(status, 409)
+        self.assertEqual(data["offset"], 10)
+        status, data = self._call("get", {"upload": upload_id})
+        self.assertEqual((data["index"], data["offset"]), (1, 10))
+        status, data = self._call("post", {"upload": upload_id, "index": 1, "offset": 10}, second)
+        self.assertEqual(data["offset"], len(self.content))
+        # bad digest
+        status, data = self._call("post", {"upload": upload_id, "finish": 1, "sha256": "00"})
+        self.assertEqual(status, 400)
+        form_data = "_name_mapping_0=identifiant&_name_mapping_1=pr%C3%A9nom&_name_mapping_2=email&_encoding=utf8"
+        status, data = self._call(
+            "post", {"upload": upload_id, "finish": 1,
+                "sha256": hashlib.sha256(self.content).hexdigest()},
+            form_data, content_type="application/x-www-form-urlencoded")
+        self.assertEqual(status, 200, data)
+        self.assertEqual(data["created"], 2)
+        self.assertTrue(get_user_model().objects.filter(username="asmith").exists())
+        record = ImportRecord.objects.get()
+        self.assertEqual(record.file_size, len(self.content))
+        self.assertEqual(record.digest, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def _upload(self):
+        upload_id = self._start()
+        self._call("post", {"upload": upload_id, "index": 0, "offset": 0}, self.content)
+        return upload_id
+
+    def test_finish_locks_upload(self):
+        upload = ChunkedUpload(self._upload())
+        with open(upload.path, "rb") as f:
+            with upload.locked():
+                uploaded = upload.get_file(self.user, hashlib.sha256(self.content).hexdigest())
+                # closed by the form, the lock is kept
+                uploaded.close()
+                # a chunk sent meanwhile waits for the end of the import
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_second_finisher(self):
+        upload_id = self._upload()
+        params = {"upload": upload_id, "finish": 1,
+            "sha256": hashlib.sha256(self.content).hexdigest()}
+        form_data = "_name_mapping_0=identifiant&_name_mapping_1=pr%C3%A9nom&_name_mapping_2=email&_encoding=utf8"
+        statuses = []
+        save = UserImport.save
+
+        def save_and_finish(form, *args, **kwargs):
+            # the same upload finished again while it is imported
+            status, _ = self._call(
+                "post", params, form_data, content_type="application/x-www-form-urlencoded")
+            statuses.append(status)
+            return save(form, *args, **kwargs)
+
+        with mock.patch.object(UserImport, "save", autospec=True, side_effect=save_and_finish):
+            status, data = self._call(
+                "post", params, form_data, content_type="application/x-www-form-urlencoded")
+        self.assertEqual(status, 200, data)
+        self.assertEqual(statuses, [409])
+        self.assertEqual(get_user_model().objects.count(), 3)
+        # and once done, the upload is gone
+        status, _ = self._call(
+            "post", params, form_data, content_type="application/x-www-form-urlencoded")
+        self.assertEqual(status, 404)
+
+    def test_finish_form_kwargs(self):
+
+        class PrefixedImportView(UserImportView):
+            def get_form_kwargs(self):
+                return {**super().get_form_kwargs(), "prefix": "users"}
+
+        upload_id = self._upload()
+        form_data = ("users-_name_mapping_0=identifiant&users-_name_mapping_1=pr%C3%A9nom"
+            "&users-_name_mapping_2=email&users-_encoding=utf8")
+        status, data = self._call(
+            "post", {"upload": upload_id, "finish": 1,
+                "sha256": hashlib.sha256(self.content).hexdigest()},
+            form_data, content_type="application/x-www-form-urlencoded",
+            view_class=PrefixedImportView)
+        self.assertEqual(status, 200, data)
+        self.assertEqual(data["created"], 2)
+
+    def test_other_user(self):
+        upload_id = self._start()
+        other = get_user_model().objects.create_user("other", is_staff=True)
+        status, _ = self._call("get", {"upload": upload_id}, user=other)
+        self.assertEqual(status, 404)
+        status, _ = self._call("get", {"upload": "../../etc/passwd"})
+        self.assertEqual(status, 404)
+        status, _ = self._call(
+            "get", {"upload": upload_id}, user=get_user_model().objects.create_user("nostaff"))
+        self.assertEqual(status, 403)
+
+
+class TestNDJSONApi(TestCase):
+
+    def setUp(self):
+        importers.register("api_users", "Utilisateurs", UserImportView)
+        self.addCleanup(importers.unregister, "api_users")
+        User = get_user_model()
+        self.staff = User.objects.create_user("staff", is_staff=True)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + Token.objects.create(user=self.staff).key)
+        self.url = reverse("import:api", kwargs={"view_name": "api_users"})
+
+    def _post(self, lines, url=None, **params):
+        body = "\n".join(lines).encode()
+        return self.client.post(
+            url or self.url + "?" + "&".join(f"{k}={v}" for k, v in params.items()),
+            body, content_type="application/x-ndjson")
+
+    def test_import(self):
+        lines = [
+            json.dumps({"identifiant": f"u{i}", "prénom": "P", "email": ""}) for i in range(7)
+        ] + ["pas du json", "[1]", json.dumps({"identifiant": "u0", "prénom": "", "email": ""})]
+        with override_settings(BULKIMPORT_API_CHUNK_SIZE=3):
+            response = self._post(lines)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["read"], data["created"], data["rejected"]), (10, 7, 3))
+        self.assertEqual([e["line"] for e in data["errors"]], [8, 9, 10])
+        self.assertIn("username", data["errors"][2]["errors"])
+        self.assertEqual(get_user_model().objects.filter(username__startswith="u").count(), 7)
+        record = ImportRecord.objects.get()
+        self.assertEqual(record.view_name, "api_users")
+        self.assertEqual(record.user, self.staff)
+        self.assertEqual(record.file_size, len("\n".join(lines).encode()))
+
+    def test_duplicates_in_chunk(self):
+        lines = [json.dumps({"identifiant": name, "prénom": "", "email": ""})
+            for name in ("d1", "d2", "d1", "d3")]
+        response = self._post(lines)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["read"], data["created"], data["rejected"]), (4, 3, 1))
+        self.assertEqual([e["line"] for e in data["errors"]], [3])
+        self.assertEqual(
+            set(get_user_model().objects.filter(username__startswith="d").values_list(
+                "username", flat=True)), {"d1", "d2", "d3"})
+        self.assertFalse(ImportRecord.objects.get().success)
+
+    def test_no_content_length(self):
+        def post(content_length):
+            request = APIRequestFactory().post(
+                self.url, b'{"identifiant": "x"}', content_type="application/x-ndjson")
+            request.META.pop("CONTENT_LENGTH")
+            if content_length is not None:
+                request.META["CONTENT_LENGTH"] = content_length
+            force_authenticate(request, self.staff)
+            return NDJSONImportView.as_view()(request, view_name="api_users")
+
+        # chunked transfer encoding
+        self.assertEqual(post(None).status_code, 411)
+        self.assertEqual(post("0").status_code, 400)
+        self.assertFalse(ImportRecord.objects.exists())
+
+    def test_name_mapping(self):
+        response = self._post([json.dumps({"login": "x", "p": "", "e": ""})],
+            _name_mapping_0="login", _name_mapping_1="p", _name_mapping_2="e")
+        self.assertEqual(response.json()["created"], 1)
+
+    def test_errors(self):
+        url = reverse("import:api", kwargs={"view_name": "unknown"})
+        self.assertEqual(self._post([], url=url).status_code, 404)
+        self.client.credentials()
+        self.assertEqual(self._post([]).status_code, 401)
@@ -0,0 +1,202 @@
+"""
+date: 2026-10-19
+
+Téléversement d'un fichier d'import par morceaux, avec reprise.
+
+Le fichier est assemblé dans BULKIMPORT_UPLOAD_DIR (par défaut un sous-dossier
+du dossier temporaire du système) : `<id>.part` pour les données et `<id>.json`
+pour l'état (nom du fichier, utilisateur, numéro et position du prochain
+morceau). Chaque morceau doit annoncer son numéro et sa position ; en cas de
+désaccord, le client reprend à la position renvoyée, qui est celle du dernier
+morceau accepté. Le fichier assemblé est passé tel quel à FileImportForm.
+"""
+import contextlib
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import re
+import tempfile
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+
+BLOCK_SIZE = 64 * 1024
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def get_upload_dir() -> Path:
+    path = getattr(settings, "BULKIMPORT_UPLOAD_DIR", None)
+    if path is None:
+        path = Path(tempfile.gettempdir()) / "bulkimport_uploads"
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class UploadError(Exception):
+    """
+    Morceau refusé. status est le code HTTP à renvoyer, state l'état courant
+    du téléversement (pour la reprise) s'il existe.
+    """
+
+    def __init__(self, message, status=400, state=None):
+        super().__init__(message)
+        self.status = status
+        self.state = state
+
+
+class ChunkedUpload():
+
+    def __init__(self, upload_id: str, root: Path|None=None):
+        if not _ID_RE.match(upload_id or ""):
+            raise UploadError("Identifiant de téléversement invalide", status=404)
+        self.upload_id = upload_id
+        root = root or get_upload_dir()
+        self.path = root / f"{upload_id}.part"
+        self.state_path = root / f"{upload_id}.json"
+
+    @classmethod
+    def create(cls, user, filename: str, root: Path|None=None) -> "ChunkedUpload":
+        cls.clean_stale(root)
+        upload = cls(uuid.uuid4().hex, root)
+        upload.path.touch(exist_ok=False)
+        upload._write_state({
+            "filename": os.path.basename(filename),
+            "user": user.pk,
+            "index": 0,
+            "offset": 0,
+        })
+        return upload
+
+    @classmethod
+    def clean_stale(cls, root: Path|None=None, max_age=None):
+        """
+        Supprime les téléversements non modifiés depuis max_age (par défaut
+        BULKIMPORT_UPLOAD_MAX_AGE, un jour).
+        """
+        root = root or get_upload_dir()
+        max_age = max_age or getattr(
+            settings, "BULKIMPORT_UPLOAD_MAX_AGE", datetime.timedelta(days=1))
+        limit = (datetime.datetime.now() - max_age).timestamp()
+        for state_path in root.glob("*.json"):
+            try:
+                if state_path.stat().st_mtime < limit:
+                    cls(state_path.stem, root).delete()
+            except (OSError, UploadError):
+                continue
+
+    def _write_state(self, state: dict):
+        tmp = self.state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, self.state_path)
+
+    def get_state(self, user) -> dict:
+        """
+        État du téléversement, réservé à l'utilisateur qui l'a créé.
+        """
+        try:
+            state = json.loads(self.state_path.read_text())
+        except (OSError, ValueError):
+            raise UploadError("Téléversement inconnu", status=404)
+        if state["user"] != user.pk:
+            raise UploadError("Téléversement inconnu", status=404)
+        return state
+
+    def append(self, user, index: int, offset: int, stream) -> dict:
+        """
+        Ajoute le morceau lu dans stream (lecture par blocs, jamais en entier en
+        mémoire) et renvoie le nouvel état.
+
+        Un morceau précédent interrompu en cours d'écriture est écrasé : seule la
+        position enregistrée dans l'état fait foi.
+        """
+        max_size = getattr(settings, "BULKIMPORT_UPLOAD_MAX_SIZE", None)
+        try:
+            f = open(self.path, "r+b")
+        except FileNotFoundError:
+            raise UploadError("Téléversement inconnu", status=404)
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            state = self.get_state(user)
+            if index != state["index"] or offset != state["offset"]:
+                raise UploadError(
+                    f"Morceau {index} à la position {offset} inattendu",
+                    status=409, state=state)
+            f.seek(offset)
+            f.truncate()
+            while True:
+                block = stream.read(BLOCK_SIZE)
+                if not block:
+                    break
+                offset += len(block)
+                if max_size is not None and offset > max_size:
+                    f.truncate(state["offset"])
+                    raise UploadError("Fichier trop volumineux", status=413, state=state)
+                f.write(block)
+            state.update(index=index + 1, offset=offset)
+            self._write_state(state)
+        return state
+
+    def digest(self, f) -> str:
+        """
+        Empreinte sha256 du fichier ouvert f, relu depuis le début.
+        """
+        digest = hashlib.sha256()
+        f.seek(0)
+        while block := f.read(BLOCK_SIZE):
+            digest.update(block)
+        f.seek(0)
+        return digest.hexdigest()
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Verrou d'append, tenu jusqu'à la sortie du bloc sur un descripteur à
+        part : les fichiers renvoyés par get_file peuvent être fermés (ce que
+        fait FileImportForm) sans le libérer. Refusé si le verrou est déjà pris,
+        par un autre import ou par un morceau en cours d'écriture.
+        """
+        try:
+            lock = open(self.path, "rb")
+        except FileNotFoundError:
+            raise UploadError("Téléversement inconnu", status=404)
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError("Téléversement en cours d'utilisation", status=409)
+            yield
+
+    def get_file(self, user, sha256: str) -> UploadedFile:
+        """
+        Fichier assemblé, après vérification de son empreinte sha256.
+
+        Le fichier renvoyé pointe directement sur les données téléversées. À
+        appeler sous locked(), gardé jusqu'à la fin de l'import : aucun morceau
+        ne peut modifier le fichier entre la vérification et la suppression du
+        téléversement.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            raise UploadError("Téléversement inconnu", status=404)
+        try:
+            state = self.get_state(user)
+            if self.digest(f) != sha256.lower():
+                raise UploadError("Empreinte sha256 incorrecte", status=400, state=state)
+        except BaseException:
+            f.close()
+            raise
+        uploaded = UploadedFile(
+            f, name=state["filename"], size=state["offset"],
+            content_type="application/octet-stream")
+        uploaded.sha256 = sha256.lower()  # already computed, see FileImportForm._file_info
+        return uploaded
+
+    def delete(self):
+        self.path.unlink(missing_ok=True)
+        self.state_path.unlink(missing_ok=True)
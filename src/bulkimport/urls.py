@@ -8,13 +8,16 @@ export their urls.
 
 import importlib
 from django import urls
-from . import importers, views
+from . import api, importers, views
 
 
-patterns = [urls.path("", views.ImportIndex.as_view(), name="index")]
+patterns = [
+    urls.path("", views.ImportIndex.as_view(), name="index"),
+    urls.path("api/<str:view_name>/", api.NDJSONImportView.as_view(), name="api"),
+]
 
 app_name = "import"
 # all views modules must be imported before urlpatterns
-for pat in importers.urlpatterns:
+for pat in importers.urlpatterns + importers.export_urlpatterns:
     module = importlib.import_module(pat.callback.view_class.__module__)
-urlpatterns = patterns + importers.urlpatterns
+urlpatterns = patterns + importers.urlpatterns + importers.export_urlpatterns
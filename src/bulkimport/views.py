@@ -4,10 +4,14 @@ date: 2015-10-16
 
 from django import urls
 from django.contrib import messages
+from django.http import HttpResponseBadRequest, JsonResponse
 import django.views.generic as views
 
-from bulkimport import importers
-from utils.views import TemplateView, FormView, UserIsStaffMixin
+from bulkimport import export, importers
+from bulkimport.models import ImportRecord
+from bulkimport.uploads import ChunkedUpload, UploadError
+from utils.views import TemplateView, FormView, UserIsStaffMixin, View
+from utils.views import json_utils
 
 class ImportIndex(UserIsStaffMixin, TemplateView):
 
@@ -24,11 +28,89 @@ class ImportIndex(UserIsStaffMixin, TemplateView):
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         ctx["urls"] = importers.get_urls()
+        ctx["export_urls"] = importers.get_export_urls()
+        ctx["history"] = ImportRecord.objects.recent()
         return ctx
 
 import_view = ImportIndex.as_view()
 
-class ModelImportView(UserIsStaffMixin, FormView):
+class ChunkedUploadMixin():
+    """
+    Chunked, resumable upload of the import file, driven by the "upload" GET
+    parameter (json responses) :
+
+    - POST ?upload=new&filename=<name> : start an upload, returns its upload_id
+    - GET ?upload=<id> : current state, {index, offset} of the next chunk
+    - POST ?upload=<id>&index=<i>&offset=<o> : raw chunk as request body.
+      A 409 response carries the state to resume from.
+    - POST ?upload=<id>&finish=1&sha256=<hex> : other form fields as a regular
+      url-encoded body. The assembled file is checked then imported.
+
+    Without the "upload" parameter, the view behaves as usual.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        upload_id = request.GET.get("upload")
+        if upload_id is None:
+            return super().dispatch(request, *args, **kwargs)
+        # permission checks of the view still apply
+        if not self.test_func():
+            return JsonResponse(json_utils.error_data("Accès interdit"), status=403)
+        try:
+            if request.method == "GET":
+                return self.upload_response(ChunkedUpload(upload_id).get_state(request.user))
+            if request.method != "POST":
+                return JsonResponse(json_utils.error_data("Méthode non permise"), status=405)
+            if upload_id == "new":
+                upload = ChunkedUpload.create(
+                    request.user, request.GET.get("filename", "import"))
+                return self.upload_response(upload.get_state(request.user), upload.upload_id)
+            upload = ChunkedUpload(upload_id)
+            if "finish" in request.GET:
+                return self.finish_upload(upload)
+            try:
+                index = int(request.GET["index"])
+                offset = int(request.GET["offset"])
+            except (KeyError, ValueError):
+                raise UploadError("Paramètres index et offset requis")
+            state = upload.append(request.user, index, offset, request)
+            return self.upload_response(state)
+        except UploadError as e:
+            add_data = {"index": e.state["index"], "offset": e.state["offset"]} if e.state else {}
+            return JsonResponse(json_utils.error_data(str(e), add_data), status=e.status)
+
+    def upload_response(self, state, upload_id=None) -> JsonResponse:
+        data = {"index": state["index"], "offset": state["offset"]}
+        if upload_id is not None:
+            data["upload_id"] = upload_id
+        return JsonResponse(json_utils.json_data(data))
+
+    def finish_upload(self, upload) -> JsonResponse:
+        with upload.locked():
+            uploaded = upload.get_file(self.request.user, self.request.GET.get("sha256", ""))
+            try:
+                kwargs = self.get_form_kwargs()
+                prefix = kwargs.get("prefix")
+                field_name = f"{prefix}-import_file" if prefix else "import_file"
+                form = self.get_form_class()(**{
+                    **kwargs,
+                    "data": self.request.POST,
+                    "files": {field_name: uploaded},
+                })
+                if not form.is_valid():
+                    self.record_import(form, False)
+                    return JsonResponse(json_utils.error_data(
+                        "Import invalide", {"errors": form.errors.get_json_data()}), status=400)
+                instances = form.save()
+                self.record_import(form, True)
+            finally:
+                uploaded.close()
+            # still locked: a chunk waiting for the lock finds no upload
+            upload.delete()
+        return JsonResponse(json_utils.json_data(created=len(instances)))
+
+
+class ModelImportView(ChunkedUploadMixin, UserIsStaffMixin, FormView):
     """
     Base abstract view for importing data via FileImportForm.
     Use with form_class pointing to a child of FileImportForm
@@ -39,6 +121,10 @@ class ModelImportView(UserIsStaffMixin, FormView):
     
     To redirect after successful import, override get_sucess_url.
     Defaults to import index page.
+
+    Large files can be sent in chunks, see ChunkedUploadMixin.
+
+    Each submitted file is recorded as an ImportRecord, valid or not.
     """
 
     template_name = "bulkimport/import.html"
@@ -63,11 +149,22 @@ class ModelImportView(UserIsStaffMixin, FormView):
         account.mark_current("import")
         return [account]
     
+    def record_import(self, form, success):
+        if not form.import_stats:  # no file was read
+            return None
+        return ImportRecord.from_stats(
+            self.model_name, self.request.user, form.import_stats, success)
+
     def form_valid(self, form):
         instances = form.save()
+        self.record_import(form, True)
         messages.add_message(self.request, messages.INFO, f"{len(instances)} créé(s)")
         return super().form_valid(form)
 
+    def form_invalid(self, form):
+        self.record_import(form, False)
+        return super().form_invalid(form)
+
     def get_success_url(self) -> str:
         return urls.reverse("import:index")
 
@@ -78,3 +175,43 @@ class ModelImportView(UserIsStaffMixin, FormView):
         """
         view_name = f"{cls.model_name}"
         importers.register(view_name, name, cls)
+
+
+class ModelExportView(UserIsStaffMixin, View):
+    """
+    Base abstract view for exporting data in a file readable by form_class,
+    a child of FileImportForm.
+
+    Concrete class must have the same model_name/title_name attributes as
+    ModelImportView. The file format is taken from the "format" GET parameter
+    ("csv" or "jsonl", defaults to csv).
+
+    Override get_queryset to restrict exported rows.
+    """
+
+    form_class = None
+    model_name = None
+    title_name = ""
+
+    def get_queryset(self):
+        return self.form_class._meta.model._default_manager.order_by("pk")
+
+    def get(self, request, *args, **kwargs):
+        fmt = request.GET.get("format", "csv")
+        if fmt not in export.FORMATS:
+            return HttpResponseBadRequest(f"Format d'export inconnu : {fmt}")
+        try:
+            return export.streaming_response(
+                self.form_class, self.get_queryset(), fmt=fmt, filename=self.model_name)
+        except ValueError as e:
+            # format not suited to form_class (see export.check_csv)
+            return HttpResponseBadRequest(str(e))
+
+    @classmethod
+    def register(cls, name):
+        """
+        Register to importfile index page, as "export_{model_name}", in the
+        exports section.
+        """
+        view_name = f"export_{cls.model_name}"
+        importers.register_export(view_name, name, cls)
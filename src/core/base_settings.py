@@ -184,11 +184,27 @@ DB_BACKUP_COMMANDS = {
     "django.db.backends.postgresql" : {
         "command": "/usr/local/pgsql/bin/pg_dump",
         "base": "-F c", # optional
+        "parallel_base": "-F d", # optional, replaces base for parallel backups
+        "jobs": "-j {JOBS}", # optional, parallel backups
         "USER": "-U {USER}",
         "HOST": "-h {HOST}",
         "PORT": "-p {PORT}",
         "NAME": "-d {NAME}",
         "output": "-f {FILE}",
+        "store": "-Z 0", # optional, deduplicated store: no compression
+    }
+}
+
+DB_RESTORE_COMMANDS = {
+    "django.db.backends.postgresql" : {
+        "command": "/usr/local/pgsql/bin/pg_restore",
+        "base": "--clean --if-exists --no-acl --no-owner", # optional
+        "jobs": "-j {JOBS}", # optional
+        "USER": "-U {USER}",
+        "HOST": "-h {HOST}",
+        "PORT": "-p {PORT}",
+        "NAME": "-d {NAME}",
+        "input": "{FILE}",
     }
 }
 
@@ -0,0 +1,74 @@
+"""
+date: 2026-10-19
+
+Pire cas du nettoyage des QuillField (quill_editor.sanitize) : durée de
+clean_quill_html sur des contenus construits pour coûter cher, avec les limites
+par défaut (DEFAULT_LIMITS) et sans limite.
+
+Usage (depuis src/, sans réglages Django) :
+
+    python -m dev.stress_test.sanitize [--size MO]
+
+Chaque contenu est essayé à la taille demandée et juste sous max_bytes. Avec
+les limites, la durée ne dépend plus de la taille envoyée : au-delà de
+max_bytes le contenu est refusé avant l'analyse, et l'analyse s'arrête au
+premier élément en trop (max_elements, max_depth). Le pire cas est alors le plus
+gros contenu accepté ("accepted").
+"""
+import argparse
+import time
+
+from quill_editor.sanitize import DEFAULT_LIMITS, SanitizeLimitError, clean_quill_html
+
+
+def get_payloads(size: int) -> dict[str, str]:
+    """
+    Contenus d'au plus size octets.
+    """
+    units = {
+        "text": "x",
+        "nesting": "<div>",
+        "elements": "<span>x</span>",
+        "formulas": '<span class="ql-formula" data-value="x"><span>k</span></span>',
+    }
+    return {name: unit * (size // len(unit)) for name, unit in units.items()}
+
+
+def get_accepted() -> str:
+    """
+    Plus gros contenu accepté : juste sous chacune des limites.
+    """
+    line = "<p>" + "<strong>x</strong>" * 99 + "</p>"
+    return line * min(
+        DEFAULT_LIMITS["max_elements"] // 100, DEFAULT_LIMITS["max_bytes"] // len(line))
+
+
+def measure(html: str, limits) -> tuple[float, str]:
+    start = time.perf_counter()
+    try:
+        clean_quill_html(html, limits=limits)
+        outcome = "ok"
+    except SanitizeLimitError as e:
+        outcome = e.code
+    return time.perf_counter() - start, outcome
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--size", type=float, default=20, help="Size of the payloads (MB)")
+    options = parser.parse_args(argv)
+    payloads = [
+        *get_payloads(int(options.size * 1024 * 1024)).items(),
+        *get_payloads(DEFAULT_LIMITS["max_bytes"]).items(),
+        ("accepted", get_accepted()),
+    ]
+    print(f"{'payload':<10} {'bytes':>10} {'limited':>24} {'unlimited':>12}")
+    for name, html in payloads:
+        limited, outcome = measure(html, DEFAULT_LIMITS)
+        unlimited, _ = measure(html, False)
+        print(f"{name:<10} {len(html):>10} {limited * 1000:>9.1f} ms {outcome:<12}"
+            f"{unlimited * 1000:>9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,16 @@
 import core.base_settings as base
 DEFAULT_CONFIG = base.QUILL_CONFIGS["default"]
 
-MEDIA_JS = [
-    # syntax-highlight
-    "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/10.1.1/highlight.min.js",
+# syntax-highlight, only with the "syntax" module
+HIGHLIGHT_JS = "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/10.1.1/highlight.min.js"
+HIGHLIGHT_CSS = "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/10.1.1/styles/darcula.min.css"
+QUILL_JS = [
     # quill
     "js/vendor/quill.min.js",
     # custom
     "js/quill_editor/quill_editor.js",
-    "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-chtml.js"
 ]
-MEDIA_CSS = [
-    # syntax-highlight
-    "style/quill.snow.css",
-    "https://cdnjs.cloudflare.com/ajax/libs/highlight.js/10.1.1/styles/darcula.min.css",
-    # custom
-]
\ No newline at end of file
+QUILL_CSS = ["style/quill.snow.css"]
+# only loaded with "formula" in the toolbar, or content with formulas (see
+# QuillWidget.render)
+MATHJAX_JS = "https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-chtml.js"
@@ -0,0 +1,249 @@
+"""
+Quill Delta storage (QuillField(storage="delta")).
+
+The field stores the editor's document as Delta JSON (``quill.getContents()``)
+instead of its rendered ``root.innerHTML``: no KaTeX or highlight.js markup, a
+fraction of the size. Writing only validates the Delta against the formats of
+the "default" config (normalize_delta, no HTML parsing); the HTML is rendered by
+the server (render_html), from the allowlists of quill_editor.sanitize: every
+text is escaped and every tag and attribute is written here, so the output is
+safe by construction (and unchanged by clean_quill_html).
+
+Rendered HTML is cached by hash of the Delta (DeltaCache, same settings as
+SanitizeCache): a page shows stored content without rendering it again.
+
+A field switched from HTML to Delta storage keeps its HTML rows: any stored
+value that is not JSON is legacy HTML (loads_stored), displayed through
+clean_quill_html and turned into a Delta by the editor on its next save.
+"""
+import json
+import re
+
+from .sanitize import (
+    _INVALID_CHARS, SanitizeCache, SanitizeLimitError, _escape, _escape_attribute,
+    check_size, clean_quill_html, get_allowlist_version, is_allowed_url)
+
+INLINE_FORMATS = ("bold", "italic", "underline")
+# outermost first, as Quill nests them
+INLINE_TAGS = (("bold", "strong"), ("italic", "em"), ("underline", "u"))
+EMBEDS = ("formula",)
+LINK_ATTRIBUTES = ' rel="noopener noreferrer" target="_blank"'
+
+_LANGUAGE = re.compile(r"^[\w+#-]{1,32}$")
+
+# bump when the output of render_html changes for the same Delta
+RENDERER_VERSION = 1
+
+
+def _normalize_attributes(attributes, line: bool) -> dict:
+    if attributes is None:
+        return {}
+    if not isinstance(attributes, dict):
+        raise ValueError("Delta attributes must be an object")
+    normalized = {}
+    for name in INLINE_FORMATS:
+        if attributes.get(name):
+            normalized[name] = True
+    link = attributes.get("link")
+    if isinstance(link, str) and link and is_allowed_url(link):
+        normalized["link"] = link
+    if line:
+        if attributes.get("blockquote"):
+            normalized["blockquote"] = True
+        language = attributes.get("code-block")
+        if language:
+            normalized["code-block"] = (
+                language if isinstance(language, str) and _LANGUAGE.match(language) else "plain")
+    return normalized
+
+
+def normalize_delta(value, limits: dict|None=None) -> dict:
+    """
+    Document Delta (JSON text, or already decoded) reduced to the allowed
+    formats and embeds, adjacent inserts with the same attributes merged.
+    Raises ValueError for anything but a document (inserts only), and
+    SanitizeLimitError beyond limits (see sanitize.get_limits: bytes of the
+    JSON, ops for elements).
+    """
+    if isinstance(value, str):
+        check_size(value, limits)
+        try:
+            value = json.loads(value)
+        except (ValueError, RecursionError) as e:
+            raise ValueError(f"Invalid Delta JSON: {e}") from e
+    ops = value.get("ops") if isinstance(value, dict) else value
+    if not isinstance(ops, list):
+        raise ValueError("A Delta must have a list of ops")
+    max_elements = limits and limits["max_elements"]
+    if max_elements is not None and len(ops) > max_elements:
+        raise SanitizeLimitError(f"Too many operations (more than {max_elements})", "max_elements")
+    normalized = []
+    for op in ops:
+        if not isinstance(op, dict) or "insert" not in op:
+            raise ValueError("A document Delta only has insert operations")
+        insert = op["insert"]
+        if isinstance(insert, str):
+            insert = _INVALID_CHARS.sub("", insert)
+            if not insert:
+                continue
+            attributes = _normalize_attributes(op.get("attributes"), "\n" in insert)
+        elif isinstance(insert, dict):
+            embed = {name: _INVALID_CHARS.sub("", insert[name]) for name in EMBEDS
+                if name in insert and isinstance(insert[name], str)}
+            if len(embed) != 1:
+                # image, video...: not allowed
+                continue
+            insert = embed
+            attributes = _normalize_attributes(op.get("attributes"), False)
+        else:
+            raise ValueError("A Delta insert is a string or an embed")
+        if (normalized and isinstance(insert, str) and isinstance(normalized[-1]["insert"], str)
+                and normalized[-1].get("attributes", {}) == attributes):
+            normalized[-1]["insert"] += insert
+            continue
+        op = {"insert": insert}
+        if attributes:
+            op["attributes"] = attributes
+        normalized.append(op)
+    # a document always ends with a line break
+    last = normalized[-1]["insert"] if normalized else None
+    if not (isinstance(last, str) and last.endswith("\n")):
+        normalized.append({"insert": "\n"})
+    return {"ops": normalized}
+
+
+def loads_stored(value: str):
+    """
+    Decoded JSON of a value stored by a storage=DELTA field, or None for
+    legacy HTML: anything but a JSON Delta ({"ops": [...]} or a list of ops),
+    so that text such as "42" or "true" is not taken for a Delta.
+    """
+    try:
+        value = json.loads(value)
+    except RecursionError as e:
+        raise ValueError(f"Invalid Delta JSON: {e}") from e
+    except ValueError:
+        return None
+    if isinstance(value, list) or (isinstance(value, dict) and "ops" in value):
+        return value
+    return None
+
+
+def render_stored(value: str) -> str:
+    """
+    HTML of a stored value: rendered from its Delta, or legacy HTML cleaned.
+    """
+    delta = loads_stored(value)
+    if delta is None:
+        # stored content, accepted within the limits of its time
+        return clean_quill_html(value, limits=False)
+    return render_html(delta)
+
+
+def dumps(delta: dict) -> str:
+    """
+    Stored form of a normalized Delta.
+    """
+    return json.dumps(delta, ensure_ascii=False, separators=(",", ":"))
+
+
+def _lines(ops: list) -> list[tuple]:
+    """
+    (segments, line attributes) of each line; a segment is a text or an embed
+    with its inline attributes.
+    """
+    lines = []
+    segments = []
+    for op in ops:
+        insert = op["insert"]
+        attributes = op.get("attributes", {})
+        if isinstance(insert, dict):
+            segments.append((insert, attributes))
+            continue
+        parts = insert.split("\n")
+        for i, part in enumerate(parts):
+            if part:
+                segments.append((part, attributes))
+            if i < len(parts) - 1:
+                lines.append((segments, attributes))
+                segments = []
+    if segments:
+        lines.append((segments, {}))
+    return lines
+
+
+def _render_inline(segments: list) -> str:
+    out = []
+    for insert, attributes in segments:
+        if isinstance(insert, dict):
+            out.append(
+                f'<span class="ql-formula" data-value="{_escape_attribute(insert["formula"])}">'
+                "</span>")
+            continue
+        html = _escape(insert)
+        if "link" in attributes:
+            html = f'<a href="{_escape_attribute(attributes["link"])}"{LINK_ATTRIBUTES}>{html}</a>'
+        for name, tag in reversed(INLINE_TAGS):
+            if attributes.get(name):
+                html = f"<{tag}>{html}</{tag}>"
+        out.append(html)
+    return "".join(out) or "<br>"
+
+
+def render_html(value) -> str:
+    """
+    HTML of a Delta (see normalize_delta), as Quill 2 renders it: a <p> or
+    <blockquote> per line, code blocks as ql-code-block lines without
+    highlighting, formulas as their source only.
+    """
+    lines = _lines(normalize_delta(value)["ops"])
+    out = []
+    i = 0
+    while i < len(lines):
+        segments, attributes = lines[i]
+        if "code-block" in attributes:
+            out.append('<div class="ql-code-block-container" spellcheck="false">')
+            while i < len(lines) and "code-block" in lines[i][1]:
+                segments, attributes = lines[i]
+                text = "".join(insert for insert, _ in segments if isinstance(insert, str))
+                out.append(
+                    f'<div class="ql-code-block" '
+                    f'data-language="{_escape_attribute(attributes["code-block"])}">'
+                    f"{_escape(text) or '<br>'}</div>")
+                i += 1
+            out.append("</div>")
+            continue
+        tag = "blockquote" if attributes.get("blockquote") else "p"
+        out.append(f"<{tag}>{_render_inline(segments)}</{tag}>")
+        i += 1
+    return "".join(out)
+
+
+class DeltaCache(SanitizeCache):
+    """
+    render_stored, cached by hash of the stored value (see SanitizeCache).
+    """
+    PREFIX = "quill-delta"
+    IDEMPOTENT = False
+
+    def check(self, value: str):
+        # stored Delta, checked by normalize_delta when it was written
+        pass
+
+    def transform(self, value: str) -> str:
+        return render_stored(value)
+
+    def get_version(self) -> str:
+        return f"{RENDERER_VERSION}.{get_allowlist_version()}"
+
+    render = SanitizeCache.clean
+
+
+delta_cache = DeltaCache()
+
+
+def cached_render_html(value: str) -> str:
+    """
+    render_stored, through delta_cache.
+    """
+    return delta_cache.render(value)
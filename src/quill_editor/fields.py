@@ -1,12 +1,138 @@
-from django.db import models
+from functools import partialmethod
 
-from django.db import models
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connections, models, router
+from django.db.models import Value, signals
 
+from . import delta as quill_delta
 from .forms import QuillFormField
+from .sanitize import extract_text
+
+HTML = "html"
+DELTA = "delta"
+
+
+def get_search_config() -> str:
+    return getattr(settings, "QUILL_SEARCH_CONFIG", "french")
 
 
 class QuillField(models.TextField):
+    """
+    HTML of a Quill editor.
+
+    Like the width_field/height_field of an ImageField, text_field and
+    search_field name fields of the model kept up to date on save:
+
+        class Page(models.Model):
+            body = QuillField(text_field="body_text", search_field="body_search")
+            body_text = models.TextField(blank=True, editable=False)
+            body_search = SearchVectorField(null=True, editable=False)
+
+            class Meta:
+                indexes = [GinIndex(fields=["body_search"])]
+
+    text_field receives the plain text (see sanitize.extract_text) and can be
+    searched without matching markup; search_field, on PostgreSQL only, its
+    tsvector (QUILL_SEARCH_CONFIG, "french" by default), to filter with
+    body_search=SearchQuery(...). A save(update_fields=[...]) must list them.
+    Existing rows are filled by the backfill_quill_text command.
+
+    With storage=DELTA, the field stores the Delta JSON of the editor instead
+    of its HTML (see quill_editor.delta); get_<name>_html() gives the HTML to
+    display in both modes. Rows saved as HTML before the switch stay readable
+    (cleaned HTML) and become Deltas when saved again from the editor.
+    """
+
+    def __init__(self, *args, text_field=None, search_field=None, storage=HTML, **kwargs):
+        if storage not in (HTML, DELTA):
+            raise ValueError(f"Unknown QuillField storage: {storage}")
+        self.text_field = text_field
+        self.search_field = search_field
+        self.storage = storage
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.storage != HTML:
+            kwargs["storage"] = self.storage
+        if self.text_field:
+            kwargs["text_field"] = self.text_field
+        if self.search_field:
+            kwargs["search_field"] = self.search_field
+        return name, path, args, kwargs
+
+    def check(self, **kwargs):
+        return [*super().check(**kwargs), *self._check_companions()]
+
+    def _check_companions(self):
+        errors = []
+        for option in ("text_field", "search_field"):
+            name = getattr(self, option)
+            if name is None:
+                continue
+            try:
+                self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                errors.append(checks.Error(
+                    f"{option} refers to the nonexistent field '{name}'.",
+                    obj=self, id="quill_editor.E001"))
+        return errors
+
+    @property
+    def companions(self) -> list[str]:
+        return [name for name in (self.text_field, self.search_field) if name]
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        if f"get_{self.name}_html" not in cls.__dict__:
+            setattr(cls, f"get_{self.name}_html", partialmethod(_get_html, field=self))
+        # as ImageField: only concrete models are saved
+        if self.companions and not cls._meta.abstract:
+            signals.pre_save.connect(self._pre_save_companions, sender=cls, weak=False)
+
+    def _pre_save_companions(self, sender, instance, raw=False, using=None, **kwargs):
+        if not raw:
+            self.update_companions(instance, using)
+
+    def update_companions(self, instance, using: str|None=None) -> list[str]:
+        """
+        Fills the companion fields of instance from its content; returns their
+        names (for bulk_update).
+        """
+        updated = []
+        if not self.companions:
+            return updated
+        text = extract_text(self.to_html(getattr(instance, self.attname)))
+        if self.text_field:
+            setattr(instance, self.text_field, text)
+            updated.append(self.text_field)
+        using = using or router.db_for_write(instance.__class__, instance=instance)
+        if self.search_field and connections[using].vendor == "postgresql":
+            # needs psycopg, installed along with PostgreSQL only
+            from django.contrib.postgres.search import SearchVector
+
+            setattr(instance, self.search_field, SearchVector(
+                Value(text, output_field=models.TextField()), config=get_search_config()))
+            updated.append(self.search_field)
+        return updated
+
+    def to_html(self, value: str|None) -> str:
+        """
+        HTML of a stored value: as is, or rendered from the Delta (cached,
+        see delta.render_stored).
+        """
+        if not value:
+            return ""
+        if self.storage == DELTA:
+            return quill_delta.cached_render_html(value)
+        return value
 
     def formfield(self, **kwargs):
-        kwargs.update({"form_class": QuillFormField})
-        return super().formfield(**kwargs)
\ No newline at end of file
+        kwargs.update({"form_class": QuillFormField, "delta": self.storage == DELTA})
+        return super().formfield(**kwargs)
+
+
+def _get_html(instance, field: QuillField) -> str:
+    return field.to_html(getattr(instance, field.attname))
@@ -1,20 +1,32 @@
 from django import forms
 
-from .sanitize import clean_quill_html
+from . import delta as quill_delta
+from .sanitize import SanitizeLimitError, cached_clean_quill_html, get_limits
 from .widgets import QuillWidget
 
 __all__ = ("QuillFormField",)
 
 
 class QuillFormField(forms.fields.CharField):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, delta=False, **kwargs):
+        self.delta = delta
         kwargs.update(
             {
-                "widget": QuillWidget(),
+                "widget": QuillWidget(delta=delta),
             }
         )
         super().__init__(*args, **kwargs)
 
     def clean(self, value):
         value = super().clean(value)
-        return clean_quill_html(value)
\ No newline at end of file
+        try:
+            if not self.delta:
+                return cached_clean_quill_html(value)
+            if not value:
+                return value
+            # a Delta is only validated, its HTML is rendered on display
+            return quill_delta.dumps(quill_delta.normalize_delta(value, get_limits()))
+        except SanitizeLimitError as e:
+            raise forms.ValidationError(str(e), code=e.code) from e
+        except ValueError as e:
+            raise forms.ValidationError(str(e), code="invalid") from e
@@ -0,0 +1,68 @@
+"""
+date: 2026-10-19
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quill_editor import resanitize
+
+class Command(BaseCommand):
+    help = "Fill the text_field and search_field of every QuillField from the stored content"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels',
+            nargs='*',
+            metavar='APP_LABEL[.MODEL]',
+            help='Only these applications or models (default: every QuillField with companions)',
+        )
+        parser.add_argument(
+            '--after',
+            type=str,
+            metavar='PK',
+            help='Resume after this primary key (a single model only)',
+            default=None
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Rows read and written at once (default: QUILL_RESANITIZE_CHUNK_SIZE setting)',
+            default=None
+        )
+
+    def progress(self, label, last_pk, rows, changed):
+        self.last_pk = last_pk
+        if self.verbosity > 1:
+            self.stdout.write(f"{label}: {rows} rows, last pk {last_pk}")
+
+    def handle(self, *args, **options):
+        self.verbosity = options.get("verbosity", 1)
+        try:
+            models = resanitize.get_companion_fields(options["labels"])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        after = options["after"]
+        if after is not None and len(models) != 1:
+            raise CommandError("--after needs a single model")
+        if not models:
+            self.stdout.write("No QuillField with text_field or search_field")
+            return
+        for model, fields in models:
+            label = model._meta.label
+            self.last_pk = after
+            try:
+                result = resanitize.backfill(
+                    model, fields, after=after, chunk_size=options["chunk_size"],
+                    progress=self.progress)
+            except (Exception, KeyboardInterrupt) as e:
+                # the chunks written so far are committed, see resanitize_quill
+                resume = "" if self.last_pk is None else f" --after {self.last_pk}"
+                raise CommandError(
+                    f"Error while filling {label}: {e} "
+                    f"(resume with: backfill_quill_text {label}{resume})") from e
+            rate = result["rows"] / result["duration"] if result["duration"] else 0
+            skipped = f", {result['skipped']} edited meanwhile" if result["skipped"] else ""
+            self.stdout.write(
+                f"{label}: {result['rows']} rows{skipped} in {result['duration']:.1f}s "
+                f"({rate:.0f} rows/s)")
+        self.stdout.write(self.style.SUCCESS("QuillField companions filled"))
@@ -0,0 +1,82 @@
+"""
+date: 2026-10-19
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quill_editor import resanitize
+
+class Command(BaseCommand):
+    help = "Clean again the stored content of every QuillField (see quill_editor.sanitize)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels',
+            nargs='*',
+            metavar='APP_LABEL[.MODEL]',
+            help='Only these applications or models (default: every model with a QuillField)',
+        )
+        parser.add_argument(
+            '--after',
+            type=str,
+            metavar='PK',
+            help='Resume after this primary key (a single model only)',
+            default=None
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of processes cleaning the content',
+            default=4
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            help='Rows read and written at once (default: QUILL_RESANITIZE_CHUNK_SIZE setting)',
+            default=None
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count the rows that would change',
+        )
+
+    def progress(self, label, last_pk, rows, changed):
+        self.last_pk = last_pk
+        if self.verbosity > 1:
+            self.stdout.write(f"{label}: {rows} rows, {changed} changed, last pk {last_pk}")
+
+    def handle(self, *args, **options):
+        self.verbosity = options.get("verbosity", 1)
+        try:
+            models = resanitize.get_quill_fields(options["labels"])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+        after = options["after"]
+        if after is not None and len(models) != 1:
+            raise CommandError("--after needs a single model")
+        if not models:
+            self.stdout.write("No QuillField to clean")
+            return
+        resanitizer = resanitize.Resanitizer(
+            workers=options["workers"], chunk_size=options["chunk_size"],
+            dry_run=options["dry_run"], progress=self.progress)
+        with resanitizer:
+            for model, fields in models:
+                label = model._meta.label
+                self.last_pk = after
+                try:
+                    result = resanitizer.run(model, fields, after=after)
+                except (Exception, KeyboardInterrupt) as e:
+                    # the chunks written so far are committed
+                    resume = "" if self.last_pk is None else f" --after {self.last_pk}"
+                    raise CommandError(
+                        f"Error while cleaning {label}: {e} "
+                        f"(resume with: resanitize_quill {label}{resume})") from e
+                rate = result["rows"] / result["duration"] if result["duration"] else 0
+                verb = "would change" if options["dry_run"] else "changed"
+                skipped = f", {result['skipped']} edited meanwhile" if result["skipped"] else ""
+                self.stdout.write(
+                    f"{label}: {result['rows']} rows, {result['changed']} {verb}{skipped} "
+                    f"in {result['duration']:.1f}s ({rate:.0f} rows/s)")
+        self.stdout.write(self.style.SUCCESS("QuillField content cleaned"))
@@ -0,0 +1,232 @@
+"""
+date: 2026-10-19
+"""
+
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, models
+
+from dev.test_utils import TestCase
+from quill_editor import resanitize
+from quill_editor.fields import QuillField
+
+
+class QuillDocument(models.Model):
+    """
+    Test model: quill_editor has no models module, the table is created by
+    QuillDocumentTable.
+    """
+
+    class Meta:
+        app_label = "quill_editor"
+
+    title = models.CharField(max_length=64)
+    body = QuillField(blank=True, text_field="body_text", search_field="body_search")
+    summary = QuillField(blank=True)
+    notes = QuillField(blank=True, storage="delta")
+    body_text = models.TextField(blank=True, editable=False)
+    # SearchVectorField on PostgreSQL, left alone elsewhere
+    body_search = models.TextField(blank=True, editable=False)
+
+
+DIRTY = "<p onclick='x'>a</p><script>alert(1)</script>"
+CLEAN = "<p>a</p>alert(1)"
+
+
+class QuillDocumentTable():
+    """
+    Creates the table of QuillDocument for the test class.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # outside of the class transaction (SQLite)
+        with connection.schema_editor() as editor:
+            editor.create_model(QuillDocument)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(QuillDocument)
+
+
+class TestResanitize(QuillDocumentTable, TestCase):
+
+    def setUp(self):
+        self.docs = [
+            QuillDocument.objects.create(
+                title=str(i), body=DIRTY if i % 3 == 0 else CLEAN, summary=CLEAN)
+            for i in range(10)]
+
+    def test_get_quill_fields(self):
+        self.assertIn((QuillDocument, ["body", "summary", "notes"]),
+            resanitize.get_quill_fields())
+        self.assertEqual(resanitize.get_quill_fields(["quill_editor"]),
+            [(QuillDocument, ["body", "summary", "notes"])])
+        with self.assertRaises(ValueError):
+            resanitize.get_quill_fields(["auth"])
+        with self.assertRaises(ValueError):
+            resanitize.get_quill_fields(["missing.Model"])
+
+    def test_clean_rows(self):
+        self.assertEqual(resanitize.clean_rows([(1, [CLEAN, ""]), (2, [DIRTY, CLEAN])]),
+            [(2, [CLEAN, CLEAN])])
+        # a Delta is normalized, not cleaned as HTML
+        stored = '{"ops":[{"insert":"<p>a</p>\\n"}]}'
+        self.assertEqual(resanitize.clean_rows(
+            [(1, [CLEAN, stored]), (2, [CLEAN, '{"ops": [{"insert": "b"}]}'])], [False, True]),
+            [(2, [CLEAN, '{"ops":[{"insert":"b"},{"insert":"\\n"}]}'])])
+
+    def test_only_changed_rows_written(self):
+        with mock.patch.object(models.QuerySet, "update",
+                autospec=True, side_effect=models.QuerySet.update) as update:
+            with resanitize.Resanitizer(workers=1, chunk_size=4) as resanitizer:
+                result = resanitizer.run(QuillDocument, ["body", "summary"])
+        self.assertEqual((result["rows"], result["changed"]), (10, 4))
+        self.assertEqual(result["last_pk"], self.docs[-1].pk)
+        self.assertEqual(update.call_count, 4)
+        self.assertFalse(QuillDocument.objects.filter(body=DIRTY).exists())
+
+    def test_edited_meanwhile(self):
+        clean_rows = resanitize.clean_rows
+
+        def edit_then_clean(rows, deltas):
+            # saved by a user between the read and the write
+            QuillDocument.objects.filter(pk=self.docs[3].pk).update(body="<p>edited</p>")
+            return clean_rows(rows, deltas)
+
+        with mock.patch.object(resanitize, "clean_rows", side_effect=edit_then_clean):
+            with resanitize.Resanitizer(workers=1) as resanitizer:
+                result = resanitizer.run(QuillDocument, ["body", "summary"])
+        self.assertEqual((result["changed"], result["skipped"]), (3, 1))
+        self.assertEqual(QuillDocument.objects.get(pk=self.docs[3].pk).body, "<p>edited</p>")
+        self.assertEqual(QuillDocument.objects.filter(body=DIRTY).count(), 0)
+
+    def test_pool_and_resume(self):
+        progress = []
+        after = self.docs[4].pk
+        with resanitize.Resanitizer(workers=2, chunk_size=2,
+                progress=lambda *args: progress.append(args)) as resanitizer:
+            result = resanitizer.run(QuillDocument, ["body", "summary"], after=after)
+        self.assertEqual((result["rows"], result["changed"]), (5, 2))
+        self.assertEqual([args[1] for args in progress],
+            [self.docs[i].pk for i in (6, 8, 9)])
+        bodies = dict(QuillDocument.objects.values_list("pk", "body"))
+        self.assertEqual(bodies[self.docs[0].pk], DIRTY)
+        self.assertEqual(bodies[self.docs[3].pk], DIRTY)
+        self.assertEqual(bodies[self.docs[6].pk], CLEAN)
+        self.assertEqual(bodies[self.docs[9].pk], CLEAN)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("resanitize_quill", "quill_editor", dry_run=True, workers=1, stdout=out)
+        self.assertIn("quill_editor.QuillDocument: 10 rows, 4 would change", out.getvalue())
+        self.assertEqual(QuillDocument.objects.filter(body=DIRTY).count(), 4)
+        out = StringIO()
+        call_command("resanitize_quill", "quill_editor.QuillDocument", workers=2, stdout=out)
+        self.assertIn("quill_editor.QuillDocument: 10 rows, 4 changed", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        self.assertFalse(QuillDocument.objects.filter(body=DIRTY).exists())
+
+    def test_command_resume(self):
+        with self.assertRaises(CommandError):
+            call_command("resanitize_quill", "auth", stdout=StringIO())
+        with mock.patch.object(resanitize, "get_quill_fields",
+                return_value=[(QuillDocument, ["body"])] * 2):
+            with self.assertRaises(CommandError):
+                call_command("resanitize_quill", after="1", stdout=StringIO())
+        write = resanitize.Resanitizer.write
+
+        def fail(resanitizer, model, fields, dbname, objs, changed):
+            if objs[0].pk > self.docs[4].pk:
+                raise RuntimeError("interrupted")
+            return write(resanitizer, model, fields, dbname, objs, changed)
+
+        with mock.patch.object(resanitize.Resanitizer, "write", fail):
+            with self.assertRaisesRegex(CommandError,
+                    f"resanitize_quill quill_editor.QuillDocument --after {self.docs[4].pk}"):
+                call_command("resanitize_quill", "quill_editor", workers=1, chunk_size=5,
+                    stdout=StringIO())
+        self.assertEqual(QuillDocument.objects.filter(body=DIRTY).count(), 2)
+        call_command("resanitize_quill", "quill_editor", after=str(self.docs[4].pk),
+            workers=1, stdout=StringIO())
+        self.assertFalse(QuillDocument.objects.filter(body=DIRTY).exists())
+
+    def test_resanitize_updates_text(self):
+        QuillDocument.objects.update(body_text="")
+        with resanitize.Resanitizer(workers=1) as resanitizer:
+            resanitizer.run(QuillDocument, ["body", "summary"])
+        texts = dict(QuillDocument.objects.values_list("pk", "body_text"))
+        self.assertEqual(texts[self.docs[0].pk], "a\nalert(1)")
+        # unchanged rows are not written
+        self.assertEqual(texts[self.docs[1].pk], "")
+
+
+class TestCompanionFields(QuillDocumentTable, TestCase):
+
+    def test_text_on_save(self):
+        doc = QuillDocument.objects.create(
+            title="t", body='<p>Aire <span class="ql-formula" data-value="\\pi r^2">r</span></p>')
+        doc.refresh_from_db()
+        self.assertEqual(doc.body_text, "Aire \\pi r^2")
+        self.assertEqual(doc.body_search, "")
+        doc.body = "<p>x</p><p>y</p>"
+        doc.save()
+        self.assertEqual(QuillDocument.objects.get(body_text="x\ny").pk, doc.pk)
+
+    def test_field_options(self):
+        field = QuillDocument._meta.get_field("body")
+        self.assertEqual(field.check(), [])
+        _, _, _, kwargs = field.deconstruct()
+        self.assertEqual((kwargs["text_field"], kwargs["search_field"]),
+            ("body_text", "body_search"))
+        field = QuillField(text_field="missing")
+        field.set_attributes_from_name("other")
+        field.model = QuillDocument
+        self.assertEqual([error.id for error in field.check()], ["quill_editor.E001"])
+
+    def test_backfill_command(self):
+        for i in range(5):
+            QuillDocument.objects.create(title=str(i), body=f"<p>{i}</p>")
+        QuillDocument.objects.update(body_text="")
+        out = StringIO()
+        call_command("backfill_quill_text", chunk_size=2, stdout=out)
+        self.assertIn("quill_editor.QuillDocument: 5 rows", out.getvalue())
+        self.assertEqual(sorted(QuillDocument.objects.values_list("body_text", flat=True)),
+            ["0", "1", "2", "3", "4"])
+        with self.assertRaises(CommandError):
+            call_command("backfill_quill_text", "auth", stdout=StringIO())
+
+    def test_backfill_edited_meanwhile(self):
+        docs = [QuillDocument.objects.create(title=str(i), body=f"<p>{i}</p>") for i in range(3)]
+        QuillDocument.objects.update(body_text="")
+        update_companions = resanitize.update_companions
+
+        def edit_then_update(model, fields, objs, dbname):
+            # saved by a user after the read, with its own text
+            doc = QuillDocument.objects.get(pk=docs[1].pk)
+            doc.body = "<p>edited</p>"
+            doc.save()
+            return update_companions(model, fields, objs, dbname)
+
+        with mock.patch.object(resanitize, "update_companions", side_effect=edit_then_update):
+            result = resanitize.backfill(QuillDocument, ["body"])
+        self.assertEqual((result["rows"], result["skipped"]), (3, 1))
+        texts = QuillDocument.objects.order_by("pk").values_list("body_text", flat=True)
+        self.assertEqual(list(texts), ["0", "edited", "2"])
+
+    def test_delta_storage(self):
+        doc = QuillDocument.objects.create(
+            title="d", notes='{"ops":[{"insert":"a"},{"insert":"\\n","attributes":{"blockquote":true}}]}')
+        self.assertEqual(doc.get_notes_html(), "<blockquote>a</blockquote>")
+        self.assertEqual(doc.get_body_html(), "")
+        field = QuillDocument._meta.get_field("notes")
+        self.assertTrue(field.formfield().delta)
+        self.assertEqual(field.deconstruct()[3]["storage"], "delta")
+        with self.assertRaises(ValueError):
+            QuillField(storage="markdown")
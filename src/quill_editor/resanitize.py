@@ -0,0 +1,271 @@
+"""
+date: 2026-10-19
+
+Nettoyage à nouveau du contenu déjà enregistré des QuillField (commande
+resanitize_quill), après un durcissement des listes autorisées de
+quill_editor.sanitize : les anciennes lignes ne passent plus par un formulaire.
+
+Les lignes de chaque modèle sont lues par paquets de QUILL_RESANITIZE_CHUNK_SIZE,
+dans l'ordre des clés primaires (pagination par clé : pk > dernière lue) et
+avec les seuls champs Quill (.only). Le nettoyage est fait par un groupe de
+processus pendant que les paquets suivants sont lus ; seules les lignes dont le
+contenu change sont réécrites, un paquet par transaction (les Delta des champs
+storage=DELTA sont normalisés, voir quill_editor.delta). Un traitement
+interrompu reprend après la dernière clé écrite (after).
+
+Une ligne n'est réécrite que si ses champs Quill ont encore les valeurs lues
+(compare-and-set : UPDATE ... WHERE pk = ... AND champ = valeur lue) : une
+ligne enregistrée entre la lecture et l'écriture, déjà nettoyée par le
+formulaire, garde sa nouvelle valeur et est comptée dans skipped.
+
+Les champs compagnons des QuillField (text_field, search_field) des lignes
+réécrites sont mis à jour avec elles ; backfill les remplit pour toutes les
+lignes (commande backfill_quill_text).
+"""
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import router, transaction
+
+from . import delta as quill_delta
+from .fields import DELTA, QuillField
+from .sanitize import clean_quill_html
+
+
+def get_chunk_size() -> int:
+    return getattr(settings, "QUILL_RESANITIZE_CHUNK_SIZE", 500)
+
+
+def get_quill_fields(labels: list[str]|None=None) -> list[tuple]:
+    """
+    Modèles concrets ayant des QuillField, avec les noms de ces champs :
+    tous, ou ceux de labels ("app" ou "app.Modele").
+    """
+    if labels:
+        models = []
+        for label in labels:
+            try:
+                if "." in label:
+                    models.append(apps.get_model(label))
+                else:
+                    models.extend(apps.get_app_config(label).get_models())
+            except LookupError as e:
+                raise ValueError(str(e)) from e
+    else:
+        models = apps.get_models()
+    found = []
+    for model in models:
+        opts = model._meta
+        if opts.proxy or not opts.managed:
+            continue
+        fields = [field.name for field in opts.concrete_fields if isinstance(field, QuillField)]
+        if fields and (model, fields) not in found:
+            found.append((model, fields))
+    if labels and not found:
+        raise ValueError(f"No QuillField in {', '.join(labels)}")
+    return found
+
+
+def get_companion_fields(labels: list[str]|None=None) -> list[tuple]:
+    """
+    Comme get_quill_fields, pour les QuillField ayant des champs compagnons.
+    """
+    found = []
+    for model, fields in get_quill_fields(labels):
+        fields = [name for name in fields if model._meta.get_field(name).companions]
+        if fields:
+            found.append((model, fields))
+    if labels and not found:
+        raise ValueError(f"No QuillField with text_field or search_field in {', '.join(labels)}")
+    return found
+
+
+def iter_chunks(model, fields: list[str], dbname: str, after=None, chunk_size: int|None=None):
+    """
+    Objets de model par paquets, dans l'ordre des clés, après after ; seuls
+    les champs fields sont lus.
+    """
+    chunk_size = chunk_size or get_chunk_size()
+    queryset = model._base_manager.using(dbname).only(*fields).order_by("pk")
+    while True:
+        page = queryset if after is None else queryset.filter(pk__gt=after)
+        objs = list(page[:chunk_size])
+        if not objs:
+            return
+        after = objs[-1].pk
+        yield objs
+
+
+def update_companions(model, fields: list[str], objs: list, dbname: str) -> list[str]:
+    """
+    Remplit les champs compagnons des QuillField fields de objs ; renvoie les
+    noms des champs modifiés.
+    """
+    quill_fields = [model._meta.get_field(name) for name in fields]
+    updated = []
+    for obj in objs:
+        for field in quill_fields:
+            for name in field.update_companions(obj, dbname):
+                if name not in updated:
+                    updated.append(name)
+    return updated
+
+
+def backfill(model, fields: list[str], after=None, dbname: str|None=None,
+        chunk_size: int|None=None, progress=None) -> dict:
+    """
+    Remplit les champs compagnons des QuillField fields de toutes les lignes
+    de model (après la clé after), un paquet par transaction. Comme pour
+    Resanitizer, une ligne n'est écrite que si ses champs Quill ont encore les
+    valeurs lues : une ligne enregistrée entre-temps a déjà ses compagnons à
+    jour (skipped).
+    """
+    dbname = dbname or router.db_for_write(model)
+    manager = model._base_manager.using(dbname)
+    label = model._meta.label
+    start = time.monotonic()
+    result = {"model": label, "rows": 0, "skipped": 0, "last_pk": after}
+    for objs in iter_chunks(model, fields, dbname, after, chunk_size):
+        updated = update_companions(model, fields, objs, dbname)
+        if updated:
+            with transaction.atomic(using=dbname):
+                for obj in objs:
+                    read = {name: getattr(obj, name) for name in fields}
+                    if not manager.filter(pk=obj.pk, **read).update(
+                            **{name: getattr(obj, name) for name in updated}):
+                        result["skipped"] += 1
+        result["rows"] += len(objs)
+        result["last_pk"] = objs[-1].pk
+        if progress is not None:
+            progress(label, result["last_pk"], result["rows"], result["rows"])
+    result["duration"] = time.monotonic() - start
+    return result
+
+
+def clean_value(value: str, delta: bool=False) -> str:
+    """
+    Contenu nettoyé : HTML, ou Delta normalisé (champ storage=DELTA, dont les
+    lignes HTML d'avant le passage au Delta restent du HTML). Le contenu
+    enregistré n'est pas soumis à QUILL_SANITIZE_LIMITS.
+    """
+    if delta and value:
+        stored = quill_delta.loads_stored(value)
+        if stored is not None:
+            return quill_delta.dumps(quill_delta.normalize_delta(stored))
+    return clean_quill_html(value, limits=False)
+
+
+def clean_rows(rows: list[tuple], deltas: list[bool]|None=None) -> list[tuple]:
+    """
+    rows : (pk, valeurs des champs) ; renvoie les lignes modifiées par le
+    nettoyage, avec leurs nouvelles valeurs. deltas indique les champs
+    storage=DELTA. Appelée dans un processus du groupe : aucun accès à la base.
+    """
+    changed = []
+    for pk, values in rows:
+        cleaned = [clean_value(value, delta)
+            for value, delta in zip(values, deltas or [False] * len(values))]
+        if cleaned != values:
+            changed.append((pk, cleaned))
+    return changed
+
+
+def _split(rows: list, parts: int) -> list[list]:
+    size = -(-len(rows) // parts)
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+class Resanitizer():
+    """
+    Nettoie les QuillField d'un modèle :
+
+        with Resanitizer(workers=4) as resanitizer:
+            for model, fields in get_quill_fields():
+                result = resanitizer.run(model, fields)
+
+    run renvoie le nombre de lignes lues, modifiées et laissées car modifiées
+    entre-temps (skipped), la durée et la dernière clé traitée. progress(model, last_pk, rows, changed) est appelée après
+    l'écriture de chaque paquet.
+    """
+
+    def __init__(self, workers: int=4, chunk_size: int|None=None, dry_run: bool=False,
+            progress=None):
+        self.workers = max(workers or 1, 1)
+        self.chunk_size = chunk_size or get_chunk_size()
+        self.dry_run = dry_run
+        self.progress = progress
+        self.pool = None
+
+    def __enter__(self):
+        if self.workers > 1:
+            # children only clean strings, they never touch the connections
+            context = multiprocessing.get_context("fork")
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=context)
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def submit(self, model, objs: list, fields: list[str]) -> list:
+        rows = [(obj.pk, [getattr(obj, name) for name in fields]) for obj in objs]
+        deltas = [model._meta.get_field(name).storage == DELTA for name in fields]
+        if self.pool is None:
+            return [clean_rows(rows, deltas)]
+        return [self.pool.submit(clean_rows, part, deltas) for part in _split(rows, self.workers)]
+
+    def write(self, model, fields: list[str], dbname: str, objs: list, changed: list) -> int:
+        """
+        Réécrit les lignes changed encore telles qu'elles ont été lues dans objs
+        et renvoie leur nombre.
+        """
+        if not changed or self.dry_run:
+            return len(changed)
+        by_pk = {obj.pk: obj for obj in objs}
+        manager = model._base_manager.using(dbname)
+        written = 0
+        with transaction.atomic(using=dbname):
+            for pk, values in changed:
+                obj = by_pk[pk]
+                read = {name: getattr(obj, name) for name in fields}
+                for name, value in zip(fields, values):
+                    setattr(obj, name, value)
+                # as a save: the companion fields follow the content
+                companions = update_companions(model, fields, [obj], dbname)
+                written += manager.filter(pk=pk, **read).update(
+                    **{name: getattr(obj, name) for name in fields + companions})
+        return written
+
+    def run(self, model, fields: list[str], after=None, dbname: str|None=None) -> dict:
+        dbname = dbname or router.db_for_write(model)
+        label = model._meta.label
+        start = time.monotonic()
+        result = {"model": label, "rows": 0, "changed": 0, "skipped": 0, "last_pk": after}
+        # chunks being cleaned while the next ones are read (in pk order)
+        pending = deque()
+
+        def finish():
+            objs, futures = pending.popleft()
+            changed = [row for future in futures
+                for row in (future if self.pool is None else future.result())]
+            written = self.write(model, fields, dbname, objs, changed)
+            result["rows"] += len(objs)
+            result["changed"] += written
+            result["skipped"] += len(changed) - written
+            result["last_pk"] = objs[-1].pk
+            if self.progress is not None:
+                self.progress(label, result["last_pk"], result["rows"], result["changed"])
+
+        for objs in iter_chunks(model, fields, dbname, after, self.chunk_size):
+            pending.append((objs, self.submit(model, objs, fields)))
+            if len(pending) > 2:
+                finish()
+        while pending:
+            finish()
+        result["duration"] = time.monotonic() - start
+        return result
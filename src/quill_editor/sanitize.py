@@ -11,18 +11,44 @@ Strategy:
     ``data-value`` (in the editor automatically, on read-only pages via a small
     render pass). This keeps the allowlist minimal and avoids whitelisting
     MathML + inline styles.
- 2. Allowlist-sanitize the rest with bleach (drops scripts, event handlers,
-    dangerous protocols, and any tag/attribute not needed by the "default"
-    Quill config).
+ 2. Allowlist-sanitize the rest (drops scripts, event handlers, dangerous
+    protocols, and any tag/attribute not needed by the "default" Quill config).
+    Disallowed tags are stripped, their text is kept.
+
+Both steps happen in a single pass: the lxml parser calls a target
+(_Sanitizer) for each tag and text, without building a tree, and the output is
+serialized by the target itself, from the allowlists only (no markup of the
+input is ever copied verbatim).
+
+The cost of a parse is bounded (QUILL_SANITIZE_LIMITS): input bytes are
+checked before parsing, element count and nesting depth while parsing, which
+stops at the first violation. SanitizeLimitError is a ValueError; the form
+field turns it into a ValidationError.
 
 This runs only on QuillField content (via QuillFormField.clean). It never
 touches other HTML on the site (e.g. separately stored pre-rendered KaTeX).
 
+Cleaning is deterministic, so results are cached (SanitizeCache) by hash of the
+input and of the allowlists: unchanged content is not parsed again on every
+save of a form.
+
 Allowlist is derived from QUILL_CONFIGS["default"]: bold, italic, underline,
 blockquote, link, code-block (+highlight.js) and formula.
 """
-import bleach
-from bs4 import BeautifulSoup
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import lxml.html
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
 
 ALLOWED_TAGS = [
     "p", "br",
@@ -44,27 +70,429 @@ ALLOWED_ATTRIBUTES = {
 
 ALLOWED_PROTOCOLS = ["http", "https", "mailto"]
 
+# attributes holding an URL, checked against ALLOWED_PROTOCOLS
+URI_ATTRIBUTES = {"href", "src"}
+VOID_TAGS = {"br"}
+# block tags are only kept at the top level or inside these (Quill never nests
+# them otherwise, and an HTML parser would close the enclosing <p> or inline
+# tag: the output would change when cleaned again)
+BLOCK_TAGS = {"p", "div", "pre", "blockquote"}
+BLOCK_CONTAINERS = {"div", "blockquote"}
+
+# characters fed to the parser at once: a violation stops it within a chunk
+FEED_SIZE = 64 * 1024
+
+# no limit with None; libxml2 itself stops at a depth of 256
+DEFAULT_LIMITS = {"max_bytes": 2 * 1024 * 1024, "max_elements": 50_000, "max_depth": 64}
+
+# characters libxml2 refuses (NUL, C0 controls except tab/newline/CR)
+_INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+# ignored by browsers inside an URL ("java\tscript:" is "javascript:")
+_URL_IGNORED = re.compile("[\x00-\x20\x7f-\xa0\\s]+")
+
+
+def _escape(text: str|None) -> str:
+    if not text:
+        return ""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _escape_attribute(value: str) -> str:
+    return _escape(value).replace('"', "&quot;")
+
+
+def is_allowed_url(value: str) -> bool:
+    """
+    Relative URLs, fragments and URLs with an allowed scheme.
+    """
+    normalized = _URL_IGNORED.sub("", value).lower()
+    try:
+        scheme = urlsplit(normalized).scheme
+    except ValueError:
+        return False
+    if scheme:
+        return scheme in ALLOWED_PROTOCOLS
+    if ":" in normalized.split("/", 1)[0]:
+        # "mailto:x" with an unusual syntax, or "localhost:8000"
+        return normalized.split(":", 1)[0] in ALLOWED_PROTOCOLS
+    return True
+
+
+def _start_tag(tag: str, attrib: dict) -> str:
+    allowed = ALLOWED_ATTRIBUTES.get(tag, ())
+    attributes = "".join(
+        f' {name}="{_escape_attribute(value)}"'
+        for name, value in attrib.items()
+        if name in allowed and (name not in URI_ATTRIBUTES or is_allowed_url(value)))
+    return f"<{tag}{attributes}>"
+
+
+def _is_kept(tag: str, inline_opened: int, in_link: bool) -> bool:
+    """
+    2. Allowlist, and nesting that parses back to the same tree.
+
+    inline_opened: written tags still open that are not BLOCK_CONTAINERS.
+    """
+    if tag not in ALLOWED_TAGS:
+        return False
+    if tag in BLOCK_TAGS:
+        return not inline_opened
+    if tag == "a":
+        return not in_link
+    return True
+
+
+def _is_formula(tag: str, attrib: dict) -> bool:
+    return tag == "span" and "ql-formula" in (attrib.get("class") or "").split()
+
+
+class SanitizeLimitError(ValueError):
+    """
+    Content beyond QUILL_SANITIZE_LIMITS; code is the exceeded limit.
+    """
+
+    def __init__(self, message: str, code: str):
+        super().__init__(message)
+        self.code = code
+
+
+def get_limits() -> dict:
+    limits = dict(DEFAULT_LIMITS)
+    configured = getattr(settings, "QUILL_SANITIZE_LIMITS", None) or {}
+    unknown = set(configured) - set(DEFAULT_LIMITS)
+    if unknown:
+        raise ImproperlyConfigured(
+            f"Unknown QUILL_SANITIZE_LIMITS keys: {', '.join(sorted(unknown))}")
+    limits.update(configured)
+    return limits
+
+
+def check_size(html: str, limits: dict|None):
+    """
+    Input bytes (UTF-8), checked before any work on html.
+    """
+    max_bytes = limits and limits["max_bytes"]
+    if max_bytes is None or len(html) * 4 <= max_bytes:
+        return
+    if len(html) > max_bytes or len(html.encode("utf-8", "surrogatepass")) > max_bytes:
+        raise SanitizeLimitError(
+            f"Content too large (more than {max_bytes} bytes)", "max_bytes")
+
+
+_DOCUMENT_TAGS = frozenset(("html", "head", "body"))
+
+
+class _Sanitizer():
+    """
+    Target of the lxml parser: writes the clean HTML, and the plain text if
+    text is a list, as the parser goes.
+    """
+
+    def __init__(self, limits: dict|None=None, text: list[str]|None=None):
+        self.out = []
+        self.text = text
+        # every open element under <body>: (tag, kept)
+        self.stack = []
+        # tags written and still open: not BLOCK_CONTAINERS, <a>
+        self.inline_opened = 0
+        self.links = 0
+        # depth inside a formula, whose content is dropped
+        self.skip = 0
+        self.in_body = False
+        self.elements = 0
+        self.max_elements = limits and limits["max_elements"]
+        self.max_depth = limits and limits["max_depth"]
+
+    def _count(self, tag: str, opened: int):
+        if tag not in BLOCK_CONTAINERS:
+            self.inline_opened += opened
+        if tag == "a":
+            self.links += opened
+
+    def start(self, tag, attrib):
+        if not self.in_body:
+            self.in_body = tag == "body"
+            return
+        if not self.stack and tag in _DOCUMENT_TAGS:
+            # stray <html>, <body> after a stray end tag: still the same body
+            return
+        self.elements += 1
+        if self.max_elements is not None and self.elements > self.max_elements:
+            raise SanitizeLimitError(
+                f"Too many elements (more than {self.max_elements})", "max_elements")
+        if self.max_depth is not None and len(self.stack) >= self.max_depth:
+            raise SanitizeLimitError(
+                f"Elements nested too deeply (more than {self.max_depth})", "max_depth")
+        if self.skip:
+            self.skip += 1
+            self.stack.append((tag, False))
+            return
+        kept = _is_kept(tag, self.inline_opened, self.links > 0)
+        if kept:
+            self.out.append(_start_tag(tag, attrib))
+            if tag not in VOID_TAGS:
+                self._count(tag, 1)
+        self.stack.append((tag, kept and tag not in VOID_TAGS))
+        if _is_formula(tag, attrib):
+            # 1. formula reduced to its source (data-value)
+            self.skip = 1
+            if self.text is not None:
+                self.text.append(attrib.get("data-value") or "")
+
+    def end(self, tag):
+        if not self.stack:
+            # </body>, </html>: stray ones anywhere in the content, or the
+            # end of the document, after which nothing comes
+            return
+        tag, kept = self.stack.pop()
+        if self.skip:
+            self.skip -= 1
+            if self.skip:
+                return
+        if kept:
+            self._count(tag, -1)
+            self.out.append(f"</{tag}>")
+        if self.text is not None and (tag in BLOCK_TAGS or tag in VOID_TAGS):
+            self.text.append("\n")
+
+    def data(self, data):
+        if self.in_body and not self.skip:
+            self.out.append(_escape(data))
+            if self.text is not None:
+                self.text.append(data)
+
+    def close(self) -> str:
+        return "".join(self.out)
+
 
-def clean_quill_html(html: str) -> str:
+def _walk(html: str, text: list[str]|None=None, limits: dict|None=None) -> str:
+    """
+    Clean HTML of html; its plain text is appended to text if given.
+    """
+    check_size(html, limits)
+    html = _INVALID_CHARS.sub("", html)
+    sanitizer = _Sanitizer(limits, text)
+    parser = lxml.html.HTMLParser(target=sanitizer)
+    # explicit document: a fragment starting with <html> must stay a fragment
+    # (no closing tags: they would end up in the text of an unclosed <textarea>)
+    parser.feed("<html><body>")
+    for i in range(0, len(html), FEED_SIZE):
+        parser.feed(html[i:i + FEED_SIZE])
+    return parser.close()
+
+
+def clean_quill_html(html: str, limits: dict|bool=True) -> str:
     """
     Sanitize Quill 2.x HTML for safe storage/display.
 
-    Idempotent: re-cleaning already-clean content is a no-op.
+    Idempotent: re-cleaning already-clean content is a no-op. limits: True
+    for QUILL_SANITIZE_LIMITS, False for none (stored content), or a dict
+    like DEFAULT_LIMITS; raises SanitizeLimitError beyond them.
     """
     if not html:
         return html
-    # 1. Reduce formulas to their source. ``clear()`` removes the rendered
-    # KaTeX children while keeping the tag and its data-value attribute.
-    soup = BeautifulSoup(html, "html.parser")  # fragment parser, no html/body wrapper
-    for formula in soup.select("span.ql-formula"):
-        formula.clear()
-    html = str(soup)
-
-    # 2. Allowlist sanitize.
-    return bleach.clean(
-        html,
-        tags=ALLOWED_TAGS,
-        attributes=ALLOWED_ATTRIBUTES,
-        protocols=ALLOWED_PROTOCOLS,
-        strip=True,
-    )
\ No newline at end of file
+    if limits is True:
+        limits = get_limits()
+    return _walk(html, limits=limits or None)
+
+
+_BLANK_LINES = re.compile(r"[ \t]*\n\s*")
+
+
+def extract_text(html: str|None) -> str:
+    """
+    Plain text of Quill HTML, by the walk of clean_quill_html: what the page
+    displays, one line per block, formulas as their LaTeX source.
+    """
+    if not html:
+        return ""
+    text = []
+    # stored content, accepted within the limits of its time
+    _walk(html, text)
+    return _BLANK_LINES.sub("\n", "".join(text)).strip()
+
+
+FORMULA = "formula"
+CODE = "code"
+# markers in the output of clean_quill_html (its own serialization: attribute
+# values in double quotes, in input order), found without parsing
+_FEATURES = {
+    FORMULA: re.compile(r'<span class="(?:[^"]* )?ql-formula[ "]'),
+    CODE: re.compile(r'<pre[ >]|<div class="(?:[^"]* )?ql-code-block[ "-]'),
+}
+
+
+def get_features(html: str|None) -> frozenset[str]:
+    """
+    Embeds (FORMULA, CODE) of cleaned content, to load only the scripts it
+    needs.
+    """
+    if not html:
+        return frozenset()
+    return frozenset(name for name, marker in _FEATURES.items() if marker.search(html))
+
+
+# bump when the output of clean_quill_html changes for the same allowlists
+SANITIZER_VERSION = 2
+
+
+def get_allowlist_version() -> str:
+    """
+    Version of the sanitizer and of its allowlists: cached results of another
+    version are ignored.
+    """
+    allowlists = json.dumps(
+        [SANITIZER_VERSION, ALLOWED_TAGS, ALLOWED_ATTRIBUTES, ALLOWED_PROTOCOLS],
+        sort_keys=True)
+    return hashlib.sha256(allowlists.encode()).hexdigest()[:16]
+
+
+class SanitizeCache():
+    """
+    Results of clean_quill_html, by hash of the input and allowlist version.
+
+    An in-process LRU of QUILL_SANITIZE_CACHE_SIZE entries (0 disables it)
+    and at most QUILL_SANITIZE_CACHE_BYTES characters of keys and results
+    (larger results are not kept in process), backed by the Django cache
+    QUILL_SANITIZE_CACHE (alias, None by default) shared by the server
+    processes. Cleaned content is also stored as its own
+    result (clean_quill_html is idempotent): content saved again as is hits
+    the cache.
+
+    hits (in-process), shared_hits and misses count the lookups, see info().
+    Subclasses cache another function of the content (transform).
+    """
+    PREFIX = "quill-sanitize"
+    # the output of transform is its own result
+    IDEMPOTENT = True
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        # characters of the keys and values of _entries
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_maxsize() -> int:
+        return getattr(settings, "QUILL_SANITIZE_CACHE_SIZE", 1024)
+
+    @staticmethod
+    def get_maxbytes() -> int:
+        return getattr(settings, "QUILL_SANITIZE_CACHE_BYTES", 16 * 1024 * 1024)
+
+    @staticmethod
+    def get_shared_cache():
+        alias = getattr(settings, "QUILL_SANITIZE_CACHE", None)
+        return caches[alias] if alias else None
+
+    def check(self, html: str):
+        """
+        Called before the content is hashed.
+        """
+        check_size(html, get_limits())
+
+    def transform(self, html: str) -> str:
+        return clean_quill_html(html)
+
+    def get_version(self) -> str:
+        # content rejected by tighter limits must not be a hit
+        limits = json.dumps(get_limits(), sort_keys=True)
+        return f"{get_allowlist_version()}.{hashlib.sha256(limits.encode()).hexdigest()[:8]}"
+
+    def get_key(self, html: str, version: str) -> str:
+        digest = hashlib.sha256(html.encode("utf-8", "surrogatepass")).hexdigest()
+        return f"{self.PREFIX}:{version}:{digest}"
+
+    def _remember(self, items: dict[str, str]):
+        maxsize = self.get_maxsize()
+        maxbytes = self.get_maxbytes()
+        if maxsize <= 0 or maxbytes <= 0:
+            return
+        with self._lock:
+            for key, value in items.items():
+                size = len(key) + len(value)
+                if size > maxbytes:
+                    continue
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._bytes -= len(key) + len(old)
+                self._entries[key] = value
+                self._bytes += size
+            while len(self._entries) > maxsize or self._bytes > maxbytes:
+                key, value = self._entries.popitem(last=False)
+                self._bytes -= len(key) + len(value)
+
+    def clean(self, html: str) -> str:
+        if not html:
+            return html
+        self.check(html)
+        version = self.get_version()
+        key = self.get_key(html, version)
+        with self._lock:
+            cleaned = self._entries.get(key)
+            if cleaned is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cleaned
+        shared = self.get_shared_cache()
+        if shared is not None:
+            try:
+                cleaned = shared.get(key)
+            except Exception:
+                # an unavailable cache must not prevent saving
+                logger.warning("Sanitize cache unavailable", exc_info=True)
+                shared = None
+            if cleaned is not None:
+                with self._lock:
+                    self.shared_hits += 1
+                self._remember({key: cleaned})
+                return cleaned
+        with self._lock:
+            self.misses += 1
+        cleaned = self.transform(html)
+        items = {key: cleaned}
+        if self.IDEMPOTENT:
+            items[self.get_key(cleaned, version)] = cleaned
+        self._remember(items)
+        if shared is not None:
+            try:
+                shared.set_many(
+                    items, getattr(settings, "QUILL_SANITIZE_CACHE_TIMEOUT", 7 * 24 * 3600))
+            except Exception:
+                logger.warning("Sanitize cache unavailable", exc_info=True)
+        return cleaned
+
+    def clear(self):
+        """
+        Empties the in-process LRU and resets the counters (the shared cache
+        expires on its own, or with a new allowlist version).
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.shared_hits = self.misses = 0
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.get_maxsize(),
+                "bytes": self._bytes,
+                "maxbytes": self.get_maxbytes(),
+            }
+
+
+sanitize_cache = SanitizeCache()
+
+
+def cached_clean_quill_html(html: str) -> str:
+    """
+    clean_quill_html, through sanitize_cache.
+    """
+    return sanitize_cache.clean(html)
@@ -0,0 +1,38 @@
+"""
+date: 2026-10-19
+
+View mixin loading the Quill, MathJax and highlight.js assets only for the
+content actually displayed.
+"""
+from .sanitize import CODE, FORMULA, get_features
+
+
+class QuillContentMixin():
+    """
+    To put before AssetsMixin (utils.views.mixins): needs_latex and
+    needs_quill are kept only for content with formulas or for non-empty
+    content, and highlight_stylesheet is set for code blocks.
+    """
+
+    def get_quill_content(self):
+        """
+        Quill content (HTML stored by a QuillField) displayed by the page, or
+        None (default): needs_latex and needs_quill then apply as is.
+        """
+        return None
+
+    def get_content_flags(self) -> dict:
+        flags = super().get_content_flags()
+        content = self.get_quill_content()
+        if content is None:
+            return flags
+        content = [html for html in content if html]
+        features = set()
+        for html in content:
+            features |= get_features(html)
+        return dict(
+            flags,
+            needs_latex=flags["needs_latex"] and FORMULA in features,
+            needs_quill=flags["needs_quill"] and bool(content),
+            highlight_stylesheet=CODE in features,
+        )
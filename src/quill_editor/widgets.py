@@ -1,16 +1,25 @@
+import copy
+import threading
 from collections.abc import Mapping
+from types import MappingProxyType
 
 from django import forms
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
 from django.forms.renderers import get_default_renderer
 from django.forms.utils import flatatt
+from django.utils.html import json_script
 from django.utils.encoding import force_str
 from django.utils.functional import Promise
 from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 
-from .config import DEFAULT_CONFIG, MEDIA_JS, MEDIA_CSS
+from .config import (
+    DEFAULT_CONFIG, HIGHLIGHT_CSS, HIGHLIGHT_JS, MATHJAX_JS, QUILL_CSS, QUILL_JS)
+from . import delta as quill_delta
+from .sanitize import FORMULA, clean_quill_html, get_features
 
 class LazyEncoder(DjangoJSONEncoder):
     def default(self, obj):
@@ -21,34 +30,133 @@ class LazyEncoder(DjangoJSONEncoder):
 
 json_encode = LazyEncoder().encode
 
-class QuillWidget(forms.Textarea):
-    class Media:
-        js = MEDIA_JS
-        css = {"all": MEDIA_CSS}
+def _toolbar_items(toolbar) -> set:
+    """
+    Formats of a toolbar option: nested lists of names or {name: value}
+    dicts, possibly under "container".
+    """
+    if isinstance(toolbar, str):
+        return {toolbar}
+    if isinstance(toolbar, Mapping):
+        if "container" in toolbar:
+            return _toolbar_items(toolbar["container"])
+        return set(toolbar)
+    items = set()
+    if isinstance(toolbar, (list, tuple)):
+        for item in toolbar:
+            items |= _toolbar_items(item)
+    return items
 
-    def __init__(self, config_name="default", *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.config = DEFAULT_CONFIG.copy()
+
+class QuillConfig():
+    """
+    A QUILL_CONFIGS entry merged over DEFAULT_CONFIG, read-only and shared by
+    the widgets using it, with its media and its JSON (encoded once per
+    language: lazy strings are translated when encoded).
+    """
+
+    def __init__(self, name: str, config: Mapping):
+        self.name = name
+        self._config = copy.deepcopy(dict(config))
+        self.config = MappingProxyType(self._config)
+        modules = self.config.get("modules") or {}
+        self.has_syntax = bool(modules.get("syntax"))
+        # formulas can be inserted: MathJax is needed, whatever the content
+        self.has_formula = "formula" in _toolbar_items(modules.get("toolbar"))
+        js = []
+        css = list(QUILL_CSS)
+        if self.has_syntax:
+            js.append(HIGHLIGHT_JS)
+            css.append(HIGHLIGHT_CSS)
+        js.extend(QUILL_JS)
+        self.media = forms.Media(
+            js=[forms.Script(src, defer=True) for src in js], css={"all": css})
+        self._encoded = {}
+
+    def encode(self) -> str:
+        language = get_language()
+        encoded = self._encoded.get(language)
+        if encoded is None:
+            encoded = self._encoded[language] = json_encode(self._config)
+        return encoded
+
+
+class QuillConfigRegistry():
+    """
+    QuillConfig by name, built on first use and dropped when QUILL_CONFIGS
+    changes (setting_changed).
+    """
+
+    def __init__(self):
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._configs = {}
+
+    def get(self, name: str="default") -> QuillConfig:
+        config = self._configs.get(name)
+        if config is None:
+            config = QuillConfig(name, self.get_merged(name))
+            with self._lock:
+                config = self._configs.setdefault(name, config)
+        return config
+
+    def get_merged(self, name: str) -> dict:
+        merged = DEFAULT_CONFIG.copy()
         configs = getattr(settings, "QUILL_CONFIGS", None)
         if configs:
             if isinstance(configs, Mapping):
-                if config_name in configs:
-                    config = configs[config_name]
+                if name in configs:
+                    config = configs[name]
                     if not isinstance(config, Mapping):
                         raise ImproperlyConfigured(
                             'QUILL_CONFIGS["%s"] setting must be a Mapping object'
-                            % config_name
+                            % name
                         )
-                    self.config.update(config)
+                    merged.update(config)
                 else:
                     raise ImproperlyConfigured(
                         'No configuration named "%s" found in your QUILL_CONFIGS'
-                        % config_name
+                        % name
                     )
             else:
                 raise ImproperlyConfigured(
                     "QUILL_CONFIGS settings must be a Mapping object"
                 )
+        return merged
+
+
+quill_configs = QuillConfigRegistry()
+
+
+def _reset_configs(setting, **kwargs):
+    if setting == "QUILL_CONFIGS":
+        quill_configs.clear()
+
+
+setting_changed.connect(_reset_configs, dispatch_uid="quill_editor.widgets.reset_configs")
+
+
+class QuillWidget(forms.Textarea):
+
+    def __init__(self, config_name="default", *args, delta=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the value is a Delta (QuillField(storage="delta")), not HTML
+        self.delta = delta
+        # raises ImproperlyConfigured on a bad QUILL_CONFIGS
+        self.quill_config = quill_configs.get(config_name)
+        self.config = self.quill_config.config
+
+    @property
+    def media(self):
+        """
+        Scripts of the engines used by the configuration, deferred (run in
+        order, before DOMContentLoaded). MathJax is left to render, which loads
+        it once per page for a toolbar or a value with formulas.
+        """
+        return self.quill_config.media
 
     def render(self, name, value, attrs=None, renderer=None):
         if renderer is None:
@@ -60,15 +168,31 @@ class QuillWidget(forms.Textarea):
         attrs["name"] = name
         attrs["value"] = value
         final_attrs = self.build_attrs(self.attrs, attrs)
-        return mark_safe(
-            renderer.render(
-                "quill_editor/widget.html",
-                {
-                    "final_attrs": flatatt(final_attrs),
-                    "id": final_attrs["id"],
-                    "name": final_attrs["name"],
-                    "config": json_encode(self.config),
-                    "value": final_attrs.get("value", None),
-                },
-            )
-        )
\ No newline at end of file
+        context = {
+            "final_attrs": flatatt(final_attrs),
+            "id": final_attrs["id"],
+            "name": final_attrs["name"],
+            "config": self.quill_config.encode(),
+            "value": final_attrs.get("value", None),
+        }
+        html = value
+        context["delta_mode"] = self.delta
+        if self.delta:
+            try:
+                delta = quill_delta.loads_stored(value) if value else []
+            except ValueError:
+                delta = []
+            if delta is None:
+                # legacy HTML (see delta.loads_stored), saved back as a Delta by the editor
+                html = context["value"] = clean_quill_html(value, limits=False)
+            else:
+                try:
+                    delta = quill_delta.normalize_delta(delta)
+                except ValueError:
+                    # invalid data sent back with its error: start again
+                    delta = quill_delta.normalize_delta([])
+                context["delta"] = json_script(delta, f"quill-delta-{final_attrs['id']}")
+                html = quill_delta.cached_render_html(quill_delta.dumps(delta))
+        if self.quill_config.has_formula or FORMULA in get_features(html):
+            context["mathjax"] = MATHJAX_JS
+        return mark_safe(renderer.render("quill_editor/widget.html", context))
\ No newline at end of file
@@ -1,6 +1,7 @@
 from dev.test_utils import TestCase
 
 from utils import menu
+from utils.views.mixins import AssetsMixin
 
 class TestMenu(TestCase):
 
@@ -69,4 +70,15 @@ class TestMenu(TestCase):
         L.show("item1")
         self.assertEqual(list(L.visible), [item1])
         L.show("item2")
-        self.assertEqual(len(list(L.visible)), 2)
\ No newline at end of file
+        self.assertEqual(len(list(L.visible)), 2)
+
+
+
+class TestContentFlags(TestCase):
+
+    class View(AssetsMixin):
+        needs_latex = True
+
+    def test_flags(self):
+        self.assertEqual(self.View().get_content_flags(),
+            {"needs_latex": True, "needs_quill": False})
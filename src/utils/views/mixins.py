@@ -388,6 +388,14 @@ class AssetsMixin(MenuMixin):
     def get_page_description(self, ctx):
         return ""
 
+    def get_content_flags(self) -> dict:
+        """
+        Asset flags (needs_latex, needs_quill...) set in the context when true.
+        Override to derive them from the displayed content, see
+        quill_editor.views.QuillContentMixin.
+        """
+        return {"needs_latex": self.needs_latex, "needs_quill": self.needs_quill}
+
     def get_page_title(self, ctx):
         return self.PAGE_TITLE
 
@@ -404,10 +412,9 @@ class AssetsMixin(MenuMixin):
         if "all_menus" not in ctx:
             ctx["all_menus"] = self.get_all_menus(ctx)
         ctx["breadcrumb"] = self.get_breadcrumb(ctx)
-        if self.needs_latex:
-            ctx["needs_latex"] = True
-        if self.needs_quill:
-            ctx["needs_quill"] = True
+        for flag, needed in self.get_content_flags().items():
+            if needed:
+                ctx[flag] = True
         ctx["rich_results"] = self.rich_results(ctx)
         ctx["page_title"] = self.get_page_title(ctx)
         ctx["staff_actions"] = self.get_actions(ctx)